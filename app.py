@@ -1,23 +1,14 @@
-from typing import Tuple
-
 import streamlit as st
 import streamlit_authenticator as stauth
 import yaml
-from pokemontcgsdk import Card
 from streamlit_authenticator import LoginError, Hasher
-from streamlit_option_menu import option_menu
 from yaml import SafeLoader
 
-from components.card_shop import show_card_shop
-from components.card_viewer import view_cards
-from components.deck_manager import view_decks
-from utils.deck import Deck  # For type hinting
-from utils.pokemon_api import get_sets
-from utils.storage import load_cards_from_collection, load_decks_from_collection
+from utils.catalog import warm_up
 
 APP_TITLE = "Pokémon Card Manager"
-SECTION_NAMES = ["Card Shop", "Deck Manager", "Owned Cards"]
-SECTION_ICONS = ["plus-circle", "folder", "cards"]
+SECTION_NAMES = ["Card Shop", "Deck Manager", "Owned Cards", "Set Progress", "Meta"]
+SECTION_ICONS = ["plus-circle", "folder", "cards", "bar-chart-steps", "graph-up"]
 
 # Set the page to wide mode and define the title
 st.set_page_config(layout="wide", page_title=APP_TITLE, initial_sidebar_state="expanded")
@@ -51,6 +42,8 @@ def navbar() -> str:
     Returns:
         str: The name of the selected menu option.
     """
+    from streamlit_option_menu import option_menu
+
     st.markdown(
         """
         <style>
@@ -89,32 +82,53 @@ def sidebar(authenticator: stauth.Authenticate) -> None:
             st.button("Account", use_container_width=True)
         with col2:
             if st.button("Logout", use_container_width=True):
+                from utils.write_queue import get_write_queue
+                get_write_queue(st.session_state['name']).flush()
                 authenticator.authentication_controller.logout()
                 authenticator.cookie_controller.delete_cookie()
                 st.session_state.decks = None
                 st.session_state.cards = None
+                st.session_state.buildability = None
+                st.session_state.set_completion = None
                 st.session_state.view = "deck_manager"
                 st.session_state.show_new_deck_input = False
                 st.rerun()
 
+        from components.jobs import show_job_status
+        show_job_status()
+
 
-def load_collections(user: str) -> (dict[str, Tuple[Card, int]], dict[str, Deck]):
+def show_section(nav: str) -> None:
     """
-    Load card and deck collections for a user.
+    Render the selected section. Component modules are only imported when their tab is first selected,
+    so the login screen does not pay for them.
     Args:
-        user (str): Username for which to load collections.
-    Returns:
-        Tuple[list, list]: Loaded cards and decks.
+        nav (str): The name of the selected menu option.
     """
-    cards = load_cards_from_collection(user)
-    decks = load_decks_from_collection(user)
-    return cards, decks
+    if nav == SECTION_NAMES[0]:
+        from components.card_shop import show_card_shop
+        from utils.pokemon_api import get_sets
+        show_card_shop(get_sets())
+    elif nav == SECTION_NAMES[1]:
+        from components.deck_manager import view_decks
+        view_decks()
+    elif nav == SECTION_NAMES[2]:
+        from components.card_viewer import view_cards
+        view_cards()
+    elif nav == SECTION_NAMES[3]:
+        from components.set_progress import view_set_progress
+        view_set_progress()
+    elif nav == SECTION_NAMES[4]:
+        from components.meta import view_meta
+        view_meta()
 
 
 def main():
     """
     Main function to run the Streamlit app.
     """
+    # Load the set list and card catalog from the local snapshot while the user logs in
+    warm_up()
     config = load_config()
 
     authenticator = stauth.Authenticate(
@@ -130,9 +144,13 @@ def main():
         st.error(e)
 
     if st.session_state.get('authentication_status'):
-        # Lazy initialization of session state variables
-        if 'cards' not in st.session_state or 'decks' not in st.session_state:
-            st.session_state['cards'], st.session_state['decks'] = load_collections(st.session_state['name'])
+        from components.collection_state import load_collections, submit_new_thumbnails, sync_collections
+
+        # Lazy initialization of session state variables, then only the changes saved by other sessions
+        if st.session_state.get('cards') is None or st.session_state.get('decks') is None:
+            load_collections()
+        else:
+            sync_collections()
 
         if "show_new_deck_input" not in st.session_state:
             st.session_state.show_new_deck_input = False
@@ -142,13 +160,10 @@ def main():
 
         # Main app interface
         nav = navbar()
-        if nav == SECTION_NAMES[0]:
-            show_card_shop(get_sets())
-        elif nav == SECTION_NAMES[1]:
-            view_decks()
-        elif nav == SECTION_NAMES[2]:
-            view_cards()
+        show_section(nav)
         sidebar(authenticator)
+        # After the section, which may have added cards, e.g. a whole batch of the Card Shop
+        submit_new_thumbnails()
 
     elif st.session_state.get('authentication_status') is False:
         st.error("Username/password is incorrect")
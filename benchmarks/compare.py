@@ -0,0 +1,58 @@
+"""
+Compare two benchmark reports produced by `python -m benchmarks.run`.
+
+Usage:
+    python -m benchmarks.compare baseline.json candidate.json [--threshold 0.1]
+"""
+import argparse
+import json
+import sys
+from typing import Optional
+
+
+def compare(baseline: dict, candidate: dict, threshold: float) -> list[tuple[str, str, float, float, float]]:
+    """
+    Compare the median timings of two reports.
+
+    Args:
+        baseline (dict): The reference report.
+        candidate (dict): The report to check.
+        threshold (float): Relative slowdown above which a benchmark counts as a regression.
+
+    Returns:
+        list[tuple[str, str, float, float, float]]: (scale, benchmark, baseline, candidate, ratio) for every
+        benchmark present in both reports, regressions first.
+    """
+    rows = []
+    for scale, results in candidate["results"].items():
+        for name, stats in results.items():
+            reference = baseline["results"].get(scale, {}).get(name)
+            if reference is None:
+                continue
+            ratio = stats["median"] / reference["median"] if reference["median"] else float("inf")
+            rows.append((scale, name, reference["median"], stats["median"], ratio))
+    return sorted(rows, key=lambda row: (row[4] <= 1 + threshold, row[0], row[1]))
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative slowdown reported as regression")
+    args = parser.parse_args(argv)
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.candidate, encoding="utf-8") as f:
+        candidate = json.load(f)
+
+    regressions = 0
+    for scale, name, before, after, ratio in compare(baseline, candidate, args.threshold):
+        flag = "REGRESSION" if ratio > 1 + args.threshold else ""
+        regressions += bool(flag)
+        print(f"{scale:>8} {name:<45} {before * 1e3:12.3f}ms {after * 1e3:12.3f}ms {ratio:7.2f}x {flag}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
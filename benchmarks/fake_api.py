@@ -0,0 +1,304 @@
+import dataclasses
+import fnmatch
+import io
+import json
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional
+from urllib.parse import parse_qsl, urlsplit
+
+from pokemontcgsdk import Card, Set, RestClient, PokemonTcgException
+from pokemontcgsdk.config import __endpoint__
+
+DEFAULT_PAGE_SIZE = 250
+
+
+class FakeTcgApi:
+    """
+    In-memory stand-in for the Pokémon TCG REST API, serving a synthetic catalog through the same JSON
+    envelope the SDK expects. Only the query features used by this app are supported:
+    `field:value` terms with `*` wildcards, implicit AND, parenthesized `or` groups,
+    `orderBy`, `page` and `pageSize`.
+    """
+
+    def __init__(self, sets: List[Set], cards: Dict[str, Card], latency: float = 0.0) -> None:
+        """
+        :param sets:        The sets served by `/sets`.
+        :param cards:       Dictionary of card IDs to the cards served by `/cards`.
+        :param latency:     Seconds to sleep on every request, to mimic the network.
+        """
+        self.sets = sets
+        self.cards = cards
+        self.latency = latency
+        self.calls = 0
+        self._json: Dict[str, dict] = {}
+
+    def _card_json(self, card_id: str) -> dict:
+        if card_id not in self._json:
+            self._json[card_id] = dataclasses.asdict(self.cards[card_id])
+        return self._json[card_id]
+
+    def get(self, url: str, params: Optional[dict] = None) -> dict:
+        """
+        Answer a GET request the way `RestClient.get` would.
+
+        :param url:     The requested URL.
+        :param params:  The query parameters.
+        :return:        The decoded JSON response.
+        """
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        params = params or {}
+        path = url.replace(__endpoint__, "").strip("/").split("/")
+        resource, resource_id = path[0], path[1] if len(path) > 1 else None
+
+        if resource == "cards" and resource_id:
+            if resource_id not in self.cards:
+                raise PokemonTcgException(f"Card {resource_id} not found")
+            return {"data": self._card_json(resource_id)}
+        if resource == "sets" and resource_id:
+            matching = [s for s in self.sets if s.id == resource_id]
+            if not matching:
+                raise PokemonTcgException(f"Set {resource_id} not found")
+            return {"data": dataclasses.asdict(matching[0])}
+
+        if resource == "cards":
+            query = params.get("q", "")
+            ids = re.fullmatch(r"\(?\s*(id:\S+(\s+or\s+id:\S+)*)\s*\)?", query, re.IGNORECASE)
+            if ids:
+                # Batched lookups by ID are answered from the index rather than by scanning the catalog
+                card_ids = [term.split(":", 1)[1].rstrip(")") for term in ids.group(1).split() if ":" in term]
+                matches = [self.cards[card_id] for card_id in card_ids if card_id in self.cards]
+            else:
+                matches = [card for card in self.cards.values() if self.matches(card, query)]
+            for field in reversed(params.get("orderBy", "").split(",")):
+                if field:
+                    matches.sort(key=lambda card: self.field_value(card, field) or "")
+            items = [self._card_json(card.id) for card in matches]
+        elif resource == "sets":
+            items = [dataclasses.asdict(s) for s in self.sets]
+        else:
+            raise PokemonTcgException(f"Unknown resource {resource}")
+
+        page_size = int(params.get("pageSize", DEFAULT_PAGE_SIZE))
+        page = int(params.get("page", 1))
+        return {"data": items[(page - 1) * page_size:page * page_size]}
+
+    @staticmethod
+    def field_value(card: Card, field: str) -> Optional[str]:
+        """
+        Resolve a dotted field name such as `set.id` on a card.
+
+        :param card:    The card to read.
+        :param field:   The dotted field name.
+        :return:        The value of the field, as a string.
+        """
+        value = card
+        for part in field.split("."):
+            value = getattr(value, part, None)
+            if value is None:
+                return None
+        return str(value)
+
+    @classmethod
+    def term_matches(cls, card: Card, term: str) -> bool:
+        """
+        Check a single `field:value` term against a card.
+
+        :param card:    The card to check.
+        :param term:    The term, e.g. `name:*char.*zard*` or `set.id:sv*`.
+        :return:        Whether the card matches.
+        """
+        field, _, pattern = term.partition(":")
+        value = cls.field_value(card, field)
+        if value is None:
+            return False
+        if field == "name":
+            # `process_card_name` already emits regex fragments between the leading and trailing wildcards
+            regex = re.sub(r"^\*|\*$", ".*", pattern)
+            return re.fullmatch(regex, value, re.IGNORECASE) is not None
+        return fnmatch.fnmatch(value.lower(), pattern.lower())
+
+    @classmethod
+    def matches(cls, card: Card, query: str) -> bool:
+        """
+        Check a full query against a card.
+
+        :param card:    The card to check.
+        :param query:   The `q` parameter of the request.
+        :return:        Whether the card matches.
+        """
+        tokens = re.findall(r"\(|\)|[^\s()]+", query)
+
+        def parse_group(position: int) -> (bool, int):
+            alternatives, pending_or = [], False
+            while position < len(tokens) and tokens[position] != ")":
+                token = tokens[position]
+                if token == "(":
+                    value, position = parse_group(position + 1)
+                elif token.lower() == "or":
+                    pending_or = True
+                    position += 1
+                    continue
+                else:
+                    value = cls.term_matches(card, token)
+                if pending_or:
+                    alternatives[-1] = alternatives[-1] or value
+                    pending_or = False
+                else:
+                    alternatives.append(value)
+                position += 1
+            return all(alternatives), position
+
+        return parse_group(0)[0]
+
+
+@contextmanager
+def installed(api: FakeTcgApi) -> Iterator[FakeTcgApi]:
+    """
+    Route every `pokemontcgsdk` request to `api` for the duration of the context.
+
+    :param api:     The fake API to install.
+    :return:        The installed fake API.
+    """
+    original = RestClient.__dict__["get"]
+    RestClient.get = classmethod(lambda cls, url, params={}: api.get(url, params))
+    try:
+        yield api
+    finally:
+        RestClient.get = original
+
+
+@contextmanager
+def served(api: FakeTcgApi, rate_limit: Optional[int] = None, failure_rate: float = 0.0) -> Iterator[str]:
+    """
+    Serve `api` over HTTP on a local port for the duration of the context, to exercise the real HTTP client,
+    e.g. with `ApiClient(endpoint=url)` or `POKEMON_API_URL=url`.
+
+    :param api:             The fake API to serve.
+    :param rate_limit:      Requests accepted per second, the others are answered with a 429 and a Retry-After.
+    :param failure_rate:    Fraction of the requests answered with a 503.
+    :return:                The base URL of the server, in place of the SDK's endpoint.
+    """
+    lock = threading.Lock()
+    window = [0.0, 0]  # Start of the current one-second window and the requests accepted in it
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args) -> None:
+            pass
+
+        def _reply(self, status: int, body: dict, headers: Optional[Dict[str, str]] = None) -> None:
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self) -> None:
+            if rate_limit is not None:
+                with lock:
+                    now = time.monotonic()
+                    if now - window[0] >= 1.0:
+                        window[:] = [now, 0]
+                    window[1] += 1
+                    throttled = window[1] > rate_limit
+                if throttled:
+                    self._reply(429, {"error": "Too many requests"}, {"Retry-After": "1"})
+                    return
+            if random.random() < failure_rate:
+                self._reply(503, {"error": "Service unavailable"})
+                return
+            url = urlsplit(self.path)
+            path = url.path[len("/v2"):] if url.path.startswith("/v2") else url.path
+            try:
+                self._reply(200, api.get(__endpoint__ + path, dict(parse_qsl(url.query))))
+            except PokemonTcgException as e:
+                self._reply(404, {"error": str(e)})
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}/v2"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@contextmanager
+def served_images(cards: Dict[str, Card]) -> Iterator[str]:
+    """
+    Serve a placeholder image of every card on a local port, and point the image URLs of the cards to it for the
+    duration of the context, so that the app's image downloads do not leave the machine. Each card gets its own
+    blocks of color, so that the images of different cards have different artwork hashes.
+
+    :param cards:   Dictionary of card IDs to the cards whose images are served.
+    :return:        The base URL of the server.
+    """
+    # Imported here, Pillow is only needed to draw the images
+    from PIL import Image, ImageDraw
+
+    sizes = {"small": (245, 342), "large": (734, 1024)}
+    rendered: Dict[str, bytes] = {}
+    lock = threading.Lock()
+
+    def render(card_id: str, size: str) -> bytes:
+        rng = random.Random(card_id)
+        width, height = sizes[size]
+        image = Image.new("RGB", (width, height), tuple(rng.randrange(256) for _ in range(3)))
+        draw = ImageDraw.Draw(image)
+        for _ in range(6):
+            left, top = rng.randrange(width), rng.randrange(height // 2)
+            draw.rectangle((left, top, left + width // 4, top + height // 6),
+                           fill=tuple(rng.randrange(256) for _ in range(3)))
+        out = io.BytesIO()
+        image.save(out, format="PNG")
+        return out.getvalue()
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args) -> None:
+            pass
+
+        def do_GET(self) -> None:
+            card_id, _, file = urlsplit(self.path).path.strip("/").rpartition("/")
+            size = file.rsplit(".", 1)[0]
+            if card_id not in cards or size not in sizes:
+                self.send_error(404)
+                return
+            with lock:
+                payload = rendered.get(self.path)
+            if payload is None:
+                payload = render(card_id, size)
+                with lock:
+                    rendered[self.path] = payload
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    originals = {card_id: (card.images.small, card.images.large) for card_id, card in cards.items() if card.images}
+    for card_id in originals:
+        cards[card_id].images.small = f"{url}/{card_id}/small.png"
+        cards[card_id].images.large = f"{url}/{card_id}/large.png"
+    try:
+        yield url
+    finally:
+        for card_id, (small, large) in originals.items():
+            cards[card_id].images.small, cards[card_id].images.large = small, large
+        server.shutdown()
+        server.server_close()
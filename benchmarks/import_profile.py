@@ -0,0 +1,85 @@
+"""
+Import-time profile of the app's modules, measured in fresh interpreters with `python -X importtime`.
+
+`app` is what a cold container pays before serving the login screen, the component modules are what the
+first visit of each tab pays on top of it.
+
+Usage:
+    python -m benchmarks.import_profile --top 15 --output imports.json
+"""
+import argparse
+import json
+import re
+import subprocess
+import sys
+from typing import Optional
+
+MODULES = [
+    "app",
+    "components.card_shop",
+    "components.card_viewer",
+    "components.deck_manager",
+    "utils.catalog",
+    "utils.deck",
+    "utils.pokemon_api",
+    "utils.storage",
+]
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def profile(module: str, top: int, baseline: str = "streamlit") -> dict:
+    """
+    Profile the import of `module` in a fresh interpreter.
+
+    Args:
+        module (str): The module to import.
+        top (int): Number of most expensive imported modules to report.
+        baseline (str): Module imported beforehand and left out of the profile, as the Streamlit
+            server has always imported it before running the app.
+
+    Returns:
+        dict: Total import time of the module and its most expensive dependencies, in milliseconds.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {baseline}; import {module}"],
+        capture_output=True, text=True,
+    )
+    entries, seen_baseline = [], False
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        if not seen_baseline:
+            seen_baseline = match.group(4) == baseline and not match.group(3).strip(" ")
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        entries.append({"module": name, "self_ms": int(self_us) / 1e3, "cumulative_ms": int(cumulative_us) / 1e3,
+                        "depth": len(indent) // 2})
+    total = next((entry["cumulative_ms"] for entry in entries if entry["module"] == module), None)
+    return {
+        "total_ms": total,
+        "error": result.stderr.strip().splitlines()[-1] if result.returncode else None,
+        "top": sorted(entries, key=lambda entry: entry["cumulative_ms"], reverse=True)[:top],
+    }
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("modules", nargs="*", default=MODULES, help="modules to profile")
+    parser.add_argument("--top", type=int, default=10, help="number of dependencies reported per module")
+    parser.add_argument("--output", default="-", help="file to write the JSON report to, '-' for stdout")
+    args = parser.parse_args(argv)
+
+    report = {module: profile(module, args.top) for module in args.modules}
+    for module, stats in report.items():
+        print(f"{module:<28} {stats['total_ms'] or float('nan'):10.1f}ms", file=sys.stderr)
+    if args.output == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,409 @@
+"""
+Concurrent-user load test of the Streamlit app.
+
+Scripted sessions of `app.py` are driven through Streamlit's testing harness, each in its own thread of a single
+process, as the Streamlit server runs the scripts of its sessions. Every session logs in as its own user, then
+tours the app: a Card Shop search and adding a card, editing a deck in the Deck Manager, and filtering and
+removing cards in the Owned Cards tab. The catalog is served by the in-memory fake of the Pokémon TCG API and
+the card images by a local image server, so that nothing leaves the machine.
+
+Every rerun is timed. For each number of concurrent users, run in a fresh interpreter, the throughput, the p50
+and p99 rerun latency overall and per step, and the memory per session are reported as JSON.
+
+Usage:
+    python -m benchmarks.load_test --users 1 5 10 20 --iterations 3 --output load.json
+"""
+import argparse
+import gc
+import json
+import logging
+import math
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+import bcrypt
+import yaml
+
+from benchmarks.fake_api import FakeTcgApi, installed, served_images
+from benchmarks.run import git_revision
+from benchmarks.synthetic import make_catalog
+from utils.storage import save_cards_to_collection
+from utils.write_queue import flush_all
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+TAB_KEY = "load_test_tab"  # Session state key of the tab selected in place of the navigation bar
+PASSWORD = "load-test"
+DECK_NAME = "Load Test"
+TIMEOUT = 300  # Seconds a single rerun may take before the harness gives up
+
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    """
+    Args:
+        values (List[float]): The samples.
+        fraction (float): The percentile, e.g. 0.99.
+
+    Returns:
+        Optional[float]: The nearest-rank percentile of the samples, or None if there are none.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))]
+
+
+def resident_memory() -> int:
+    """
+    Returns:
+        int: The resident memory of the process in bytes, or its peak where the current one is not available.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def write_config(users: List[str]) -> None:
+    """
+    Write the authentication configuration of the load-test users to `config.yaml`, in the working directory.
+
+    Args:
+        users (List[str]): The user names, which are also their display names.
+    """
+    # Hashed once, every user has the same password
+    password = bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt()).decode()
+    config = {
+        "credentials": {"usernames": {
+            user: {"email": f"{user}@example.com", "name": user, "password": password,
+                   "failed_login_attempts": 0, "logged_in": False}
+            for user in users
+        }},
+        "cookie": {"name": "load_test", "key": "load-test-cookie-key-0123456789ab", "expiry_days": 1},
+    }
+    with open("config.yaml", "w", encoding="utf-8") as f:
+        yaml.dump(config, f)
+
+
+def select_tabs_from_session_state() -> None:
+    """
+    Replace the navigation bar, a custom component the testing harness cannot click, with a lookup of the tab in
+    the session state.
+    """
+    import streamlit as st
+    import streamlit_option_menu
+
+    def option_menu(menu_title, options, default_index=0, **kwargs):
+        return st.session_state.get(TAB_KEY, options[default_index])
+
+    streamlit_option_menu.option_menu = option_menu
+
+
+def share_runtime() -> None:
+    """
+    Keep a runtime installed between the runs of the testing harness. Each run installs its own mock of the
+    Streamlit runtime, a process-wide singleton, and removes it when done, which breaks the runs of the other
+    sessions still in progress: the last installed one is kept instead.
+    """
+    from streamlit.runtime import Runtime
+    from streamlit.testing.v1 import app_test
+
+    class KeepInstance(type(Runtime)):
+        def __setattr__(cls, name: str, value: object) -> None:
+            if name == "_instance":
+                if value is not None:
+                    Runtime._instance = value
+                return
+            super().__setattr__(name, value)
+
+    # A subclass, so that the harness's mocks still have the runtime's attributes
+    class SharedRuntime(Runtime, metaclass=KeepInstance):
+        pass
+
+    app_test.Runtime = SharedRuntime
+
+
+class Session:
+    def __init__(self, user: str, names: List[str], think: float, seed: int) -> None:
+        """
+        A scripted user of the app, driven through Streamlit's testing harness.
+
+        Args:
+            user (str): The user name to log in with.
+            names (List[str]): Card names to search for in the Card Shop.
+            think (float): Mean pause between two interactions, in seconds.
+            seed (int): Seed of the random choices of the session.
+        """
+        self.user = user
+        self.names = names
+        self.think = think
+        self.rng = random.Random(seed)
+        self.at = None
+        self.timings: List[Tuple[str, float]] = []
+        self.errors: List[str] = []
+
+    def _rerun(self, step: str, interact: Callable[[], object]) -> None:
+        if self.think:
+            time.sleep(self.rng.uniform(0, 2 * self.think))
+        start = time.perf_counter()
+        interact()
+        self.timings.append((step, time.perf_counter() - start))
+        for exception in self.at.exception:
+            self.errors.append(f"{step}: {exception.message}")
+
+    def _tab(self, step: str, tab: str) -> None:
+        def select() -> None:
+            self.at.session_state[TAB_KEY] = tab
+            self.at.run()
+        self._rerun(step, select)
+
+    def _button(self, predicate: Callable[[object], bool]):
+        return next((button for button in self.at.button if predicate(button)), None)
+
+    def login(self) -> None:
+        from streamlit.testing.v1 import AppTest
+
+        self.at = AppTest.from_file(APP_PATH, default_timeout=TIMEOUT)
+        self._rerun("login.page", self.at.run)
+
+        def submit() -> None:
+            self.at.text_input[0].input(self.user)
+            self.at.text_input[1].input(PASSWORD)
+            self.at.button[0].click().run()
+        self._rerun("login.submit", submit)
+
+    def shop(self) -> None:
+        self._tab("shop.open", "Card Shop")
+        batch_mode = self.at.toggle(key="shop_batch_mode")
+        if batch_mode.value:
+            # The batch table is a data editor, which the harness cannot fill in
+            self._rerun("shop.open", lambda: batch_mode.set_value(False).run())
+        card_name = next(widget for widget in self.at.text_input if widget.label == "Card Name")
+        self._rerun("shop.search", lambda: card_name.input(self.rng.choice(self.names)).run())
+        add = self._button(lambda button: button.key and button.key.startswith("add_"))
+        if add is not None:
+            self._rerun("shop.add", lambda: add.click().run())
+
+    def decks(self) -> None:
+        self.at.session_state["view"] = "deck_manager"
+        self._tab("decks.open", "Deck Manager")
+        edit = self._button(lambda button: button.key == f"edit_{DECK_NAME}")
+        if edit is None:
+            self._rerun("decks.create", lambda: self._button(lambda button: button.label == "Create a New Deck")
+                        .click().run())
+            name = next(widget for widget in self.at.text_input if widget.placeholder == "New Deck Name")
+            self._rerun("decks.create", lambda: name.input(DECK_NAME).run())
+            edit = self._button(lambda button: button.key == f"edit_{DECK_NAME}")
+        self._rerun("decks.edit", lambda: edit.click().run())
+        add = self._button(lambda button: button.label.startswith("Add ("))
+        if add is not None:
+            self._rerun("decks.add_card", lambda: add.click().run())
+        self._rerun("decks.save", lambda: self._button(lambda button: button.label == "Save").click().run())
+
+    def owned(self) -> None:
+        self._tab("owned.open", "Owned Cards")
+        search = next((widget for widget in self.at.sidebar.text_input if widget.label == "Search by Name"), None)
+        if search is None:
+            return  # No cards yet
+        self._rerun("owned.filter", lambda: search.input(self.rng.choice("aeiou")).run())
+        self._rerun("owned.filter", lambda: search.input("").run())
+        remove = self._button(lambda button: button.label.startswith("Remove ("))
+        if remove is not None:
+            self._rerun("owned.remove", lambda: remove.click().run())
+
+    def tour(self) -> None:
+        """
+        Visit every tab once.
+        """
+        self.shop()
+        self.decks()
+        self.owned()
+
+
+def run_level(users: int, iterations: int, think: float, scale: int, collection_size: int, latency: float,
+              seed: int) -> dict:
+    """
+    Run concurrent sessions in this process, in a fresh working directory.
+
+    Args:
+        users (int): The number of concurrent sessions, each with its own user.
+        iterations (int): The number of tours of the app of each session after logging in.
+        think (float): Mean pause between two interactions, in seconds.
+        scale (int): The number of cards in the catalog.
+        collection_size (int): The number of cards each user owns to begin with.
+        latency (float): Simulated API latency in seconds.
+        seed (int): Seed of the synthetic data and of the sessions.
+
+    Returns:
+        dict: The results of the level.
+    """
+    for name in list(logging.root.manager.loggerDict):
+        if name.startswith("streamlit"):
+            logging.getLogger(name).setLevel(logging.ERROR)
+    select_tabs_from_session_state()
+    share_runtime()
+
+    sets, cards = make_catalog(scale, seed)
+    rng = random.Random(seed)
+    names = sorted({card.name for card in cards.values()})
+    user_names = ["warm-up"] + [f"user-{index:03d}" for index in range(users)]
+    write_config(user_names)
+    for user in user_names:
+        owned = rng.sample(list(cards.values()), min(collection_size, len(cards)))
+        save_cards_to_collection({card.id: (card, rng.randint(1, 4)) for card in owned}, user)
+
+    api = FakeTcgApi(sets, cards, latency)
+    with installed(api), served_images(cards):
+        # One untimed tour first, so that imports and process-wide caches are not billed to the sessions
+        warm_up = Session(user_names[0], names, 0.0, seed)
+        warm_up.login()
+        warm_up.tour()
+        del warm_up
+        gc.collect()
+        baseline = resident_memory()
+
+        sessions = [Session(user, names, think, seed + index) for index, user in enumerate(user_names[1:], 1)]
+        failures: List[str] = []
+
+        def drive(session: Session) -> None:
+            try:
+                session.login()
+                for _ in range(iterations):
+                    session.tour()
+            except Exception as e:  # A step whose widgets did not render, reported with the others
+                failures.append(f"{session.user}: {type(e).__name__}: {e}")
+
+        threads = [threading.Thread(target=drive, args=(session,), name=session.user) for session in sessions]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        seconds = time.perf_counter() - start
+        end = resident_memory()
+
+    timings = [(step, duration) for session in sessions for step, duration in session.timings]
+    durations = [duration for _, duration in timings]
+    steps: Dict[str, List[float]] = {}
+    for step, duration in timings:
+        steps.setdefault(step, []).append(duration)
+    errors = [error for session in sessions for error in session.errors] + failures
+    return {
+        "users": users,
+        "iterations": iterations,
+        "think": think,
+        "reruns": len(timings),
+        "seconds": seconds,
+        "throughput": len(timings) / seconds if seconds else None,  # Reruns per second
+        "latency": {
+            "p50": percentile(durations, 0.50),
+            "p99": percentile(durations, 0.99),
+            "max": max(durations, default=None),
+        },
+        "steps": {
+            step: {"count": len(values), "p50": percentile(values, 0.50), "p99": percentile(values, 0.99)}
+            for step, values in sorted(steps.items())
+        },
+        "memory": {  # Resident bytes, the sessions' share includes the harness's copy of their elements
+            "baseline": baseline,
+            "end": end,
+            "per_session": (end - baseline) / users if users else None,
+        },
+        "api_calls": api.calls,
+        "errors": len(errors),
+        "error_samples": errors[:10],
+    }
+
+
+def run(levels: List[int], iterations: int, think: float, scale: int, collection_size: int, latency: float,
+        seed: int) -> dict:
+    """
+    Run every level of concurrency, each in a fresh interpreter so that the memory and the caches of a level do
+    not carry over to the next.
+
+    Returns:
+        dict: The JSON-serializable report.
+    """
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "scale": scale,
+            "collection": collection_size,
+            "iterations": iterations,
+            "think": think,
+            "latency": latency,
+            "seed": seed,
+        },
+        "results": {},
+    }
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for users in levels:
+        command = [sys.executable, "-m", "benchmarks.load_test", "--level", str(users), "--iterations",
+                   str(iterations), "--think", str(think), "--scale", str(scale), "--collection",
+                   str(collection_size), "--latency", str(latency), "--seed", str(seed)]
+        result = subprocess.run(command, cwd=root, capture_output=True, text=True)
+        if result.returncode:
+            print(result.stderr, file=sys.stderr)
+            report["results"][str(users)] = {"users": users, "error": result.stderr.strip().splitlines()[-1:]}
+            continue
+        # The report is the last line, after anything the app printed
+        level = json.loads(result.stdout.strip().splitlines()[-1])
+        report["results"][str(users)] = level
+        print(f"{users:>4} users: {level['throughput']:7.1f} reruns/s, p50 {level['latency']['p50'] * 1e3:7.1f}ms, "
+              f"p99 {level['latency']['p99'] * 1e3:7.1f}ms, {level['memory']['per_session'] / 2 ** 20:6.1f}MB "
+              f"per session, {level['errors']} errors", file=sys.stderr)
+    return report
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 5, 10], help="concurrent users of each level")
+    parser.add_argument("--iterations", type=int, default=3, help="tours of the app per session after logging in")
+    parser.add_argument("--think", type=float, default=0.0, help="mean pause between interactions, in seconds")
+    parser.add_argument("--scale", type=int, default=2000, help="number of cards in the catalog")
+    parser.add_argument("--collection", type=int, default=300, help="number of cards each user owns at first")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated API latency, in seconds")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic data and of the sessions")
+    parser.add_argument("--output", default="-", help="file to write the JSON report to, '-' for stdout")
+    parser.add_argument("--level", type=int, help=argparse.SUPPRESS)  # Runs a single level in this process
+    args = parser.parse_args(argv)
+
+    if args.level is not None:
+        # Sessions write their users' data to a working directory of their own
+        work = tempfile.mkdtemp(prefix="load-test-")
+        os.chdir(work)
+        level = run_level(args.level, args.iterations, args.think, args.scale, args.collection, args.latency,
+                          args.seed)
+        # The sessions' last changes are saved in the background, before the directory is deleted
+        flush_all()
+        print()
+        print(json.dumps(level), flush=True)
+        shutil.rmtree(work, ignore_errors=True)
+        # Skips the shutdown hooks, which would save the scheduler's and the catalog's state to the deleted directory
+        os._exit(0)
+
+    report = run(args.users, args.iterations, args.think, args.scale, args.collection, args.latency, args.seed)
+    if args.output == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,460 @@
+"""
+Benchmark suite for the storage, deck and collection code paths.
+
+Builds a synthetic catalog, collection and set of decks at each requested scale, serves the catalog through
+an in-memory fake of the Pokémon TCG API and times the hot functions. Results are printed as JSON so runs
+on different commits can be compared with `python -m benchmarks.compare`.
+
+Usage:
+    python -m benchmarks.run --scales 1000 10000 100000 --output bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, Optional
+
+from benchmarks.fake_api import FakeTcgApi, installed
+from benchmarks.synthetic import make_catalog, make_collection, make_decks, make_decklist
+from components.card_viewer import CardFilters, filter_cards, filtered_view, group_evolution_families, sort_cards
+from utils import catalog, storage
+from utils.buildability import BuildabilityMatrix
+from utils.bulk_import import resolve_collection_import
+from utils.deck import Deck
+from utils.deck_index import DeckIndex
+from utils.goldfish import encode_deck, simulate
+from utils.meta import MetaAnalytics
+from utils.owned_cards import OwnedCards
+from utils.recommender import CardRecommender
+from utils.set_completion import SetCompletionIndex
+from utils.valuation import PriceHistory
+
+USER = "benchmark"
+
+
+def measure(fn: Callable[[], object], repeat: int, number: int = 1,
+            setup: Optional[Callable[[], object]] = None) -> Dict[str, float]:
+    """
+    Time `fn`, calling it `number` times per sample and taking `repeat` samples.
+
+    Args:
+        fn (Callable[[], object]): The function to time.
+        repeat (int): Number of samples.
+        number (int): Number of calls per sample.
+        setup (Optional[Callable[[], object]]): Called before each sample, outside the timed region.
+
+    Returns:
+        Dict[str, float]: Minimum, median and mean seconds per call.
+    """
+    samples = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - start) / number)
+    return {
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "mean": statistics.fmean(samples),
+        "repeat": repeat,
+        "number": number,
+    }
+
+
+def bench_deck(cards, decks, rng, repeat) -> Dict[str, dict]:
+    """
+    Time the `Deck` operations on a 60-card deck.
+    """
+    deck = next(iter(decks.values()))
+    deck_cards = [card for card, quantity in deck.cards() for _ in range(quantity)]
+    catalog_cards = list(cards.values())
+    probes = [rng.choice(catalog_cards) for _ in range(1000)]
+    scratch = Deck("scratch", [])
+
+    def add_all():
+        for card in probes:
+            scratch.add_card(card)
+
+    def remove_all():
+        for card in probes:
+            scratch.remove_card(card)
+
+    def count_all():
+        for card in probes:
+            deck.count_of(card)
+
+    return {
+        "deck.init": measure(lambda: Deck("bench", deck_cards), repeat, 100),
+        "deck.add_card": measure(add_all, repeat, setup=lambda: scratch.__init__("scratch", [])),
+        "deck.remove_card": measure(remove_all, repeat, setup=lambda: scratch.__init__("scratch", probes)),
+        "deck.count_of": measure(count_all, repeat),
+        "deck.cards": measure(deck.cards, repeat, 100),
+        "deck.len": measure(lambda: len(deck), repeat, 100),
+        "deck.legal": measure(deck.legal, repeat, 100),
+    }
+
+
+def bench_import_export(decks, repeat) -> Dict[str, dict]:
+    """
+    Time deck import from a PTCGO decklist through the fake API, and deck export.
+    """
+    deck = next(iter(decks.values()))
+    decklist = make_decklist(deck)
+    return {
+        "deck.import_from_string": measure(lambda: Deck("imported", []).import_from_string(decklist), repeat),
+        "deck.export": measure(deck.export, repeat),
+    }
+
+
+def bench_bulk_import(cards, rng, repeat) -> Dict[str, dict]:
+    """
+    Time the bulk import of a CSV and of a decklist with one row per catalog card, resolved from a warm catalog.
+    """
+    catalog.get_catalog().add_cards(cards.values())
+    catalog_cards = list(cards.values())
+    rng.shuffle(catalog_cards)
+    csv_lines = ["Quantity,Card ID\n"] + [f"{rng.randint(1, 4)},{card.id}\n" for card in catalog_cards]
+    decklist_lines = [f"{rng.randint(1, 4)} {card.name} {card.set.ptcgoCode} {card.number}\n"
+                      for card in catalog_cards]
+    return {
+        "bulk_import.csv": measure(lambda: resolve_collection_import(csv_lines), repeat),
+        "bulk_import.decklist": measure(lambda: resolve_collection_import(decklist_lines), repeat),
+    }
+
+
+def bench_collection(collection, repeat) -> Dict[str, dict]:
+    """
+    Time sorting, evolution grouping and sidebar filtering of the owned-card collection, and updating its
+    persistent version and rerunning the tab on an unchanged version.
+    """
+    pokemon = {k: v for k, v in collection.items() if v[0].supertype == "Pokémon"}
+    owned = OwnedCards(collection)
+    entries = list(collection.values())[:1000]
+    filters = CardFilters(False, ("Pokémon",), ("Fire", "Water"), "", "")
+    filtered_view(owned, filters)
+
+    def set_owned_all():
+        versions = owned
+        for card, quantity in entries:
+            versions = versions.set_owned(card, quantity + 1)
+
+    return {
+        "owned_cards.build": measure(lambda: OwnedCards(collection), repeat),
+        "owned_cards.set_owned": measure(set_owned_all, repeat),
+        "card_viewer.filtered_view.cached": measure(lambda: filtered_view(owned, filters), repeat),
+        "card_viewer.sort_cards": measure(lambda: sort_cards(collection), repeat),
+        "card_viewer.group_evolution_families": measure(lambda: group_evolution_families(pokemon), repeat),
+        "card_viewer.filter_cards.name": measure(lambda: filter_cards(collection, search_query="ka"), repeat),
+        "card_viewer.filter_cards.types": measure(
+            lambda: filter_cards(collection, supertypes=["Pokémon"], pokemon_types=["Fire", "Water"]), repeat),
+        "card_viewer.filter_cards.all": measure(
+            lambda: filter_cards(collection, True, ["Pokémon"], ["Fire"], "a"), repeat),
+    }
+
+
+def bench_buildability(collection, decks, rng, repeat) -> Dict[str, dict]:
+    """
+    Time building the deck buildability matrix and keeping it up to date as cards and decks change.
+    """
+    matrix = BuildabilityMatrix(collection, decks.values())
+    deck_cards = [card for deck in decks.values() for card, _ in deck.cards()]
+    probes = [rng.choice(deck_cards) for _ in range(1000)]
+    deck_list = list(decks.values())
+    names = list(decks)[:10]
+
+    def set_owned_all():
+        for card in probes:
+            matrix.set_owned(card.id, rng.randint(0, 4))
+
+    def set_deck_all():
+        for deck in deck_list:
+            matrix.set_deck(deck)
+
+    return {
+        "buildability.init": measure(lambda: BuildabilityMatrix(collection, decks.values()), repeat),
+        "buildability.set_owned": measure(set_owned_all, repeat),
+        "buildability.set_deck": measure(set_deck_all, repeat),
+        "buildability.complete_decks": measure(matrix.complete_decks, repeat, 100),
+        "buildability.combined_shortfall": measure(lambda: matrix.combined_shortfall(names), repeat, 100),
+        "buildability.simultaneous_builds": measure(matrix.simultaneous_builds, repeat),
+    }
+
+
+def bench_deck_index(decks, repeat) -> Dict[str, dict]:
+    """
+    Time MinHash indexing of the decks, nearest-deck queries and archetype clustering.
+    """
+    items = list(decks.items())
+    index = DeckIndex()
+    index.add_decks(items)
+    probes = [deck for _, deck in items[:100]]
+
+    def query_all():
+        for deck in probes:
+            index.query(deck, 10)
+
+    return {
+        "deck_index.add_decks": measure(lambda: DeckIndex().add_decks(items), repeat),
+        "deck_index.query": measure(query_all, repeat),
+        "deck_index.archetypes": measure(index.archetypes, repeat),
+    }
+
+
+def bench_recommender(collection, decks, repeat) -> Dict[str, dict]:
+    """
+    Time building the card co-occurrence matrix, saving a deck into it and ranking a collection for a deck.
+    """
+    items = list(decks.items())
+    recommender = CardRecommender()
+    recommender.add_decks(items)
+    deck_id, deck = items[0]
+    cards = list(collection.values())
+    return {
+        "recommender.add_decks": measure(lambda: CardRecommender().add_decks(items), repeat),
+        "recommender.update_deck": measure(lambda: recommender.add_decks([(deck_id, deck)]), repeat, 100),
+        "recommender.rank": measure(lambda: recommender.rank(deck, cards), repeat, 10),
+    }
+
+
+def bench_meta(decks, repeat) -> Dict[str, dict]:
+    """
+    Time projecting decks into the meta analytics matrices, updating a deck and the grouped usage queries.
+    """
+    items = list(decks.items())
+    analytics = MetaAnalytics()
+    analytics.add_decks(items)
+    deck_id, deck = items[0]
+
+    def build():
+        built = MetaAnalytics()
+        built.add_decks(items)
+        len(built)
+
+    def update():
+        analytics.add_decks([(deck_id, deck)])
+        analytics.card_usage(limit=10)
+
+    return {
+        "meta.build": measure(build, repeat),
+        "meta.update_and_query": measure(update, repeat, 100),
+        "meta.card_usage": measure(analytics.card_usage, repeat, 10),
+        "meta.set_usage": measure(analytics.set_usage, repeat, 10),
+    }
+
+
+def bench_goldfish(decks, repeat) -> Dict[str, dict]:
+    """
+    Time encoding a deck for the goldfish simulator and simulating games in the calling process.
+    """
+    deck = next((deck for deck in decks.values() if len(deck) == 60), next(iter(decks.values())))
+    return {
+        "goldfish.encode": measure(lambda: encode_deck(deck), repeat, 100),
+        "goldfish.1000_games": measure(lambda: simulate(deck, games=1000, workers=1, seed=0), repeat),
+    }
+
+
+def bench_set_completion(sets, collection, repeat) -> Dict[str, dict]:
+    """
+    Time building the set completion bitmaps, updating them and computing the completion of every set.
+    """
+    index = SetCompletionIndex(sets, collection)
+    card_id = next(iter(collection))
+
+    def toggle():
+        index.set_owned(card_id, 0)
+        index.set_owned(card_id, 1)
+
+    return {
+        "set_completion.build": measure(lambda: SetCompletionIndex(sets, collection), repeat),
+        "set_completion.set_owned": measure(toggle, repeat, 1000),
+        "set_completion.completion": measure(index.completion, repeat, 1000),
+        "set_completion.missing_numbers": measure(lambda: index.missing_numbers(sets[0].id), repeat, 100),
+    }
+
+
+def bench_catalog_snapshot(sets, cards, rng, repeat) -> Dict[str, dict]:
+    """
+    Time writing the memory-mapped catalog snapshot, opening it and looking cards up in it.
+    """
+    probes = rng.sample(list(cards), min(1000, len(cards)))
+    snapshot = catalog.Catalog(sets, dict(cards), time.time())
+    catalog.save_snapshot(snapshot)
+    loaded = catalog.load_snapshot()
+    fresh = {}
+
+    def reopen():
+        fresh["catalog"] = catalog.load_snapshot()
+
+    def cold_lookups():
+        for card_id in probes:
+            fresh["catalog"].get(card_id)
+
+    def lookups():
+        for card_id in probes:
+            loaded.get(card_id)
+
+    return {
+        "catalog.save_snapshot": measure(lambda: catalog.save_snapshot(catalog.Catalog(sets, dict(cards), 0.0)),
+                                         repeat),
+        "catalog.load_snapshot": measure(catalog.load_snapshot, repeat, 10),
+        "catalog.get_cold": measure(cold_lookups, repeat, setup=reopen),
+        "catalog.get": measure(lookups, repeat),
+    }
+
+
+def bench_storage(collection, decks, rng, repeat) -> Dict[str, dict]:
+    """
+    Time every function of `utils.storage` against a temporary data directory.
+    """
+    card_ids = list(collection)
+    deck = next(iter(decks.values()))
+    with tempfile.TemporaryDirectory() as data_path:
+        storage.DATA_PATH = data_path
+        user_path = storage.get_user_path(USER)
+        storage.ensure_directory(user_path)
+        cards_path = os.path.join(user_path, storage.CARDS_FILE)
+        decks_path = os.path.join(user_path, storage.DECKS_FILE)
+
+        def reset():
+            storage.save_pickle_file(collection, cards_path)
+            storage.save_pickle_file(decks, decks_path)
+
+        reset()
+        results = {
+            "storage.get_user_path": measure(lambda: storage.get_user_path(USER), repeat, 1000),
+            "storage.ensure_directory": measure(lambda: storage.ensure_directory(user_path), repeat, 100),
+            "storage.save_pickle_file": measure(lambda: storage.save_pickle_file(collection, cards_path), repeat),
+            "storage.load_pickle_file": measure(lambda: storage.load_pickle_file(cards_path), repeat),
+            "storage.load_cards_from_collection": measure(
+                lambda: storage.load_cards_from_collection(USER), repeat),
+            "storage.save_cards_to_collection": measure(
+                lambda: storage.save_cards_to_collection(collection, USER), repeat, setup=reset),
+            "storage.save_card_to_collection": measure(
+                lambda: storage.save_card_to_collection(collection[rng.choice(card_ids)][0], 1, USER), repeat,
+                setup=reset),
+            "storage.remove_one_card_from_collection": measure(
+                lambda: storage.remove_one_card_from_collection(rng.choice(card_ids), USER), repeat, setup=reset),
+            "storage.load_decks_from_collection": measure(
+                lambda: storage.load_decks_from_collection(USER), repeat),
+            "storage.save_deck_to_collection": measure(
+                lambda: storage.save_deck_to_collection(deck, USER), repeat, setup=reset),
+            "storage.remove_deck_from_collection": measure(
+                lambda: storage.remove_deck_from_collection(deck.name, USER), repeat, setup=reset),
+        }
+        storage.DATA_PATH = "data"
+    return results
+
+
+def bench_valuation(collection, repeat) -> Dict[str, dict]:
+    """
+    Time price snapshots and revaluation of the collection from a 30-snapshot price history.
+    """
+    with tempfile.TemporaryDirectory() as path:
+        history = PriceHistory(path)
+        for day in range(30):
+            history.append_snapshot(collection, day * 86400.0)
+        results = {
+            "valuation.append_snapshot": measure(lambda: history.append_snapshot(collection), repeat),
+            "valuation.load": measure(lambda: PriceHistory(path), repeat),
+            "valuation.value_over_time": measure(history.value_over_time, repeat),
+            "valuation.value_by_set": measure(history.value_by_set, repeat),
+            "valuation.top_movers": measure(history.top_movers, repeat),
+        }
+    return results
+
+
+def git_revision() -> Optional[str]:
+    """
+    Get the commit the benchmarks run against, if inside a git checkout.
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(scales: list[int], repeat: int, seed: int, latency: float) -> dict:
+    """
+    Run every benchmark at every scale.
+
+    Args:
+        scales (list[int]): Number of cards in the catalog and collection for each run.
+        repeat (int): Number of samples per benchmark.
+        seed (int): Seed of the synthetic data.
+        latency (float): Simulated API latency in seconds.
+
+    Returns:
+        dict: The JSON-serializable report.
+    """
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": seed,
+            "repeat": repeat,
+            "latency": latency,
+        },
+        "results": {},
+    }
+    for scale in scales:
+        rng = random.Random(seed)
+        sets, cards = make_catalog(scale, seed)
+        collection = make_collection(cards, seed)
+        decks = make_decks(cards, min(1000, max(5, scale // 100)), seed)
+        api = FakeTcgApi(sets, cards, latency)
+        with installed(api), tempfile.TemporaryDirectory() as catalog_path:
+            catalog.CATALOG_PATH = catalog_path
+            catalog.set_catalog(catalog.Catalog())
+            results = {}
+            results.update(bench_deck(cards, decks, rng, repeat))
+            results.update(bench_import_export(decks, repeat))
+            results.update(bench_bulk_import(cards, rng, repeat))
+            results.update(bench_collection(collection, repeat))
+            results.update(bench_buildability(collection, decks, rng, repeat))
+            results.update(bench_deck_index(decks, repeat))
+            results.update(bench_recommender(collection, decks, repeat))
+            results.update(bench_meta(decks, repeat))
+            results.update(bench_goldfish(decks, repeat))
+            results.update(bench_set_completion(sets, collection, repeat))
+            results.update(bench_catalog_snapshot(sets, cards, rng, repeat))
+            results.update(bench_storage(collection, decks, rng, repeat))
+            results.update(bench_valuation(collection, repeat))
+            catalog.set_catalog(None)
+        report["results"][str(scale)] = results
+        print(f"scale {scale}: {len(results)} benchmarks, {api.calls} API calls", file=sys.stderr)
+    return report
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", type=int, nargs="+", default=[1000, 10000],
+                        help="catalog and collection sizes to benchmark")
+    parser.add_argument("--repeat", type=int, default=5, help="samples per benchmark")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic data")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated API latency, in seconds")
+    parser.add_argument("--output", default="-", help="file to write the JSON report to, '-' for stdout")
+    args = parser.parse_args(argv)
+
+    report = run(args.scales, args.repeat, args.seed, args.latency)
+    if args.output == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
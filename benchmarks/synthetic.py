@@ -0,0 +1,304 @@
+import random
+from typing import Dict, List, Tuple
+
+from pokemontcgsdk import Card, Set
+from pokemontcgsdk.ability import Ability
+from pokemontcgsdk.attack import Attack
+from pokemontcgsdk.cardimage import CardImage
+from pokemontcgsdk.cardmarket import Cardmarket, CardmarketPrices
+from pokemontcgsdk.legality import Legality
+from pokemontcgsdk.setimage import SetImage
+from pokemontcgsdk.tcgplayer import TCGPlayer, TCGPrice, TCGPrices
+
+from utils.deck import Deck
+
+SET_PREFIXES = ["bw", "xy", "sm", "swsh", "sv"]
+POKEMON_TYPES = [
+    "Colorless", "Darkness", "Dragon", "Fairy", "Fighting", "Fire",
+    "Grass", "Lightning", "Metal", "Psychic", "Water",
+]
+TRAINER_SUBTYPES = ["Item", "Pokémon Tool", "Supporter", "Stadium"]
+SYLLABLES = ["pi", "ka", "char", "man", "der", "bul", "ba", "saur", "squir", "tle", "gen", "gar",
+             "eev", "ee", "lu", "gia", "dra", "go", "mew", "two", "zor", "ua", "ark", "rai"]
+CARD_TEXTS = [
+    "Search your deck for a Basic Pokémon and put it onto your Bench. Then, shuffle your deck.",
+    "Draw 3 cards.",
+    "Flip a coin. If heads, your opponent's Active Pokémon is now Paralyzed.",
+    "Attach a basic Energy card from your discard pile to 1 of your Benched Pokémon.",
+    "Shuffle your hand into your deck. Then, draw 6 cards.",
+    "Switch your Active Pokémon with 1 of your Benched Pokémon.",
+    "This attack does 30 damage to each of your opponent's Benched Pokémon.",
+    "Heal 60 damage from 1 of your Pokémon.",
+    "Discard 2 Energy from this Pokémon.",
+    "Look at the top 7 cards of your deck and put any number of Supporter cards you find there into your hand.",
+]
+LEGAL = Legality(unlimited="Legal", expanded="Legal", standard="Legal")
+
+
+def make_name(rng: random.Random) -> str:
+    """
+    Build a pronounceable, capitalized Pokémon-like name.
+
+    Args:
+        rng (random.Random): Random source.
+
+    Returns:
+        str: The generated name.
+    """
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3))).capitalize()
+
+
+def make_ptcgo_code(index: int) -> str:
+    """
+    Build a unique three letter PTCGO code for the set at `index`.
+
+    Args:
+        index (int): Index of the set.
+
+    Returns:
+        str: The PTCGO code.
+    """
+    return "".join(chr(ord("A") + (index // 26 ** power) % 26) for power in (2, 1, 0))
+
+
+def make_sets(count: int) -> List[Set]:
+    """
+    Build `count` sets spread over the post-BW eras, ordered by release date.
+
+    Args:
+        count (int): Number of sets to build.
+
+    Returns:
+        List[Set]: The generated sets.
+    """
+    sets = []
+    for index in range(count):
+        prefix = SET_PREFIXES[index * len(SET_PREFIXES) // count]
+        set_id = f"{prefix}{index + 1}"
+        year, month = 2011 + index // 12, index % 12 + 1
+        sets.append(Set(
+            id=set_id,
+            images=SetImage(
+                symbol=f"https://images.pokemontcg.io/{set_id}/symbol.png",
+                logo=f"https://images.pokemontcg.io/{set_id}/logo.png",
+            ),
+            legalities=LEGAL,
+            name=f"Synthetic Set {index + 1}",
+            printedTotal=0,
+            ptcgoCode=make_ptcgo_code(index),
+            releaseDate=f"{year}/{month:02d}/01",
+            series=prefix.upper(),
+            total=0,
+            updatedAt=f"{year}/{month:02d}/01 00:00:00",
+        ))
+    return sets
+
+
+def make_prices(rng: random.Random, card_id: str) -> Tuple[TCGPlayer, Cardmarket]:
+    """
+    Build random tcgplayer and cardmarket price blocks for a card.
+
+    Args:
+        rng (random.Random): Random source.
+        card_id (str): ID of the card the prices belong to.
+
+    Returns:
+        Tuple[TCGPlayer, Cardmarket]: The price blocks.
+    """
+    market = round(rng.lognormvariate(-1.0, 1.2), 2)
+    tcgplayer = TCGPlayer(
+        url=f"https://prices.pokemontcg.io/tcgplayer/{card_id}",
+        updatedAt="2024/11/19",
+        prices=TCGPrices(
+            normal=TCGPrice(low=round(market * 0.6, 2), mid=market, high=round(market * 4, 2), market=market,
+                            directLow=None),
+            holofoil=None, reverseHolofoil=None, firstEditionHolofoil=None, firstEditionNormal=None,
+        ),
+    )
+    trend = round(market * rng.uniform(0.8, 1.2), 2)
+    cardmarket = Cardmarket(
+        url=f"https://prices.pokemontcg.io/cardmarket/{card_id}",
+        updatedAt="2024/11/19",
+        prices=CardmarketPrices(
+            averageSellPrice=trend, lowPrice=round(trend * 0.5, 2), trendPrice=trend, germanProLow=0.0,
+            suggestedPrice=0.0, reverseHoloSell=None, reverseHoloLow=None, reverseHoloTrend=None,
+            lowPriceExPlus=None, avg1=trend, avg7=trend, avg30=trend, reverseHoloAvg1=None, reverseHoloAvg7=None,
+            reverseHoloAvg30=None,
+        ),
+    )
+    return tcgplayer, cardmarket
+
+
+def make_catalog(size: int, seed: int = 0) -> Tuple[List[Set], Dict[str, Card]]:
+    """
+    Build a synthetic catalog of `size` cards. Roughly 60% are Pokémon organized in evolution lines
+    of up to three stages, 30% are Trainers and 10% are Energies.
+
+    Cards are built straight from the SDK dataclasses rather than through `dacite`, which would take minutes
+    at the 100k scale.
+
+    Args:
+        size (int): Number of cards in the catalog.
+        seed (int): Seed of the random source.
+
+    Returns:
+        Tuple[List[Set], Dict[str, Card]]: The sets and a dictionary of card IDs to cards.
+    """
+    rng = random.Random(seed)
+    sets = make_sets(max(2, size // 150))
+    families = []
+    for _ in range(max(1, size // 12)):
+        base = make_name(rng)
+        stages = [base, f"{base}mon", f"Mega {base}"][:rng.choice([1, 2, 2, 3])]
+        families.append((stages, rng.choice(POKEMON_TYPES)))
+    trainer_names = [f"{make_name(rng)}'s {word}" for word in ["Ball", "Research", "Switch", "Rod", "Catcher"]
+                     for _ in range(max(1, size // 100))]
+
+    cards: Dict[str, Card] = {}
+    for index in range(size):
+        card_set = sets[index * len(sets) // size]
+        card_set.total += 1
+        card_set.printedTotal += 1
+        number = str(card_set.total)
+        card_id = f"{card_set.id}-{number}"
+        roll = rng.random()
+        attacks, abilities, rules, evolves_from, types = None, None, None, None, None
+        if roll < 0.6:
+            stages, energy_type = rng.choice(families)
+            stage = rng.randrange(len(stages))
+            name = stages[stage]
+            supertype = "Pokémon"
+            subtypes = [["Basic"], ["Stage 1"], ["Stage 2"]][stage]
+            evolves_from = stages[stage - 1] if stage else None
+            types = [energy_type]
+            if rng.random() < 0.15:
+                name += " ex"
+                subtypes = subtypes + ["ex"]
+                rules = ["Pokémon ex rule: When your Pokémon ex is Knocked Out, your opponent takes 2 Prize cards."]
+            attacks = [Attack(name=make_name(rng), cost=[energy_type] * (attack + 1),
+                              convertedEnergyCost=attack + 1, damage=str(30 * (attack + 1)),
+                              text=rng.choice(CARD_TEXTS))
+                       for attack in range(rng.randint(1, 2))]
+            if rng.random() < 0.2:
+                abilities = [Ability(name=make_name(rng), text=rng.choice(CARD_TEXTS), type="Ability")]
+        elif roll < 0.9:
+            name = rng.choice(trainer_names)
+            supertype = "Trainer"
+            subtypes = [rng.choice(TRAINER_SUBTYPES)]
+            rules = [rng.choice(CARD_TEXTS)]
+        else:
+            supertype = "Energy"
+            if rng.random() < 0.7:
+                name = f"Basic {rng.choice(POKEMON_TYPES)} Energy"
+                subtypes = ["Basic"]
+            else:
+                name = f"{make_name(rng)} Energy"
+                subtypes = ["Special"]
+                rules = [rng.choice(CARD_TEXTS)]
+        tcgplayer, cardmarket = make_prices(rng, card_id)
+        cards[card_id] = Card(
+            abilities=abilities, artist="Synthetic", ancientTrait=None, attacks=attacks, cardmarket=cardmarket,
+            convertedRetreatCost=None, evolvesFrom=evolves_from, flavorText=None, hp=None, id=card_id,
+            images=CardImage(
+                small=f"https://images.pokemontcg.io/{card_set.id}/{number}.png",
+                large=f"https://images.pokemontcg.io/{card_set.id}/{number}_hires.png",
+            ),
+            legalities=LEGAL, regulationMark=None, name=name, nationalPokedexNumbers=None, number=number,
+            rarity="Common", resistances=None, retreatCost=None, rules=rules, set=card_set, subtypes=subtypes,
+            supertype=supertype, tcgplayer=tcgplayer, types=types, weaknesses=None,
+        )
+    return sets, cards
+
+
+def make_collection(catalog: Dict[str, Card], seed: int = 0) -> Dict[str, Tuple[Card, int]]:
+    """
+    Build an owned-card collection holding every catalog card, in the `cards.pkl` format.
+
+    Args:
+        catalog (Dict[str, Card]): Dictionary of card IDs to cards.
+        seed (int): Seed of the random source.
+
+    Returns:
+        Dict[str, Tuple[Card, int]]: A dictionary of card IDs to tuples of cards and quantities.
+    """
+    rng = random.Random(seed)
+    return {card_id: (card, rng.randint(1, 4)) for card_id, card in catalog.items()}
+
+
+def split_by_supertype(catalog: Dict[str, Card]) -> Dict[str, List[Card]]:
+    """
+    Group catalog cards by supertype.
+
+    Args:
+        catalog (Dict[str, Card]): Dictionary of card IDs to cards.
+
+    Returns:
+        Dict[str, List[Card]]: The cards of each supertype.
+    """
+    by_supertype: Dict[str, List[Card]] = {"Pokémon": [], "Trainer": [], "Energy": []}
+    for card in catalog.values():
+        by_supertype[card.supertype].append(card)
+    return by_supertype
+
+
+def make_deck(by_supertype: Dict[str, List[Card]], name: str, rng: random.Random) -> Deck:
+    """
+    Build a 60-card deck made of a few Pokémon, a Trainer core and some Energy.
+
+    Args:
+        by_supertype (Dict[str, List[Card]]): Catalog cards grouped by supertype.
+        name (str): Name of the deck.
+        rng (random.Random): Random source.
+
+    Returns:
+        Deck: The generated deck.
+    """
+    cards: List[Card] = []
+    for pool, count in (("Pokémon", 16), ("Trainer", 34), ("Energy", 10)):
+        picks = by_supertype[pool] or by_supertype["Pokémon"]
+        while count > 0:
+            card = rng.choice(picks)
+            copies = min(count, rng.randint(1, 4))
+            cards.extend([card] * copies)
+            count -= copies
+    return Deck(name, cards)
+
+
+def make_decks(catalog: Dict[str, Card], count: int, seed: int = 0) -> Dict[str, Deck]:
+    """
+    Build `count` synthetic decks in the `decks.pkl` format.
+
+    Args:
+        catalog (Dict[str, Card]): Dictionary of card IDs to cards.
+        count (int): Number of decks to build.
+        seed (int): Seed of the random source.
+
+    Returns:
+        Dict[str, Deck]: A dictionary of deck names to decks.
+    """
+    rng = random.Random(seed)
+    by_supertype = split_by_supertype(catalog)
+    decks = {}
+    for index in range(count):
+        deck = make_deck(by_supertype, f"Deck {index + 1}", rng)
+        decks[deck.name] = deck
+    return decks
+
+
+def make_decklist(deck: Deck) -> str:
+    """
+    Render a deck as a PTCGO decklist, including the section headers the importer skips.
+
+    Args:
+        deck (Deck): The deck to render.
+
+    Returns:
+        str: The decklist.
+    """
+    lines = []
+    for header, cards in (("Pokémon", deck.get_pokemon_cards()), ("Trainer", deck.get_trainer_cards()),
+                          ("Energy", deck.get_energy_cards())):
+        lines.append(f"{header}: {sum(quantity for _, quantity in cards)}")
+        lines.extend(f"{quantity} {card.name} {card.set.ptcgoCode} {card.number}" for card, quantity in cards)
+        lines.append("")
+    return "\n".join(lines)
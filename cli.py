@@ -0,0 +1,347 @@
+"""
+Command-line entry point for batch deck and collection jobs, without the Streamlit app.
+
+Decklist files hold one deck each, in the PTCGL format the deck builder exports, and are named after the deck.
+They are parsed in parallel by a pool of processes, and a JSON object per file is written to stdout as soon as
+it is ready, in the order of the arguments.
+
+Usage:
+    python cli.py validate decks/*.txt
+    python cli.py import --user Ash decks/*.txt
+    python cli.py export --user Ash --format csv > decks.csv
+    python cli.py export --user Ash --collection --format jsonl > collection.jsonl
+    python cli.py reconcile --user Ash collection.csv --apply
+    python cli.py ingest --corpus "Worlds 2024" worlds-2024.txt
+    python cli.py index-images --set sv1 sv2
+    python cli.py jobs --submit compact_storage
+"""
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from pokemontcgsdk import Card
+
+from utils.bulk_import import resolve_collection_import
+from utils.catalog import get_catalog
+from utils.corpus import ingest_corpus
+from utils.deck import Deck
+from utils.export import EXPORT_FORMATS
+from utils.pokemon_api import get_sets
+from utils.proxies import IMAGE_WORKERS, cached_image_path
+from utils.scheduler import HIGH, get_scheduler
+from utils.storage import commit_changes, load_cards_from_collection, load_decks_from_collection
+
+FORMATS = {"csv": "CSV", "jsonl": "JSON Lines", "ptcgl": "PTCGL"}
+
+
+def load_deck_file(path: str) -> dict:
+    """
+    Parse a decklist file into a deck named after the file, and check its legality. The deck is returned as card
+    IDs and quantities, plus the cards that were not in the catalog, so that workers send little back.
+    Args:
+        path (str): The path of the decklist file.
+    Returns:
+        dict: The file, the deck name, its cards or an error if the file could not be read, its legality
+        and the lines that could not be resolved to a card.
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    try:
+        with open(path, "r", encoding="utf-8-sig") as f:
+            text = f.read()
+    except OSError as e:
+        return {"file": path, "deck": name, "error": str(e)}
+    catalog = get_catalog()
+    known = len(catalog.cards)
+    deck = Deck(name, [])
+    unresolved = deck.import_from_string(text)
+    legal, message = deck.legal()
+    return {
+        "file": path,
+        "deck": name,
+        "cards": [(card.id, quantity) for card, quantity in deck.cards()],
+        # The catalog keeps the insertion order, the cards fetched from the API are the last ones
+        "fetched": list(islice(catalog.cards.values(), known, None)) if len(catalog.cards) > known else [],
+        "legal": legal,
+        "message": message,
+        "unresolved": unresolved,
+    }
+
+
+def load_deck_files(paths: List[str], jobs: int) -> Iterator[Tuple[dict, Optional[Deck]]]:
+    """
+    Parse decklist files in parallel, yielding each result in the order of the paths as soon as it is ready.
+    Args:
+        paths (List[str]): The paths of the decklist files.
+        jobs (int): The number of worker processes.
+    Returns:
+        Iterator[Tuple[dict, Optional[Deck]]]: The JSON summary of each file and its deck, None if the file
+        could not be read.
+    """
+    # Loaded before the workers start, so that forked workers share the catalog instead of each reading it
+    get_sets()
+    get_catalog()
+    if jobs <= 1 or len(paths) <= 1:
+        yield from _build_decks(map(load_deck_file, paths))
+        return
+    chunk_size = max(1, min(32, len(paths) // (jobs * 4)))
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        yield from _build_decks(executor.map(load_deck_file, paths, chunksize=chunk_size))
+
+
+def _build_decks(results: Iterable[dict]) -> Iterator[Tuple[dict, Optional[Deck]]]:
+    catalog = get_catalog()
+    for result in results:
+        if "error" in result:
+            yield result, None
+            continue
+        # Cards the workers fetched from the API are kept in the catalog, saved on exit
+        catalog.add_cards(result["fetched"])
+        cards = [catalog.get(card_id) for card_id, quantity in result["cards"] for _ in range(quantity)]
+        deck = Deck(result["deck"], cards)
+        summary = {"file": result["file"], "deck": deck.name, "cards": len(deck), "legal": result["legal"],
+                   "message": result["message"], "unresolved": result["unresolved"]}
+        yield summary, deck
+
+
+def write_record(record: dict) -> None:
+    sys.stdout.write(json.dumps(record, ensure_ascii=False) + "\n")
+    sys.stdout.flush()
+
+
+def validate(paths: List[str], jobs: int) -> int:
+    """
+    Check the legality of decklist files.
+    Args:
+        paths (List[str]): The paths of the decklist files.
+        jobs (int): The number of worker processes.
+    Returns:
+        int: The exit code, 1 if a file could not be read, has unresolved lines or holds an illegal deck.
+    """
+    failed = 0
+    for summary, _ in load_deck_files(paths, jobs):
+        failed += "error" in summary or not summary["legal"] or bool(summary["unresolved"])
+        write_record(summary)
+    print(f"{len(paths) - failed} of {len(paths)} decks are legal", file=sys.stderr)
+    return 1 if failed else 0
+
+
+def import_decks(paths: List[str], user: str, jobs: int) -> int:
+    """
+    Import decklist files into a user's decks, replacing the decks of the same name.
+    Args:
+        paths (List[str]): The paths of the decklist files.
+        user (str): The user's name.
+        jobs (int): The number of worker processes.
+    Returns:
+        int: The exit code, 1 if a file could not be read or holds no card.
+    """
+    imported_decks: Dict[str, Deck] = {}
+    for summary, deck in load_deck_files(paths, jobs):
+        if deck is not None and len(deck):
+            imported_decks[deck.name] = deck
+        elif "error" not in summary:
+            summary["error"] = "No card could be resolved."
+        write_record(summary)
+    # A single write, as each write of the decks file rewrites all of the user's decks
+    commit_changes({}, imported_decks, user)
+    print(f"Imported {len(imported_decks)} of {len(paths)} decks for {user}", file=sys.stderr)
+    return 0 if len(imported_decks) == len(paths) else 1
+
+
+def export(user: str, collection: bool, deck_names: List[str], export_format: str) -> int:
+    """
+    Write an export of a user's decks or collection to stdout.
+    Args:
+        user (str): The user's name.
+        collection (bool): Whether to export the collection rather than the decks.
+        deck_names (List[str]): The decks to export, all of them if empty.
+        export_format (str): One of FORMATS.
+    Returns:
+        int: The exit code, 1 if a deck does not exist.
+    """
+    collection_lines, decks_lines, _, _ = EXPORT_FORMATS[FORMATS[export_format]]
+    if collection:
+        lines: Iterable[str] = collection_lines(load_cards_from_collection(user))
+    else:
+        decks = load_decks_from_collection(user)
+        missing = [name for name in deck_names if name not in decks]
+        if missing:
+            print(f"No deck named {', '.join(missing)} for {user}", file=sys.stderr)
+            return 1
+        lines = decks_lines([decks[name] for name in deck_names] if deck_names else decks.values())
+    sys.stdout.writelines(lines)
+    sys.stdout.flush()
+    return 0
+
+
+def reconcile(user: str, path: str, apply: bool) -> int:
+    """
+    Compare a user's collection with a CSV or decklist export of the whole collection, e.g. from another
+    collection tracker, and optionally make the collection match it.
+    Args:
+        user (str): The user's name.
+        path (str): The path of the export.
+        apply (bool): Whether to save the quantities of the export, removing the cards it does not list.
+    Returns:
+        int: The exit code, 1 if rows of the export could not be resolved.
+    """
+    owned = load_cards_from_collection(user)
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        expected, unresolved = resolve_collection_import(f, {card_id: card for card_id, (card, _) in owned.items()})
+
+    deltas: Dict[str, Tuple[Card, int]] = {}
+    for card_id in list(owned) + [card_id for card_id in expected if card_id not in owned]:
+        card, owned_quantity = owned.get(card_id, (None, 0))
+        expected_card, expected_quantity = expected.get(card_id, (card, 0))
+        if owned_quantity != expected_quantity:
+            deltas[card_id] = (expected_card, expected_quantity - owned_quantity)
+            write_record({"id": card_id, "name": expected_card.name, "owned": owned_quantity,
+                          "expected": expected_quantity})
+    for line, text in unresolved:
+        write_record({"line": line, "text": text, "error": "Unresolved row."})
+
+    print(f"{len(deltas)} cards differ, {len(unresolved)} rows unresolved", file=sys.stderr)
+    if unresolved:
+        # The unresolved rows may be owned cards, which would be removed
+        if apply:
+            print("Not applying the export, resolve its rows first", file=sys.stderr)
+        return 1
+    if apply:
+        commit_changes(deltas, {}, user)
+    return 0
+
+
+def ingest(path: str, corpus: str) -> int:
+    """
+    Ingest a dump of decklists, e.g. tournament results, as a corpus used by the deck index and recommender.
+    Args:
+        path (str): The path of the dump, decks separated by "Deck: <name>" lines or PTCGL section headers.
+        corpus (str): The name of the corpus, replaced if it exists.
+    Returns:
+        int: The exit code, 1 if the corpus name is invalid or lines could not be resolved.
+    """
+    if not corpus or corpus.startswith(".") or "/" in corpus or os.sep in corpus:
+        print(f"Invalid corpus name {corpus!r}", file=sys.stderr)
+        return 1
+
+    def on_deck(deck: Deck, unresolved: List[Tuple[int, str]]) -> None:
+        write_record({"deck": deck.name, "cards": len(deck), "unresolved": [text for _, text in unresolved]})
+
+    with open(path, "r", encoding="utf-8-sig") as f:
+        summary = ingest_corpus(f, corpus, on_deck=on_deck)
+    print(f"Ingested {summary.decks} decks ({summary.cards} cards) into {corpus}, "
+          f"{summary.unresolved} lines unresolved", file=sys.stderr)
+    return 1 if summary.unresolved else 0
+
+
+def index_images(set_ids: List[str], jobs: int) -> int:
+    """
+    Download the images of the catalog's cards into the image cache and hash them, so that the cards can be
+    recognized in photos.
+    Args:
+        set_ids (List[str]): Only download the cards of these sets, all the catalog's cards by default.
+        jobs (int): The number of worker processes hashing the images.
+    Returns:
+        int: The exit code, 1 if images could not be downloaded.
+    """
+    # Imported here, the image libraries are only needed by this command
+    from utils.recognition import get_recognizer
+
+    catalog = get_catalog()
+    cards = [card for card in catalog if not set_ids or card.set.id in set_ids]
+    with ThreadPoolExecutor(max_workers=IMAGE_WORKERS) as executor:
+        missing = sum(path is None for path in executor.map(cached_image_path, cards))
+    recognizer = get_recognizer()
+    added = recognizer.refresh(jobs)
+    print(f"Cached the images of {len(cards) - missing} cards, {added} newly recognizable "
+          f"({len(recognizer)} in total)", file=sys.stderr)
+    return 1 if missing else 0
+
+
+def run_jobs(job: List[str]) -> int:
+    """
+    Run the background jobs the app left pending and the periodic jobs that are due, e.g. from cron while the app
+    is down, and write a JSON line per finished job. While the app is up, it runs them itself and only the
+    submitted job is run.
+    Args:
+        job (List[str]): A job to run as well, its kind followed by its arguments.
+    Returns:
+        int: The exit code, 1 if a job failed or could not run.
+    """
+    scheduler = get_scheduler()
+    if scheduler.workers < 1:
+        print("No job worker to run the jobs, set JOB_WORKERS to 1 or more", file=sys.stderr)
+        return 1
+    if not scheduler.leader:
+        print("The pending and periodic jobs are run by another process, e.g. the app", file=sys.stderr)
+    if job:
+        try:
+            scheduler.submit(job[0], *job[1:], priority=HIGH)
+        except ValueError as e:  # Unknown kind of job
+            print(e, file=sys.stderr)
+            return 1
+    scheduler.wait_idle()
+    finished = [status for status in reversed(scheduler.status()) if status.finished_at is not None]
+    for status in finished:
+        write_record({"job": status.kind, "args": list(status.args), "state": status.state,
+                      "seconds": round(status.finished_at - status.started_at, 3), "result": status.result})
+    return 1 if any(status.state == "failed" for status in finished) else 0
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    validate_parser = commands.add_parser("validate", help="check the legality of decklist files")
+    validate_parser.add_argument("files", nargs="+", help="decklist files, one deck per file")
+
+    import_parser = commands.add_parser("import", help="import decklist files into a user's decks")
+    import_parser.add_argument("files", nargs="+", help="decklist files, one deck per file")
+    import_parser.add_argument("--user", required=True, help="name of the user")
+
+    images_parser = commands.add_parser("index-images", help="cache and hash card images for photo recognition")
+    images_parser.add_argument("--set", nargs="*", default=[], dest="sets", help="set IDs, all sets by default")
+
+    for command_parser in (validate_parser, import_parser, images_parser):
+        command_parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="worker processes")
+
+    export_parser = commands.add_parser("export", help="export a user's decks or collection to stdout")
+    export_parser.add_argument("decks", nargs="*", help="decks to export, all of them by default")
+    export_parser.add_argument("--user", required=True, help="name of the user")
+    export_parser.add_argument("--collection", action="store_true", help="export the collection instead")
+    export_parser.add_argument("--format", choices=FORMATS, default="ptcgl", help="export format")
+
+    reconcile_parser = commands.add_parser("reconcile", help="compare a user's collection with an export")
+    reconcile_parser.add_argument("file", help="CSV or decklist export of the whole collection")
+    reconcile_parser.add_argument("--user", required=True, help="name of the user")
+    reconcile_parser.add_argument("--apply", action="store_true", help="make the collection match the export")
+
+    ingest_parser = commands.add_parser("ingest", help="ingest a dump of decklists as a corpus")
+    ingest_parser.add_argument("file", help="decklists, each starting with a 'Deck: <name>' line")
+    ingest_parser.add_argument("--corpus", required=True, help="name of the corpus")
+
+    jobs_parser = commands.add_parser("jobs", help="run the pending and due background jobs")
+    jobs_parser.add_argument("--submit", nargs="+", default=[], metavar="JOB", help="kind and arguments of a job")
+
+    args = parser.parse_args(argv)
+    if args.command == "validate":
+        return validate(args.files, args.jobs)
+    if args.command == "import":
+        return import_decks(args.files, args.user, args.jobs)
+    if args.command == "export":
+        return export(args.user, args.collection, args.decks, args.format)
+    if args.command == "ingest":
+        return ingest(args.file, args.corpus)
+    if args.command == "index-images":
+        return index_images(args.sets, args.jobs)
+    if args.command == "jobs":
+        return run_jobs(args.submit)
+    return reconcile(args.user, args.file, args.apply)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
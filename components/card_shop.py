@@ -1,11 +1,41 @@
+import io
 import re
+from typing import Dict, Tuple
+
 import streamlit as st
 from pokemontcgsdk import Card, Set
+from components.collection_state import set_owned_quantity
+from utils.bulk_import import resolve_collection_import
+from utils.catalog import get_catalog
 from utils.pokemon_api import try_find_card_with_params, process_card_name
-from utils.storage import save_card_to_collection
+from utils.storage import save_cards_to_collection
+from utils.text_search import get_text_index
+from utils.write_queue import get_write_queue
 
 # Define constants
 POST_BW_SET_IDS = ["bw*", "xy*", "sm*", "swsh*", "sv*"]
+SEARCH_CACHE_TTL = "1h"
+
+
+@st.cache_data(ttl=SEARCH_CACHE_TTL, max_entries=256)
+def search_cards(**kwargs) -> list[Card]:
+    """
+    Searches the Pokémon TCG API, caching the results across reruns and sessions.
+
+    Args:
+        **kwargs: The search parameters, see `try_find_card_with_params`.
+
+    Returns:
+        list[Card]: The cards found.
+
+    Raises:
+        LookupError: If no cards were found or the search failed, so that the miss is not cached.
+    """
+    cards, found = try_find_card_with_params(**kwargs)
+    if not found:
+        raise LookupError(kwargs)
+    return cards
+
 
 def display_cards(cards: list[Card], batch_size: int = 50) -> None:
     """
@@ -53,20 +83,211 @@ def display_cards(cards: list[Card], batch_size: int = 50) -> None:
             st.session_state.displayed_cards_idx += batch_size
             st.rerun()
 
+
+def display_cards_batch(cards: list[Card], key: str) -> None:
+    """
+    Display cards as a single editable table in a form, where quantities can be set for any number of cards
+    and added in one go. The page holds one widget however many cards are found, and editing quantities does
+    not rerun the app until the form is submitted.
+    Args:
+        cards (list[Card]): List of Card objects to display.
+        key (str): Key of the table, e.g. the search query, so that edits do not carry over to other results.
+    """
+    # Imported here, pandas is only needed to build the table
+    import pandas as pd
+
+    owned = st.session_state.cards
+    table = pd.DataFrame({
+        "Card": [card.images.small for card in cards],
+        "Name": [card.name for card in cards],
+        "Set": [card.set.name for card in cards],
+        "Number": [card.number for card in cards],
+        "Owned": [owned[card.id][1] if card.id in owned else 0 for card in cards],
+        "Add": [0] * len(cards),
+    })
+    with st.form("batch_add", clear_on_submit=True, border=False):
+        edited = st.data_editor(
+            table,
+            key=f"batch_add_{key}",
+            hide_index=True,
+            use_container_width=True,
+            disabled=["Card", "Name", "Set", "Number", "Owned"],
+            column_config={
+                "Card": st.column_config.ImageColumn("Card", width="small"),
+                "Add": st.column_config.NumberColumn("Add", min_value=0, max_value=99, step=1),
+            },
+        )
+        submitted = st.form_submit_button("Add Selected Cards", use_container_width=True)
+
+    if submitted:
+        selected = {
+            cards[row].id: (cards[row], int(quantity))
+            for row, quantity in enumerate(edited["Add"].fillna(0).tolist()) if quantity > 0
+        }
+        if not selected:
+            st.toast("Set the quantity of the cards to add first.")
+            return
+        add_cards_to_collection(selected)
+        st.toast(f"Successfully added {sum(quantity for _, quantity in selected.values())} cards "
+                 f"({len(selected)} unique)")
+        st.rerun()
+
+
 def add_card_to_collection(card: Card, quantity: int) -> None:
     """
-    Add a card to the user's collection and save it to persistent storage.
+    Add a card to the user's collection and queue saving it to persistent storage.
     Args:
         card (Card): Card object to add.
         quantity (int): Quantity of the card to add.
     """
-    if card.id in st.session_state.cards:
-        _, current_quantity = st.session_state.cards[card.id]
-        st.session_state.cards[card.id] = (card, current_quantity + quantity)
-    else:
-        st.session_state.cards[card.id] = (card, quantity)
+    current_quantity = st.session_state.cards[card.id][1] if card.id in st.session_state.cards else 0
+    set_owned_quantity(card, current_quantity + quantity)
+
+    get_write_queue(st.session_state["name"]).add_cards(card, quantity)
+
+
+def add_cards_to_collection(new_cards: Dict[str, Tuple[Card, int]]) -> None:
+    """
+    Add many cards to the user's collection and save them to persistent storage in a single write.
+    Args:
+        new_cards (Dict[str, Tuple[Card, int]]): Dictionary of card IDs to tuples of Card objects and quantities to add.
+    """
+    save_cards_to_collection(new_cards, st.session_state["name"])
+    for card_id, (card, quantity) in new_cards.items():
+        current_quantity = st.session_state.cards[card_id][1] if card_id in st.session_state.cards else 0
+        set_owned_quantity(card, current_quantity + quantity)
+
+
+def show_bulk_import() -> None:
+    """
+    Display the bulk import interface, adding every card of a CSV or decklist export to the collection
+    in a single storage write.
+    """
+    with st.expander("Bulk Import"):
+        st.caption(
+            "Upload a CSV with a quantity column and either a card ID column or set code and number columns, "
+            "or a list of lines such as `3 Regidrago V SIT 135`."
+        )
+        uploaded = st.file_uploader("Collection export", type=["csv", "txt"], label_visibility="collapsed")
+        pasted = st.text_area("Or paste card lines here", height=150)
+        if not st.button("Import Cards", use_container_width=True, disabled=not (uploaded or pasted)):
+            return
+
+        if uploaded is not None:
+            raw = uploaded
+            total_bytes = uploaded.size or 1
+        else:
+            raw = io.BytesIO(pasted.encode("utf-8"))
+            total_bytes = len(pasted.encode("utf-8")) or 1
+        progress_bar = st.progress(0.0, text="Resolving cards...")
+
+        def report_progress(rows: int) -> None:
+            progress_bar.progress(min(raw.tell() / total_bytes, 1.0), text=f"Resolved {rows} rows...")
+
+        owned_cards = {card_id: card for card_id, (card, _) in st.session_state.cards.items()}
+        lines = io.TextIOWrapper(raw, encoding="utf-8-sig", newline="")
+        resolved, unresolved = resolve_collection_import(lines, owned_cards, report_progress)
+        progress_bar.progress(1.0, text="Saving collection...")
+
+        if resolved:
+            add_cards_to_collection(resolved)
+        progress_bar.empty()
+
+        added = sum(quantity for _, quantity in resolved.values())
+        st.success(f"Imported {added} cards ({len(resolved)} unique).")
+        if unresolved:
+            st.warning(f"{len(unresolved)} rows could not be resolved:")
+            st.dataframe(
+                [{"Line": line, "Row": text} for line, text in unresolved],
+                use_container_width=True, hide_index=True,
+            )
+
+
+def recognize_photos(photos: list, grid: Tuple[int, int] | None) -> list[list[Tuple[Card, int]]]:
+    """
+    Recognize the cards of uploaded photos, keeping the results of each photo for the session so that reruns
+    do not recognize them again.
+    Args:
+        photos (list): The uploaded photos.
+        grid (Tuple[int, int] | None): The pockets per row and per column of binder pages, or None for single cards.
+    Returns:
+        list[list[Tuple[Card, int]]]: The candidate cards and their distances for each card shown, in order.
+    """
+    # Imported here, the image libraries are only needed to recognize photos
+    from utils.recognition import candidates_to_cards, get_recognizer
+
+    recognizer = get_recognizer()
+    results = st.session_state.setdefault("scan_results", {})
+    slots = []
+    for photo in photos:
+        key = (photo.file_id, grid)
+        if key not in results:
+            matches = recognizer.match_page(photo, grid) if grid else [recognizer.match(photo)]
+            results[key] = [candidates_to_cards(candidates) for candidates in matches]
+        slots.extend(results[key])
+    return slots
+
 
-    save_card_to_collection(card, quantity, st.session_state["name"])
+def show_scan_import() -> None:
+    """
+    Display the scan interface, recognizing cards in photos or scans of single cards or binder pages
+    and adding the confirmed cards to the collection in a single storage write.
+    """
+    with st.expander("Scan Cards"):
+        st.caption("Upload photos or scans of cards, or of binder pages. Cards are recognized by their artwork "
+                   "among the card images downloaded so far.")
+        photos = st.file_uploader("Photos", type=["jpg", "jpeg", "png", "webp"], accept_multiple_files=True,
+                                  key="scan_photos", label_visibility="collapsed")
+        col1, col2, col3 = st.columns(3, vertical_alignment="bottom")
+        binder = col1.toggle("Binder pages", key="scan_binder")
+        columns = col2.number_input("Pockets per row", min_value=1, max_value=4, value=3, disabled=not binder)
+        rows = col3.number_input("Pockets per column", min_value=1, max_value=4, value=3, disabled=not binder)
+        if not photos:
+            return
+
+        slots = recognize_photos(photos, (int(columns), int(rows)) if binder else None)
+        if not any(slots):
+            st.warning("No cards recognized. Card images are downloaded when printing proxies or browsing cards.")
+            return
+        with st.form("scan_add", border=False):
+            selected: Dict[str, Tuple[Card, int]] = {}
+            for position, candidates in enumerate(slots):
+                col1, col2 = st.columns([1, 5], vertical_alignment="center")
+                choice = col2.selectbox(
+                    f"Card {position + 1}",
+                    [None] + [card for card, _ in candidates],
+                    index=1 if candidates else 0,
+                    format_func=lambda card: "Skip" if card is None
+                    else f"{card.name} ({card.set.name} {card.number})",
+                    key=f"scan_choice_{position}",
+                )
+                if candidates:
+                    col1.image(candidates[0][0].images.small, use_container_width=True)
+                if choice is not None:
+                    selected[choice.id] = (choice, selected[choice.id][1] + 1 if choice.id in selected else 1)
+            submitted = st.form_submit_button("Add Recognized Cards", use_container_width=True)
+
+        if submitted and selected:
+            add_cards_to_collection(selected)
+            st.session_state.pop("scan_results", None)
+            st.toast(f"Successfully added {sum(quantity for _, quantity in selected.values())} cards "
+                     f"({len(selected)} unique)")
+
+
+def search_card_text(query: str, card_name: str = "", set_id: str | None = None) -> list[Card]:
+    """
+    Search the attack, ability and rules text of the cards of the catalog.
+    Args:
+        query (str): The text to search, "quoted phrases" must match word for word.
+        card_name (str): Case-insensitive substring the card name must contain.
+        set_id (str | None): Only return the cards of this set.
+    Returns:
+        list[Card]: The matching cards, most relevant first.
+    """
+    catalog = get_catalog()
+    hits = get_text_index().search(query, limit=300, set_ids=[set_id] if set_id else None)
+    cards = [card for hit in hits if (card := catalog.get(hit.card_id)) is not None]
+    return [card for card in cards if card_name.lower() in card.name.lower()]
 
 
 def filter_sets_by_pattern(sets: list[Set], patterns: list[str]) -> list[Set]:
@@ -89,6 +310,11 @@ def show_card_shop(sets: list[Set]) -> None:
         sets (list[Set]): List of available sets.
     """
     st.header("Get a Card", anchor=False)
+    show_bulk_import()
+    show_scan_import()
+
+    batch_mode = st.toggle("Batch add", value=True, key="shop_batch_mode",
+                           help="Set quantities for many cards in a table and add them together")
 
     # Input fields for card search
     col1, col2 = st.columns(2)
@@ -101,11 +327,23 @@ def show_card_shop(sets: list[Set]) -> None:
             f"{s.name} ({s.ptcgoCode})" for s in filter_sets_by_pattern(sorted_sets, POST_BW_SET_IDS)
         ]
         set_name = st.selectbox("Select Set", filtered_sets)
+    card_text = st.text_input("Card Text", placeholder='Attack, ability or rules text, e.g. "search your deck" basic')
 
-    if card_name or set_name:
-        # Process set selection
-        set_name_clean = re.sub(r"\(.*\)", "", set_name).strip()
-        set_id = next((s.id for s in sets if s.name == set_name_clean), None)
+    # Process set selection
+    set_name_clean = re.sub(r"\(.*\)", "", set_name).strip()
+    set_id = next((s.id for s in sets if s.name == set_name_clean), None)
+
+    if card_text:
+        cards = search_card_text(card_text, card_name, set_id if set_name != "-" else None)
+        if not cards:
+            st.warning("No cards found with that text. Please try again.")
+        else:
+            st.success(f"Found {len(cards)} cards")
+            if batch_mode:
+                display_cards_batch(cards, card_text)
+            else:
+                display_cards(cards)
+    elif card_name or set_name:
         set_query = f" set.id:{set_id}" if set_name != "-" else ""
         post_bw_filter = "(set.id:bw* or set.id:xy* or set.id:sm* or set.id:swsh* or set.id:sv*)"
 
@@ -116,11 +354,17 @@ def show_card_shop(sets: list[Set]) -> None:
             "page": 1,
             "orderBy": "set.releaseDate,number",
         }
-        cards, found = try_find_card_with_params(**kwargs)
+        try:
+            cards, found = search_cards(**kwargs), True
+        except LookupError:
+            cards, found = None, False
 
         # Handle search results
         if not found:
             st.warning("No cards found with that name. Please try again.")
         else:
             st.success(f"Found {len(cards)} cards")
-            display_cards(cards[::-1])  # Reverse card list for display
+            if batch_mode:
+                display_cards_batch(cards[::-1], kwargs["q"])  # Reverse card list for display
+            else:
+                display_cards(cards[::-1])
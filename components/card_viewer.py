@@ -1,10 +1,16 @@
 from collections import defaultdict, deque
-from typing import Dict, Tuple, Optional, List
+from typing import Dict, NamedTuple, Tuple, Optional, List
 
 import streamlit as st
 from pokemontcgsdk import Card
 
-from utils.storage import remove_one_card_from_collection
+from components.collection_state import set_owned_quantity
+from utils.export import EXPORT_FORMATS, export_to_file, read_and_close
+from utils.owned_cards import OwnedCards
+from utils.scheduler import LOW, submit
+from utils.text_search import get_text_index
+from utils.valuation import SOURCES, load_price_history
+from utils.write_queue import get_write_queue
 
 
 # Code generated by OpenAI's ChatGPT o1-preview
@@ -186,14 +192,13 @@ def sort_cards(cards_dict: Dict[str, Tuple[Card, int]]) -> List[Tuple[Card, int]
     return sorted_pokemon + sorted_trainers + sorted_energies
 
 
-def view_collection(cards_dict: Dict[str, Tuple[Card, int]]) -> None:
+def view_collection(sorted_cards: List[Tuple[Card, int]]) -> None:
     """
     Displays a collection of cards, allowing the user to remove cards from the collection.
 
     Args:
-        cards_dict (Dict[str, Tuple[Card, int]]): Dictionary of card IDs to tuples of Card objects and quantities.
+        sorted_cards (List[Tuple[Card, int]]): The cards and their quantities, in display order.
     """
-    sorted_cards = sort_cards(cards_dict)
     num_columns = 5
     columns = st.columns(num_columns)
     for idx, (card, quantity) in enumerate(sorted_cards):
@@ -205,74 +210,80 @@ def view_collection(cards_dict: Dict[str, Tuple[Card, int]]) -> None:
                 use_container_width=True
             )
             if button:
-                remove_one_card_from_collection(card.id, st.session_state["name"])
-                st.session_state.cards[card.id] = (card, quantity - 1)
-                if quantity > 1:
-                    st.session_state.cards[card.id] = (card, quantity - 1)
-                else:
-                    st.session_state.cards.pop(card.id)
+                set_owned_quantity(card, quantity - 1)
+                get_write_queue(st.session_state["name"]).add_cards(card, -1)
                 st.toast(f"Successfully removed 1 x '{card.name}'")
                 st.rerun()
 
 
-def render_sidebar(cards_dict: Dict[str, Tuple[Card, int]]) -> Optional[Dict[str, Tuple[Card, int]]]:
+class CardFilters(NamedTuple):
+    non_rulebox: bool
+    supertypes: Tuple[str, ...]
+    pokemon_types: Tuple[str, ...]
+    search_query: str
+    text_query: str
+
+
+POKEMON_TYPES = [
+    "Colorless",
+    "Darkness",
+    "Dragon",
+    "Fairy",
+    "Fighting",
+    "Fire",
+    "Grass",
+    "Lightning",
+    "Metal",
+    "Psychic",
+    "Water",
+]
+
+
+def filter_cards(
+        cards_dict: Dict[str, Tuple[Card, int]],
+        non_rulebox: bool = False,
+        supertypes: Optional[List[str]] = None,
+        pokemon_types: Optional[List[str]] = None,
+        search_query: str = "",
+        text_query: str = "",
+) -> Dict[str, Tuple[Card, int]]:
     """
-    Renders the sidebar filters and applies them to the cards dictionary.
+    Applies the sidebar filters to the cards dictionary.
 
     Args:
         cards_dict (Dict[str, Tuple[Card, int]]): The original dictionary of cards.
+        non_rulebox (bool): Whether to keep only cards without a rule box.
+        supertypes (Optional[List[str]]): Supertypes to keep, all of them if empty.
+        pokemon_types (Optional[List[str]]): Pokémon types to keep, all of them if empty.
+        search_query (str): Case-insensitive substring the card name must contain.
+        text_query (str): Query the attack, ability or rules text of the cards must match, see `TextIndex.search`.
 
     Returns:
-        Optional[Dict[str, Tuple[Card, int]]]: The filtered dictionary of cards, or None if no cards match.
+        Dict[str, Tuple[Card, int]]: The filtered dictionary of cards.
     """
-    st.sidebar.header("Filter Options")
-
     # Filter by Rulebox
-    non_rulebox = st.sidebar.checkbox("Non-Rulebox Cards Only", value=False)
     if non_rulebox:
         cards_dict = {
             k: v for k, v in cards_dict.items() if not getattr(v[0], "rules", None)
         }
 
     # Filter by Supertype
-    supertypes = ["Trainer", "Energy", "Pokémon"]
-    selected_supertypes = st.sidebar.multiselect(
-        "Filter by Supertype", options=supertypes, default=[]
-    )
-    if selected_supertypes:
+    if supertypes:
         cards_dict = {
-            k: v for k, v in cards_dict.items() if v[0].supertype in selected_supertypes
+            k: v for k, v in cards_dict.items() if v[0].supertype in supertypes
         }
 
     # Filter by Pokémon Type (applies only to Pokémon cards)
-    if "Pokémon" in selected_supertypes or not selected_supertypes:
-        pokemon_types = [
-            "Colorless",
-            "Darkness",
-            "Dragon",
-            "Fairy",
-            "Fighting",
-            "Fire",
-            "Grass",
-            "Lightning",
-            "Metal",
-            "Psychic",
-            "Water",
-        ]
-        selected_pokemon_types = st.sidebar.multiselect(
-            "Filter by Pokémon Type", options=pokemon_types, default=[]
-        )
-        if selected_pokemon_types:
-            cards_dict = {
-                k: v
-                for k, v in cards_dict.items()
-                if v[0].supertype == "Pokémon"
-                   and v[0].types
-                   and any(t in selected_pokemon_types for t in v[0].types)
-            }
+    if pokemon_types:
+        cards_dict = {
+            k: v
+            for k, v in cards_dict.items()
+            if v[0].supertype == "Pokémon"
+               and v[0].types
+               and any(t in pokemon_types for t in v[0].types)
+        }
 
     # Search by Name
-    search_query = st.sidebar.text_input("Search by Name")
     if search_query:
         cards_dict = {
             k: v
@@ -280,13 +291,138 @@ def render_sidebar(cards_dict: Dict[str, Tuple[Card, int]]) -> Optional[Dict[str
             if search_query.lower() in v[0].name.lower()
         }
 
-    # Return None if no cards match
-    if not cards_dict:
-        return None
+    # Search the card text, the owned cards are added to the index if the catalog does not know them
+    if text_query and cards_dict:
+        text_index = get_text_index()
+        text_index.add_cards(card for card, _ in cards_dict.values())
+        hits = text_index.search(text_query, limit=None, card_ids=cards_dict)
+        cards_dict = {hit.card_id: cards_dict[hit.card_id] for hit in hits}
 
     return cards_dict
 
 
+def render_sidebar() -> CardFilters:
+    """
+    Renders the sidebar filters.
+
+    Returns:
+        CardFilters: The selected filters, the arguments of `filter_cards` after the cards.
+    """
+    st.sidebar.header("Filter Options")
+
+    non_rulebox = st.sidebar.checkbox("Non-Rulebox Cards Only", value=False)
+
+    supertypes = ["Trainer", "Energy", "Pokémon"]
+    selected_supertypes = st.sidebar.multiselect(
+        "Filter by Supertype", options=supertypes, default=[]
+    )
+
+    selected_pokemon_types = []
+    if "Pokémon" in selected_supertypes or not selected_supertypes:
+        selected_pokemon_types = st.sidebar.multiselect(
+            "Filter by Pokémon Type", options=POKEMON_TYPES, default=[]
+        )
+
+    search_query = st.sidebar.text_input("Search by Name")
+    text_query = st.sidebar.text_input("Search Card Text", help='Attack, ability or rules text, "quoted phrases" '
+                                                                'match word for word')
+
+    return CardFilters(non_rulebox, tuple(selected_supertypes), tuple(selected_pokemon_types), search_query,
+                       text_query)
+
+
+def filtered_view(cards: OwnedCards, filters: CardFilters) -> List[Tuple[Card, int]]:
+    """
+    Get the filtered and sorted cards of the collection. They are cached on the collection's version, a rerun that
+    changed neither the collection nor the filters neither copies nor sorts the cards.
+
+    Args:
+        cards (OwnedCards): The user's collection.
+        filters (CardFilters): The filters.
+
+    Returns:
+        List[Tuple[Card, int]]: The matching cards and their quantities, in display order.
+    """
+    return cards.view(filters, lambda: sort_cards(filter_cards(cards, *filters)))
+
+
+def show_collection_export(cards_dict: Dict[str, Tuple[Card, int]]) -> None:
+    """
+    Displays a download button for the collection. The export is only generated when the button is clicked.
+
+    Args:
+        cards_dict (Dict[str, Tuple[Card, int]]): Dictionary of card IDs to tuples of Card objects and quantities.
+    """
+    with st.sidebar.expander("Export Collection"):
+        export_format = st.selectbox("Format", list(EXPORT_FORMATS), key="collection_export_format")
+        exporter, _, extension, mime = EXPORT_FORMATS[export_format]
+        st.download_button(
+            "Download",
+            data=lambda: read_and_close(export_to_file(exporter(cards_dict))),
+            file_name=f"collection.{extension}",
+            mime=mime,
+            use_container_width=True,
+            on_click="ignore",
+        )
+
+
+def show_collection_value(cards_dict: Dict[str, Tuple[Card, int]]) -> None:
+    """
+    Displays the value of the collection, its evolution over time and its most valuable sets. Prices are
+    snapshotted once a day by a background job queued when the tab is opened, or on demand. The history is kept
+    in the session and only reloaded once a snapshot was appended.
+
+    Args:
+        cards_dict (Dict[str, Tuple[Card, int]]): Dictionary of card IDs to tuples of Card objects and quantities.
+    """
+    # Imported here, pandas is only needed to give the chart a time axis
+    import pandas as pd
+
+    name = st.session_state["name"]
+    loaded_name, history = st.session_state.get("price_history", (None, None))
+    if loaded_name != name or history.is_outdated():
+        history = load_price_history(name)
+        st.session_state.price_history = (name, history)
+    if history.is_stale():
+        submit("price_snapshot", name, priority=LOW)
+
+    with st.expander("Collection Value"):
+        col1, col2 = st.columns([3, 1])
+        source = col1.selectbox("Prices", list(SOURCES), format_func=SOURCES.get, key="valuation_source")
+        col2.write("")
+        if col2.button("Snapshot Prices", use_container_width=True):
+            history.append_snapshot(cards_dict)
+
+        if not len(history):
+            st.info("The prices of the collection are being snapshotted, their value will show up shortly.")
+            return
+        totals = history.value_over_time(source)
+        symbol = "$" if source == "usd" else "€"
+        delta = totals[-1] - totals[-2] if len(totals) > 1 else None
+        st.metric("Total Value", f"{symbol}{totals[-1]:,.2f}",
+                  delta=f"{delta:+,.2f}" if delta is not None else None)
+        if len(totals) > 1:
+            st.line_chart(pd.DataFrame({"Value": totals}, index=pd.to_datetime(history.timestamps, unit="s")))
+
+        by_set = history.value_by_set(source=source)
+        if by_set:
+            top_sets = dict(list(by_set.items())[:15])
+            st.bar_chart(pd.DataFrame({"Value": list(top_sets.values())}, index=list(top_sets)))
+
+        movers = history.top_movers(source=source)
+        if movers:
+            st.caption("Biggest changes since the previous snapshot")
+            st.dataframe(
+                pd.DataFrame([
+                    {"Card": cards_dict[card_id][0].name if card_id in cards_dict else card_id, "ID": card_id,
+                     "Change": f"{change:+,.2f}"}
+                    for card_id, change in movers
+                ]),
+                hide_index=True,
+                use_container_width=True,
+            )
+
+
 def view_cards() -> None:
     """
     Main function to display the user's card collection with filtering options.
@@ -296,10 +432,13 @@ def view_cards() -> None:
         st.warning("No cards available. Add some cards first!")
         return
 
-    cards_dict: Dict[str, Tuple[Card, int]] = st.session_state.cards.copy()
+    # Never modified in place, a change replaces it with a new version
+    cards: OwnedCards = st.session_state.cards
+    show_collection_export(cards)
+    show_collection_value(cards)
 
     # Apply filters from the sidebar
-    filtered_cards = render_sidebar(cards_dict)
+    filtered_cards = filtered_view(cards, render_sidebar())
 
     # Display filtered cards
     if not filtered_cards:
@@ -0,0 +1,149 @@
+import streamlit as st
+from pokemontcgsdk import Card
+
+from utils import deck_index, meta, recommender
+from utils.buildability import BuildabilityMatrix
+from utils.change_feed import CARDS, current_position, read_changes
+from utils.deck import Deck
+from utils.owned_cards import OwnedCards
+from utils.pokemon_api import get_sets
+from utils.scheduler import submit_thumbnails
+from utils.set_completion import SetCompletionIndex
+from utils.storage import get_user_path, load_cards_from_collection, load_decks_from_collection
+from utils.write_queue import get_write_queue
+
+
+def get_buildability() -> BuildabilityMatrix:
+    """
+    Get the deck buildability matrix of the session, building it on first use.
+
+    Returns:
+        BuildabilityMatrix: The matrix of the user's decks against the user's collection.
+    """
+    if st.session_state.get("buildability") is None:
+        st.session_state.buildability = BuildabilityMatrix(st.session_state.cards, st.session_state.decks.values())
+    return st.session_state.buildability
+
+
+def get_set_completion() -> SetCompletionIndex:
+    """
+    Get the set completion index of the session, building it on first use.
+
+    Returns:
+        SetCompletionIndex: The owned card numbers of each set.
+    """
+    if st.session_state.get("set_completion") is None:
+        st.session_state.set_completion = SetCompletionIndex(get_sets(), st.session_state.cards)
+    return st.session_state.set_completion
+
+
+def set_owned_quantity(card: Card, quantity: int, changed_here: bool = True) -> None:
+    """
+    Update the owned quantity of a card in the session, removing the card when none are left. The collection is
+    replaced by its new version, the views derived from the previous one are dropped with it. The thumbnails of
+    cards newly owned through this session are cached by a background job, see `submit_new_thumbnails`.
+
+    Args:
+        card (Card): The card.
+        quantity (int): The new owned quantity.
+        changed_here (bool): Whether the change was made in this session, rather than synced from another one
+            whose process caches the thumbnails.
+    """
+    if changed_here and quantity > 0 and card.id not in st.session_state.cards:
+        st.session_state.setdefault("new_thumbnails", set()).add(card.id)
+    st.session_state.cards = st.session_state.cards.set_owned(card, quantity)
+    if st.session_state.get("buildability") is not None:
+        st.session_state.buildability.set_owned(card.id, quantity)
+    if st.session_state.get("set_completion") is not None:
+        st.session_state.set_completion.set_owned(card.id, quantity)
+
+
+def submit_new_thumbnails() -> None:
+    """
+    Queue caching the thumbnails of the cards the session newly owned since the last call, in a single batch
+    per rerun however many cards were added.
+    """
+    card_ids = st.session_state.get("new_thumbnails")
+    if card_ids:
+        st.session_state.new_thumbnails = set()
+        submit_thumbnails(card_ids)
+
+
+def update_deck(deck: Deck) -> None:
+    """
+    Add or replace a deck in the session after it was created or edited.
+
+    Args:
+        deck (Deck): The deck.
+    """
+    st.session_state.decks[deck.name] = deck
+    if st.session_state.get("buildability") is not None:
+        st.session_state.buildability.set_deck(deck)
+    deck_id = f"{st.session_state['name']}/{deck.name}"
+    deck_index.index_deck(deck_id, deck)
+    recommender.index_deck(deck_id, deck)
+    meta.index_deck(deck_id, deck)
+
+
+def delete_deck(name: str) -> None:
+    """
+    Remove a deck from the session.
+
+    Args:
+        name (str): The name of the deck.
+    """
+    st.session_state.decks.pop(name, None)
+    if st.session_state.get("buildability") is not None:
+        st.session_state.buildability.remove_deck(name)
+    deck_id = f"{st.session_state['name']}/{name}"
+    deck_index.index_deck(deck_id, None)
+    recommender.index_deck(deck_id, None)
+    meta.index_deck(deck_id, None)
+
+
+def load_collections() -> None:
+    """
+    Load the user's cards and decks into the session, along with the position of the change journal they reflect.
+    """
+    name = st.session_state["name"]
+    # Taken before loading, so that a change saved in the meantime is applied on the next sync
+    st.session_state.feed_position = current_position(get_user_path(name))
+    st.session_state.cards = OwnedCards(load_cards_from_collection(name))
+    st.session_state.decks = load_decks_from_collection(name)
+    st.session_state.buildability = None
+    st.session_state.set_completion = None
+
+
+def sync_collections() -> None:
+    """
+    Apply to the session the changes other sessions of the user saved since it was loaded or last synced, e.g. in
+    another tab or another server process. Costs reading the journal's header when nothing changed, and reloads
+    the collections only if the journal was restarted.
+    """
+    if get_write_queue(st.session_state["name"]).pending:
+        # The session is ahead of the journal until its queued changes are saved, sync on a later rerun
+        return
+    position, records = read_changes(get_user_path(st.session_state["name"]), st.session_state.feed_position)
+    if records is None:
+        load_collections()
+        return
+    for kind, changes in records:
+        if kind == CARDS:
+            for card_id, entry in changes.items():
+                card, quantity = entry if entry is not None else (None, 0)
+                current = st.session_state.cards.get(card_id)
+                if (current[1] if current is not None else 0) != quantity:
+                    set_owned_quantity(card if card is not None else current[0], quantity, changed_here=False)
+        else:
+            for deck_name, deck in changes.items():
+                current = st.session_state.decks.get(deck_name)
+                if deck is None:
+                    if current is not None:
+                        delete_deck(deck_name)
+                elif current is None or _deck_contents(current) != _deck_contents(deck):
+                    update_deck(deck)
+    st.session_state.feed_position = position
+
+
+def _deck_contents(deck: Deck) -> list:
+    return [(card.id, quantity) for card, quantity in deck.cards()]
@@ -6,8 +6,14 @@ import streamlit as st
 from PIL import Image, ImageOps
 from pokemontcgsdk import Card
 
+from components.collection_state import delete_deck, get_buildability, set_owned_quantity, update_deck
 from utils.deck import Deck
-from utils.storage import save_deck_to_collection, remove_deck_from_collection, save_card_to_collection
+from utils.deck_index import get_deck_index
+from utils.export import EXPORT_FORMATS, export_to_file, read_and_close
+from utils.goldfish import POLICIES, simulate
+from utils.proxies import missing_cards, proxy_sheets_to_file
+from utils.recommender import get_recommender
+from utils.write_queue import get_write_queue
 
 
 @st.cache_data
@@ -49,8 +55,8 @@ def show_add_deck() -> None:
                 st.toast(f"Deck '{deck_name}' already exists. Please choose a different name.")
             else:
                 new_deck = Deck(deck_name, [])
-                st.session_state.decks[deck_name] = new_deck
-                save_deck_to_collection(new_deck, st.session_state["name"])
+                update_deck(new_deck)
+                get_write_queue(st.session_state["name"]).save_deck(new_deck)
                 st.toast(f"Deck '{deck_name}' created successfully.")
                 st.session_state.show_new_deck_input = False
                 st.rerun()
@@ -60,10 +66,13 @@ def show_decks() -> None:
     """
     Display all decks with options to edit or delete them.
     """
-    for deck in st.session_state.decks.values():
+    buildability = get_buildability()
+    for deck in list(st.session_state.decks.values()):
         col1, col2, col3 = st.columns([7, 1, 1])  # Adjust column proportions as needed
         with col1:
-            st.subheader(f"{deck.name} ({len(deck)} cards)", anchor=False)
+            shortfall = buildability.shortfalls.get(deck.name, 0)
+            status = f"({shortfall} missing)" if shortfall else "✅" if len(deck) else ""
+            st.subheader(f"{deck.name} ({len(deck)} cards) {status}", anchor=False)
         with col2:
             if st.button("Edit", key=f"edit_{deck.name}", use_container_width=True):
                 st.session_state.view = "deck_builder"
@@ -71,8 +80,8 @@ def show_decks() -> None:
                 st.rerun()
         with col3:
             if st.button("Delete", key=f"delete_{deck.name}", use_container_width=True):
-                del st.session_state.decks[deck.name]
-                remove_deck_from_collection(deck.name, st.session_state["name"])
+                delete_deck(deck.name)
+                get_write_queue(st.session_state["name"]).remove_deck(deck.name)
                 st.toast(f"Deck '{deck.name}' deleted successfully.")
                 st.rerun()
         st.divider()
@@ -143,7 +152,7 @@ def display_deck_cards(deck: Deck, num_columns: int) -> None:
                         use_container_width=True
                 ):
                     deck.remove_card(card)
-                    st.session_state.decks[deck.name] = deck
+                    update_deck(deck)
                     st.toast(f"Successfully removed {card.name} from '{deck.name}'")
                     st.rerun()
         st.write("")
@@ -177,6 +186,16 @@ def show_export(deck: Deck) -> None:
         st.session_state['show_export'] = False
         return
     st.code(deck_data, language='text')
+    missing = missing_cards(deck, st.session_state.cards)
+    st.download_button(
+        f"Print Proxies of Missing Cards ({len(missing)})",
+        data=lambda: read_and_close(proxy_sheets_to_file(missing)),
+        file_name=f"{deck.name} proxies.pdf",
+        mime="application/pdf",
+        use_container_width=True,
+        on_click="ignore",
+        disabled=not missing,
+    )
     if st.button("Close Export", use_container_width=True, key="close_export"):
         st.session_state['show_export'] = False
 
@@ -193,6 +212,7 @@ def show_import(deck: Deck) -> None:
     import_data = st.text_area("Paste deck data here", height=200)
     if st.button("Import Deck", use_container_width=True, key="import_deck"):
             deck.import_from_string(import_data)
+            update_deck(deck)
             st.success("Deck imported successfully")
             st.session_state['show_import'] = False
             st.rerun()
@@ -204,7 +224,7 @@ def show_import(deck: Deck) -> None:
 
 def show_owned_cards(deck: Deck) -> None:
     """
-    Displays the interface for adding owned cards to the deck.
+    Displays the interface for adding owned cards to the deck, the cards that best fit the deck first.
 
     Args:
         deck (Deck): The deck to add cards to.
@@ -217,6 +237,9 @@ def show_owned_cards(deck: Deck) -> None:
             search_results = [(card, quantity) for card, quantity in cards if search_query.lower() in card.name.lower()]
         else:
             search_results = cards
+        if deck.cards():
+            # Cards most often played alongside the cards of the deck, in the decks of all users
+            search_results = get_recommender().rank(deck, search_results)
 
         num_columns = 4
         columns = st.columns(num_columns)
@@ -228,14 +251,85 @@ def show_owned_cards(deck: Deck) -> None:
                 if st.button(f"Add ({quantity_left} left)", key=f"add_{card.id}_{idx}", use_container_width=True):
                     if quantity_left > 0:
                         deck.add_card(card)
-                        st.session_state.decks[deck.name] = deck
-                        save_deck_to_collection(deck, st.session_state["name"])
+                        update_deck(deck)
+                        get_write_queue(st.session_state["name"]).save_deck(deck)
                         st.toast(f"Successfully added {1} x {card.name} to '{deck.name}'")
                         st.rerun()
                     else:
                         st.toast(f"Cannot add more {card.name} to '{deck.name}'. Limit reached.")
 
 
+def show_similar_decks(deck: Deck) -> None:
+    """
+    Displays the decks of all users that are most similar to the deck being edited.
+
+    Args:
+        deck (Deck): The deck to compare.
+    """
+    with st.expander("Similar Decks"):
+        if not len(deck):
+            st.write("Add cards to the deck to find similar decks.")
+            return
+        similar = get_deck_index().query(deck, k=5, exclude=f"{st.session_state['name']}/{deck.name}")
+        if not similar:
+            st.write("No similar decks found.")
+            return
+        for deck_id, similarity in similar:
+            user, deck_name = deck_id.split("/", 1)
+            st.write(f"**{deck_name}** by {user}: {similarity:.0%} similar")
+
+
+def show_goldfish(deck: Deck) -> None:
+    """
+    Displays the goldfish simulator, playing the deck alone for a few turns many times to measure how
+    consistently it sets up its Pokémon.
+
+    Args:
+        deck (Deck): The deck to simulate.
+    """
+    with st.expander("Goldfish Simulator"):
+        if len(deck) != 60:
+            st.write("Complete the deck to 60 cards to simulate it.")
+            return
+        col1, col2, col3, col4 = st.columns(4, vertical_alignment="bottom")
+        games = col1.selectbox("Games", [1000, 10000, 50000], index=1, key="goldfish_games")
+        turns = col2.slider("Turns", min_value=2, max_value=8, value=4, key="goldfish_turns")
+        policy = col3.selectbox("Play pattern", list(POLICIES), key="goldfish_policy")
+        going_first = col4.toggle("Going first", value=True, key="goldfish_first")
+        if st.button("Simulate", use_container_width=True, key="goldfish_run"):
+            with st.spinner("Simulating games..."):
+                try:
+                    st.session_state["goldfish_result"] = (
+                        deck.name, simulate(deck, games, turns, going_first, POLICIES[policy]))
+                except ValueError as e:
+                    st.warning(str(e))
+                    return
+
+        if st.session_state.get("goldfish_result", (None,))[0] != deck.name:
+            return
+        result = st.session_state["goldfish_result"][1]
+        columns = [f"Turn {turn}" for turn in range(1, result.turns + 1)]
+        st.caption(f"{result.games} games at {result.games_per_second:,.0f} games per second, "
+                   f"{result.mulligans:.2f} mulligans per game")
+        st.dataframe(
+            {"": ["Stage 1 in play", "Stage 2 in play", "Pokémon in play", "Energy attached"],
+             **{column: [result.stage_in_play[1][turn], result.stage_in_play[2][turn],
+                         result.pokemon_in_play[turn], result.energy_attached[turn]]
+                for turn, column in enumerate(columns)}},
+            hide_index=True,
+            use_container_width=True,
+            column_config={column: st.column_config.NumberColumn(column, format="%.2f") for column in columns},
+        )
+        st.dataframe(
+            [{"Pokémon": name, **{column: row[turn] for turn, column in enumerate(columns)}}
+             for name, row in zip(result.names, result.in_play.tolist()) if row[-1] > 0],
+            hide_index=True,
+            use_container_width=True,
+            column_config={column: st.column_config.ProgressColumn(column, min_value=0, max_value=1,
+                                                                   format="percent") for column in columns},
+        )
+
+
 def show_deck_builder(deck: Deck) -> None:
     """
     Displays the deck builder interface, allowing the user to modify the deck.
@@ -257,7 +351,7 @@ def show_deck_builder(deck: Deck) -> None:
     with col2:
         if st.button("Save", use_container_width=True):
             st.session_state.view = "deck_manager"
-            save_deck_to_collection(deck, st.session_state["name"])
+            get_write_queue(st.session_state["name"]).save_deck(deck)
             st.toast(f"Deck '{deck.name}' saved successfully.")
             st.rerun()
     with col3:
@@ -274,8 +368,8 @@ def show_deck_builder(deck: Deck) -> None:
                 unowned = card.id not in st.session_state.cards
                 if unowned or st.session_state.cards[card.id][1] < quantity:
                     q_to_add = quantity - (0 if unowned else st.session_state.cards[card.id][1])
-                    save_card_to_collection(card, q_to_add, st.session_state["name"])
-                    st.session_state.cards[card.id] = (card, quantity)
+                    get_write_queue(st.session_state["name"]).add_cards(card, q_to_add)
+                    set_owned_quantity(card, quantity)
                     count += q_to_add
             st.toast(f"Added {count} missing cards to your collection.")
 
@@ -285,6 +379,9 @@ def show_deck_builder(deck: Deck) -> None:
     if st.session_state['show_import']:
         show_import(deck)
 
+    show_similar_decks(deck)
+    show_goldfish(deck)
+
     left_col, right_col = st.columns([3, 2])
     with left_col:
         display_deck_cards(deck, 5)
@@ -292,6 +389,60 @@ def show_deck_builder(deck: Deck) -> None:
         show_owned_cards(deck)
 
 
+def show_build_planner() -> None:
+    """
+    Display which decks can be built from the collection, which can be built at the same time without sharing
+    copies, and the cards missing to build a selection of decks together.
+    """
+    buildability = get_buildability()
+    with st.expander("Build Planner"):
+        complete = buildability.complete_decks()
+        st.write(f"**{len(complete)}** of your {len(st.session_state.decks)} decks can be built from your collection.")
+
+        free, choices = buildability.simultaneous_builds()
+        if free:
+            st.write("Can always be built together: " + ", ".join(free))
+        for combinations in choices:
+            st.write("Competing for the same copies, build one of:")
+            st.markdown("\n".join(f"- {' + '.join(combination)}" for combination in combinations))
+
+        selected = st.multiselect("Decks to build together", list(st.session_state.decks), key="planner_decks")
+        if not selected:
+            return
+        shortfall = buildability.combined_shortfall(selected)
+        if not shortfall:
+            st.success("You own enough cards to build these decks at the same time.")
+            return
+        st.warning(f"{sum(shortfall.values())} cards missing to build these decks at the same time:")
+        deck_cards = {card.id: card for name in selected for card, _ in st.session_state.decks[name].cards()}
+        st.dataframe(
+            [{"Card": deck_cards[card_id].name, "ID": card_id, "Missing": count}
+             for card_id, count in shortfall.items()],
+            hide_index=True,
+            use_container_width=True,
+        )
+
+
+def show_decks_export() -> None:
+    """
+    Display a download button for all the user's decks. The export is only generated when the button is clicked.
+    """
+    decks = list(st.session_state.decks.values())
+    col1, col2 = st.columns([5, 1], vertical_alignment="bottom")
+    with col1:
+        export_format = st.selectbox("Export format", list(EXPORT_FORMATS), key="decks_export_format")
+    _, exporter, extension, mime = EXPORT_FORMATS[export_format]
+    with col2:
+        st.download_button(
+            "Export All Decks",
+            data=lambda: read_and_close(export_to_file(exporter(decks))),
+            file_name=f"decks.{extension}",
+            mime=mime,
+            use_container_width=True,
+            on_click="ignore",
+        )
+
+
 def view_decks() -> None:
     """
     Main function to manage and view decks. Handles the deck builder and deck manager views.
@@ -321,3 +472,5 @@ def view_decks() -> None:
         st.warning("No decks available. Create a deck first.")
     else:
         show_decks()
+        show_build_planner()
+        show_decks_export()
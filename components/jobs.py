@@ -0,0 +1,48 @@
+import time
+
+import streamlit as st
+
+from utils.scheduler import PRIORITY_NAMES, JobStatus, get_scheduler
+
+JOB_ARGS_SHOWN = 3  # Arguments listed per job, batches of cards are summed up
+
+
+def _age(timestamp: float) -> str:
+    seconds = int(time.time() - timestamp)
+    if seconds < 60:
+        return f"{seconds}s ago"
+    if seconds < 60 * 60:
+        return f"{seconds // 60}m ago"
+    return f"{seconds // (60 * 60)}h ago"
+
+
+def _describe(status: JobStatus) -> str:
+    if len(status.args) > JOB_ARGS_SHOWN:
+        return f"{status.kind} {' '.join(status.args[:JOB_ARGS_SHOWN])}… ({len(status.args)} in all)"
+    return " ".join((status.kind,) + status.args)
+
+
+def show_job_status() -> None:
+    """
+    Displays the background jobs of the server: the running and queued ones, then the latest finished ones.
+    """
+    # Imported here, pandas is only needed to build the table
+    import pandas as pd
+
+    statuses = get_scheduler().status()
+    active = sum(status.state in ("queued", "running") for status in statuses)
+    with st.expander(f"Background Jobs ({active} pending)" if active else "Background Jobs"):
+        if not statuses:
+            st.caption("No jobs ran since the server started.")
+            return
+        st.dataframe(
+            pd.DataFrame([
+                {"Job": _describe(status), "State": status.state,
+                 "Priority": PRIORITY_NAMES.get(status.priority, str(status.priority)),
+                 "When": _age(status.finished_at or status.started_at or status.submitted_at),
+                 "Result": status.result}
+                for status in statuses
+            ]),
+            hide_index=True,
+            use_container_width=True,
+        )
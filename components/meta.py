@@ -0,0 +1,85 @@
+import streamlit as st
+
+from utils.deck_index import get_deck_index
+from utils.meta import get_meta_analytics
+
+SUPERTYPES = ["All", "Pokémon", "Trainer", "Energy"]
+
+
+def show_archetypes(owners: list[str]) -> None:
+    """
+    Displays the share of the archetypes the decks of the selected users and corpora belong to.
+
+    Args:
+        owners (list[str]): The users and corpora whose decks to count.
+    """
+    selected = set(owners)
+    shares = []
+    for archetype in get_deck_index().archetypes():
+        decks = sum(deck_id.split("/", 1)[0] in selected for deck_id in archetype.deck_ids)
+        if decks:
+            shares.append({"Archetype": archetype.name, "Decks": decks})
+    if not shares:
+        st.write("No archetypes found.")
+        return
+    total = sum(share["Decks"] for share in shares)
+    for share in shares:
+        share["Share"] = share["Decks"] / total
+    st.dataframe(
+        shares[:20],
+        hide_index=True,
+        use_container_width=True,
+        column_config={"Share": st.column_config.ProgressColumn("Share", min_value=0, max_value=1, format="percent")},
+    )
+
+
+def view_meta() -> None:
+    """
+    Main function to display the card usage statistics over every user's decks and the imported decklist corpora.
+    """
+    # Imported here, pandas is only needed to give the tables their column types
+    import pandas as pd
+
+    st.header("Meta", anchor=False)
+    meta = get_meta_analytics()
+    all_owners = meta.owner_names()
+    if not all_owners:
+        st.warning("No decks available. Create or import some decks first!")
+        return
+
+    col1, col2 = st.columns([3, 1])
+    owners = col1.multiselect("Decks of", all_owners, default=all_owners, key="meta_owners")
+    supertype = col2.selectbox("Card type", SUPERTYPES, key="meta_supertype")
+    if not owners:
+        st.info("Select the users or corpora to analyze.")
+        return
+
+    usage = meta.card_usage(owners, None if supertype == "All" else supertype, limit=200)
+    st.subheader("Most played cards", anchor=False)
+    st.dataframe(
+        pd.DataFrame(usage, columns=["Card", "Type", "Decks", "Inclusion", "Average Copies"]),
+        hide_index=True,
+        use_container_width=True,
+        column_config={
+            "Inclusion": st.column_config.ProgressColumn("Inclusion", min_value=0, max_value=1, format="percent"),
+            "Average Copies": st.column_config.NumberColumn("Average Copies", format="%.2f"),
+        },
+    )
+
+    st.subheader("Sets by release", anchor=False)
+    sets = pd.DataFrame(meta.set_usage(owners),
+                        columns=["Set ID", "Set", "Released", "Decks", "Inclusion", "Copies", "Share"])
+    if not sets.empty:
+        st.bar_chart(sets, x="Released", y="Share")
+        st.dataframe(
+            sets.drop(columns="Set ID")[::-1],
+            hide_index=True,
+            use_container_width=True,
+            column_config={
+                "Inclusion": st.column_config.ProgressColumn("Inclusion", min_value=0, max_value=1, format="percent"),
+                "Share": st.column_config.NumberColumn("Share of Cards", format="percent"),
+            },
+        )
+
+    with st.expander("Archetypes"):
+        show_archetypes(owners)
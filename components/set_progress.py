@@ -0,0 +1,60 @@
+import streamlit as st
+
+from components.collection_state import get_set_completion
+
+
+def show_set_details(set_id: str) -> None:
+    """
+    Displays the completion of a set and the numbers of its cards that are missing from the collection.
+
+    Args:
+        set_id (str): The ID of the set.
+    """
+    index = get_set_completion()
+    position = index.set_index[set_id]
+    owned, total = int(index.owned[position]), int(index.totals[position])
+    st.progress(owned / max(total, 1), text=f"{owned} of {total} cards")
+    missing = index.missing_numbers(set_id)
+    if missing:
+        st.caption(f"Missing numbers ({len(missing)})")
+        st.write(", ".join(missing))
+    elif total:
+        st.success("Set complete!")
+
+
+def view_set_progress() -> None:
+    """
+    Main function to display how close the collection is to completing each set.
+    """
+    # Imported here, pandas is only needed to give the table its column types
+    import pandas as pd
+
+    st.header("Set Progress", anchor=False)
+    index = get_set_completion()
+    progress = index.progress(started_only=st.toggle("Only sets with owned cards", value=True))
+    if not progress:
+        st.warning("No cards available. Add some cards first!")
+        return
+
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Sets Started", int((index.owned > 0).sum()))
+    col2.metric("Sets Completed", int(((index.owned == index.totals) & (index.totals > 0)).sum()))
+    col3.metric("Cards Owned", f"{int(index.owned.sum())} of {int(index.totals.sum())}")
+
+    table = pd.DataFrame([
+        {"Set": entry.name, "Series": entry.series, "Released": entry.release_date,
+         "Owned": entry.owned, "Total": entry.total, "Completion": entry.owned / max(entry.total, 1)}
+        for entry in progress
+    ])
+    st.dataframe(
+        table,
+        hide_index=True,
+        use_container_width=True,
+        column_config={"Completion": st.column_config.ProgressColumn("Completion", min_value=0, max_value=1,
+                                                                     format="percent")},
+    )
+
+    names = {entry.set_id: f"{entry.name} ({entry.series})" for entry in progress}
+    set_id = st.selectbox("Set", list(names), format_func=names.get, key="progress_set")
+    if set_id is not None:
+        show_set_details(set_id)
@@ -0,0 +1,488 @@
+"""
+JSON HTTP API over the users' collections and decks, for bots and companion apps.
+
+Requests authenticate with HTTP Basic credentials of `config.yaml`, the same as the app's login, and act on the
+authenticated user's data. Collections are kept in memory per user and kept in sync with the change journal
+written by the app and the CLI, writes go through the same coalescing write queue as the app. Collection and
+deck reads carry an ETag and answer `If-None-Match` with 304 Not Modified, deck writes honor `If-Match`.
+
+    GET    /api/cards                       The collection
+    PATCH  /api/cards                       Add or remove copies of many cards: {"cards": {"sv2-185": 2, ...}}
+    GET    /api/cards/{card_id}             A card of the collection
+    PUT    /api/cards/{card_id}             Set the owned quantity of a card: {"quantity": 3}
+    GET    /api/decks                       The decks, without their cards
+    GET    /api/decks/{name}                A deck
+    PUT    /api/decks/{name}                Create or replace a deck, from a decklist or {"cards": {"sv2-185": 2}}
+    DELETE /api/decks/{name}                Delete a deck
+    GET    /api/decks/{name}/export         Export a deck, ?format=ptcgl (default), csv or jsonl
+    POST   /api/legality                    Check the legality of a decklist without saving it
+
+Usage:
+    python server.py --host 127.0.0.1 --port 8080
+"""
+import argparse
+import asyncio
+import base64
+import binascii
+import itertools
+import json
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import bcrypt
+import yaml
+from aiohttp import web
+from pokemontcgsdk import Card
+from yaml import SafeLoader
+
+from utils.catalog import get_catalog
+from utils.change_feed import CARDS, current_position, read_changes
+from utils.deck import Deck
+from utils.export import EXPORT_FORMATS
+from utils.pokemon_api import find_cards_by_ids, get_sets
+from utils.storage import get_user_path, load_cards_from_collection, load_decks_from_collection
+from utils.write_queue import flush_all, get_write_queue
+
+CONFIG_FILE = "config.yaml"
+FORMATS = {"csv": "CSV", "jsonl": "JSON Lines", "ptcgl": "PTCGL"}
+MAX_AUTH_CACHE = 1024  # Authorization headers remembered after a successful password check
+
+# Revisions are unique across users and resources, and ETags carry the process ID so that a restarted server
+# never reuses the ETag of a previous process
+_revisions = itertools.count(1)
+_etag_prefix = f"{os.getpid():x}-"
+
+
+def card_json(card: Card, quantity: int) -> dict:
+    return {"id": card.id, "name": card.name, "set": card.set.id, "number": card.number,
+            "supertype": card.supertype, "quantity": quantity}
+
+
+def deck_contents(deck: Deck) -> list:
+    return [(card.id, quantity) for card, quantity in deck.cards()]
+
+
+def deck_json(deck: Deck, with_cards: bool = True) -> dict:
+    legal, message = deck.legal()
+    data = {"name": deck.name, "size": len(deck), "legal": legal, "message": message}
+    if with_cards:
+        data["cards"] = [card_json(card, quantity) for card, quantity in deck.cards()]
+    return data
+
+
+class UserStore:
+    def __init__(self, name: str) -> None:
+        """
+        In-memory copy of a user's collection and decks, with a revision per resource for ETags. Other processes'
+        changes are applied from the change journal, and the JSON of the collection is cached per revision.
+
+        :param name:    The user's name.
+        """
+        self.name = name
+        self.user_path = get_user_path(name)
+        self.cards: Dict[str, Tuple[Card, int]] = {}
+        self.decks: Dict[str, Deck] = {}
+        self.cards_revision = 0
+        self.deck_revisions: Dict[str, int] = {}
+        self.decks_revision = 0  # Changes with any deck, for the deck list
+        self._cards_body: Optional[Tuple[int, bytes]] = None
+        self.reload()
+
+    def reload(self) -> None:
+        # Taken before loading, so that a change saved in the meantime is applied on the next sync
+        self.position = current_position(self.user_path)
+        self.cards = load_cards_from_collection(self.name)
+        self.decks = load_decks_from_collection(self.name)
+        self.cards_revision = next(_revisions)
+        self.decks_revision = next(_revisions)
+        self.deck_revisions = {deck_name: self.decks_revision for deck_name in self.decks}
+
+    def sync(self) -> None:
+        """
+        Apply the changes other processes saved since the last sync. Costs reading the journal's header when
+        nothing changed.
+        """
+        if get_write_queue(self.name).pending:
+            return  # Ahead of the journal until the queued writes are saved
+        position, records = read_changes(self.user_path, self.position)
+        if records is None:
+            self.reload()
+            return
+        for kind, changes in records:
+            if kind == CARDS:
+                for card_id, entry in changes.items():
+                    current = self.cards.get(card_id)
+                    if (current[1] if current is not None else 0) != (entry[1] if entry is not None else 0):
+                        self._set_card(card_id, entry)
+            else:
+                for deck_name, deck in changes.items():
+                    # Records of this process' own writes leave the decks, and so their ETags, unchanged
+                    current = self.decks.get(deck_name)
+                    if deck is None and current is None or (deck is not None and current is not None
+                                                            and deck_contents(deck) == deck_contents(current)):
+                        continue
+                    self._set_deck(deck_name, deck)
+        self.position = position
+
+    def _set_card(self, card_id: str, entry: Optional[Tuple[Card, int]]) -> None:
+        if entry is not None and entry[1] > 0:
+            self.cards[card_id] = entry
+        else:
+            self.cards.pop(card_id, None)
+        self.cards_revision = next(_revisions)
+
+    def _set_deck(self, deck_name: str, deck: Optional[Deck]) -> None:
+        if deck is not None:
+            self.decks[deck_name] = deck
+            self.deck_revisions[deck_name] = next(_revisions)
+        else:
+            self.decks.pop(deck_name, None)
+            self.deck_revisions.pop(deck_name, None)
+        self.decks_revision = next(_revisions)
+
+    def add_cards(self, changes: Dict[str, Tuple[Card, int]]) -> None:
+        """
+        Add or remove copies of cards, saved by the write queue.
+
+        :param changes:     Dictionary of card IDs to tuples of cards and quantities to add, negative to remove.
+        """
+        queue = get_write_queue(self.name)
+        for card_id, (card, quantity) in changes.items():
+            owned = self.cards[card_id][1] if card_id in self.cards else 0
+            quantity = max(quantity, -owned)
+            if quantity:
+                self._set_card(card_id, (card, owned + quantity))
+                queue.add_cards(card, quantity)
+
+    def save_deck(self, deck: Deck) -> None:
+        """
+        Create or replace a deck, saved by the write queue.
+
+        :param deck:    The deck.
+        """
+        self._set_deck(deck.name, deck)
+        get_write_queue(self.name).save_deck(deck)
+
+    def delete_deck(self, deck_name: str) -> None:
+        """
+        Delete a deck, saved by the write queue.
+
+        :param deck_name:   The name of the deck.
+        """
+        self._set_deck(deck_name, None)
+        get_write_queue(self.name).remove_deck(deck_name)
+
+    def cards_body(self) -> bytes:
+        """
+        :return:    The JSON of the collection, serialized once per revision.
+        """
+        if self._cards_body is None or self._cards_body[0] != self.cards_revision:
+            cards = [card_json(card, quantity) for card, quantity in self.cards.values()]
+            self._cards_body = (self.cards_revision, json.dumps({"cards": cards}).encode("utf-8"))
+        return self._cards_body[1]
+
+
+def etag(revision: int) -> str:
+    return f'"{_etag_prefix}{revision:x}"'
+
+
+def json_response(request: web.Request, data, status: int = 200, revision: Optional[int] = None,
+                  body: Optional[bytes] = None) -> web.Response:
+    """
+    Make a JSON response, or a 304 Not Modified if the client already has this revision of the resource.
+    Args:
+        request (web.Request): The request.
+        data: The data to serialize, unless `body` is given.
+        status (int): The status of the response.
+        revision (Optional[int]): The revision of the resource, sent as its ETag.
+        body (Optional[bytes]): The already serialized JSON.
+    Returns:
+        web.Response: The response.
+    """
+    headers = {}
+    if revision is not None:
+        headers["ETag"] = etag(revision)
+        if request.method == "GET" and headers["ETag"] in request.headers.get("If-None-Match", ""):
+            return web.Response(status=304, headers=headers)
+    if body is None:
+        body = json.dumps(data).encode("utf-8")
+    return web.Response(body=body, status=status, headers=headers, content_type="application/json")
+
+
+_ERRORS = {
+    400: web.HTTPBadRequest,
+    401: web.HTTPUnauthorized,
+    404: web.HTTPNotFound,
+    412: web.HTTPPreconditionFailed,
+    422: web.HTTPUnprocessableEntity,
+}
+
+
+def error(status: int, message: str, **details) -> web.HTTPException:
+    """
+    Make a JSON error, to be raised by a handler.
+    Args:
+        status (int): The status of the response, one of _ERRORS.
+        message (str): The error message.
+        **details: Additional fields of the error.
+    Returns:
+        web.HTTPException: The error.
+    """
+    headers = {"WWW-Authenticate": 'Basic realm="PokemonTCGLab"'} if status == 401 else None
+    return _ERRORS[status](text=json.dumps({"error": message, **details}), content_type="application/json",
+                           headers=headers)
+
+
+class Api:
+    def __init__(self, credentials: dict) -> None:
+        """
+        Handlers of the API, with the user stores and the credentials of `config.yaml`.
+
+        :param credentials:     The `credentials` section of the configuration.
+        """
+        self.users = credentials.get("usernames", {})
+        self.stores: Dict[str, UserStore] = {}
+        self._authorized: Dict[str, str] = {}  # Authorization header -> user's name
+
+    async def authenticate(self, request: web.Request) -> str:
+        """
+        Check the Basic credentials of a request. Password checks are slow by design, so they run in a thread
+        and the headers that passed are remembered.
+
+        :param request:     The request.
+        :return:            The name of the authenticated user, which names the user's data directory.
+        """
+        header = request.headers.get("Authorization", "")
+        name = self._authorized.get(header)
+        if name is not None:
+            return name
+        scheme, _, encoded = header.partition(" ")
+        try:
+            username, _, password = base64.b64decode(encoded).decode("utf-8").partition(":")
+        except (binascii.Error, UnicodeDecodeError):
+            username, password = "", ""
+        user = self.users.get(username)
+        if scheme.lower() != "basic" or user is None or not await asyncio.get_running_loop().run_in_executor(
+                None, bcrypt.checkpw, password.encode("utf-8"), user["password"].encode("utf-8")):
+            raise error(401, "Invalid credentials.")
+        if len(self._authorized) >= MAX_AUTH_CACHE:
+            self._authorized.clear()
+        self._authorized[header] = user["name"]
+        return user["name"]
+
+    @web.middleware
+    async def middleware(self, request: web.Request, handler) -> web.StreamResponse:
+        name = await self.authenticate(request)
+        store = self.stores.get(name)
+        if store is None:
+            store = self.stores[name] = UserStore(name)
+        else:
+            store.sync()
+        request["store"] = store
+        return await handler(request)
+
+    @staticmethod
+    async def resolve_cards(store: UserStore, card_ids: Iterable[str]) -> Dict[str, Card]:
+        """
+        Find cards by ID in the collection, then the catalog, then the Pokémon TCG API.
+
+        :param store:       The user's store.
+        :param card_ids:    The IDs of the cards.
+        :return:            Dictionary of card IDs to the cards that were found.
+        """
+        catalog = get_catalog()
+        found: Dict[str, Card] = {}
+        missing: List[str] = []
+        for card_id in card_ids:
+            card = store.cards[card_id][0] if card_id in store.cards else catalog.get(card_id)
+            if card is not None:
+                found[card_id] = card
+            else:
+                missing.append(card_id)
+        loop = asyncio.get_running_loop()
+        for start in range(0, len(missing), 100):
+            found.update(await loop.run_in_executor(None, find_cards_by_ids, missing[start:start + 100]))
+        return found
+
+    @staticmethod
+    async def read_json(request: web.Request) -> dict:
+        try:
+            data = await request.json()
+        except ValueError:
+            raise error(400, "The body is not valid JSON.")
+        if not isinstance(data, dict):
+            raise error(400, "The body must be a JSON object.")
+        return data
+
+    async def read_deck(self, request: web.Request, name: str) -> Tuple[Deck, List[str]]:
+        """
+        Read a deck from a request, either a decklist in plain text or {"cards": {card ID: quantity}}.
+
+        :param request:     The request.
+        :param name:        The name of the deck.
+        :return:            The deck and the decklist lines or card IDs that could not be resolved.
+        """
+        deck = Deck(name, [])
+        if request.content_type == "application/json":
+            quantities = (await self.read_json(request)).get("cards")
+            if not isinstance(quantities, dict) or not all(isinstance(q, int) and q > 0 for q in quantities.values()):
+                raise error(400, '"cards" must map card IDs to positive quantities.')
+            found = await self.resolve_cards(request["store"], quantities)
+            for card_id, quantity in quantities.items():
+                if card_id in found:
+                    for _ in range(quantity):
+                        deck.add_card(found[card_id])
+            return deck, [card_id for card_id in quantities if card_id not in found]
+        text = await request.text()
+        # Cards missing from the catalog are fetched from the API, off the event loop
+        unresolved = await asyncio.get_running_loop().run_in_executor(None, deck.import_from_string, text)
+        return deck, unresolved
+
+    async def get_cards(self, request: web.Request) -> web.Response:
+        store: UserStore = request["store"]
+        return json_response(request, None, revision=store.cards_revision, body=store.cards_body())
+
+    async def patch_cards(self, request: web.Request) -> web.Response:
+        store: UserStore = request["store"]
+        quantities = (await self.read_json(request)).get("cards")
+        if not isinstance(quantities, dict) or not all(isinstance(q, int) for q in quantities.values()):
+            raise error(400, '"cards" must map card IDs to quantities to add.')
+        found = await self.resolve_cards(store, quantities)
+        unknown = [card_id for card_id in quantities if card_id not in found]
+        if unknown:
+            raise error(422, "Unknown cards.", unknown=unknown)
+        store.add_cards({card_id: (found[card_id], quantity) for card_id, quantity in quantities.items()})
+        owned = {card_id: store.cards[card_id][1] if card_id in store.cards else 0 for card_id in quantities}
+        return json_response(request, {"cards": owned}, revision=store.cards_revision)
+
+    async def get_card(self, request: web.Request) -> web.Response:
+        store: UserStore = request["store"]
+        card_id = request.match_info["card_id"]
+        if card_id not in store.cards:
+            raise error(404, f"No card {card_id} in the collection.")
+        return json_response(request, card_json(*store.cards[card_id]), revision=store.cards_revision)
+
+    async def put_card(self, request: web.Request) -> web.Response:
+        store: UserStore = request["store"]
+        card_id = request.match_info["card_id"]
+        quantity = (await self.read_json(request)).get("quantity")
+        if not isinstance(quantity, int) or quantity < 0:
+            raise error(400, '"quantity" must be a non-negative integer.')
+        card = (await self.resolve_cards(store, [card_id])).get(card_id)
+        if card is None:
+            raise error(404, f"Unknown card {card_id}.")
+        owned = store.cards[card_id][1] if card_id in store.cards else 0
+        store.add_cards({card_id: (card, quantity - owned)})
+        return json_response(request, card_json(card, quantity), revision=store.cards_revision)
+
+    async def get_decks(self, request: web.Request) -> web.Response:
+        store: UserStore = request["store"]
+        decks = [deck_json(deck, with_cards=False) for deck in store.decks.values()]
+        return json_response(request, {"decks": decks}, revision=store.decks_revision)
+
+    @staticmethod
+    def find_deck(request: web.Request) -> Deck:
+        store: UserStore = request["store"]
+        name = request.match_info["name"]
+        if name not in store.decks:
+            raise error(404, f"No deck named {name}.")
+        return store.decks[name]
+
+    async def get_deck(self, request: web.Request) -> web.Response:
+        deck = self.find_deck(request)
+        return json_response(request, deck_json(deck), revision=request["store"].deck_revisions[deck.name])
+
+    @staticmethod
+    def check_precondition(request: web.Request, name: str) -> None:
+        # If-Match makes concurrent editors fail rather than overwrite each other's changes
+        expected = request.headers.get("If-Match")
+        if expected is None:
+            return
+        revision = request["store"].deck_revisions.get(name)
+        if revision is None:
+            raise error(412, f"No deck named {name}.")
+        if expected.strip() != "*" and etag(revision) not in [tag.strip() for tag in expected.split(",")]:
+            raise error(412, f"Deck {name} was changed.")
+
+    async def put_deck(self, request: web.Request) -> web.Response:
+        store: UserStore = request["store"]
+        name = request.match_info["name"]
+        self.check_precondition(request, name)
+        deck, unresolved = await self.read_deck(request, name)
+        created = name not in store.decks
+        store.save_deck(deck)
+        data = deck_json(deck)
+        data["unresolved"] = unresolved
+        return json_response(request, data, status=201 if created else 200, revision=store.deck_revisions[name])
+
+    async def delete_deck(self, request: web.Request) -> web.Response:
+        deck = self.find_deck(request)
+        self.check_precondition(request, deck.name)
+        request["store"].delete_deck(deck.name)
+        return web.Response(status=204)
+
+    async def export_deck(self, request: web.Request) -> web.Response:
+        deck = self.find_deck(request)
+        export_format = request.query.get("format", "ptcgl")
+        if export_format not in FORMATS:
+            raise error(400, f"Unknown format {export_format}.", formats=list(FORMATS))
+        _, decks_lines, _, content_type = EXPORT_FORMATS[FORMATS[export_format]]
+        revision = request["store"].deck_revisions[deck.name]
+        headers = {"ETag": etag(revision)}
+        if headers["ETag"] in request.headers.get("If-None-Match", ""):
+            return web.Response(status=304, headers=headers)
+        return web.Response(text="".join(decks_lines([deck])), content_type=content_type, headers=headers)
+
+    async def check_legality(self, request: web.Request) -> web.Response:
+        deck, unresolved = await self.read_deck(request, "")
+        data = deck_json(deck, with_cards=False)
+        del data["name"]
+        data["unresolved"] = unresolved
+        return json_response(request, data)
+
+
+def make_app(config: dict) -> web.Application:
+    """
+    Create the API application.
+    Args:
+        config (dict): The configuration of `config.yaml`.
+    Returns:
+        web.Application: The application.
+    """
+    api = Api(config["credentials"])
+    app = web.Application(middlewares=[api.middleware])
+    app.add_routes([
+        web.get("/api/cards", api.get_cards),
+        web.patch("/api/cards", api.patch_cards),
+        web.get("/api/cards/{card_id}", api.get_card),
+        web.put("/api/cards/{card_id}", api.put_card),
+        web.get("/api/decks", api.get_decks),
+        web.get("/api/decks/{name}", api.get_deck),
+        web.put("/api/decks/{name}", api.put_deck),
+        web.delete("/api/decks/{name}", api.delete_deck),
+        web.get("/api/decks/{name}/export", api.export_deck),
+        web.post("/api/legality", api.check_legality),
+    ])
+
+    async def flush_writes(_: web.Application) -> None:
+        await asyncio.get_running_loop().run_in_executor(None, flush_all)
+
+    app.on_shutdown.append(flush_writes)
+    return app
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8080, help="port to listen on")
+    args = parser.parse_args(argv)
+
+    with open(CONFIG_FILE, "r", encoding="utf-8") as f:
+        config = yaml.load(f, Loader=SafeLoader)
+    # The set list is needed to resolve decklists, load it before serving
+    get_sets()
+    web.run_app(make_app(config), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, Optional, Tuple
+
+import requests
+from pokemontcgsdk import PokemonTcgException, RestClient
+from pokemontcgsdk.config import __endpoint__
+from requests.adapters import HTTPAdapter
+
+MAX_CONNECTIONS = 8  # Pooled connections, also the maximum number of requests in flight
+MAX_RETRIES = 4
+BACKOFF_BASE = 0.5  # Seconds, the retry delays are drawn from [0, BACKOFF_BASE * 2 ** attempt]
+BACKOFF_CAP = 30.0
+REQUEST_TIMEOUT = 30.0
+QUEUE_TIMEOUT = 60.0  # Longest wait for a rate limit token before giving up on a request
+# The API allows 30 requests a minute without a key, the limits of a key are much higher
+RATE_WITHOUT_KEY = (0.5, 30)  # Requests per second and burst size
+RATE_WITH_KEY = (10.0, 50)
+
+_SDK_GET = RestClient.__dict__["get"]
+
+
+class ApiError(PokemonTcgException):
+    pass
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float) -> None:
+        """
+        Token bucket rate limiter. Callers reserve a token and sleep until it is due, outside the lock, so that
+        a burst is spread over time in arrival order rather than rejected.
+
+        :param rate:        Tokens added per second.
+        :param capacity:    Maximum number of tokens, the size of the bursts let through without waiting.
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self, timeout: Optional[float] = None) -> None:
+        """
+        Take a token, waiting for it if the bucket is empty.
+
+        :param timeout:     The longest wait, in seconds.
+        :raise ApiError:    If the token would not be available within `timeout`.
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            wait = max(0.0, (1 - self.tokens) / self.rate)
+            if timeout is not None and wait > timeout:
+                raise ApiError(f"Rate limit queue full, the next request slot is in {wait:.0f}s")
+            self.tokens -= 1
+        if wait:
+            time.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        """
+        Hold back every caller for a while, e.g. when the server says the quota is exhausted.
+
+        :param seconds:     The duration of the pause.
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+class ApiClient:
+    def __init__(self, endpoint: Optional[str] = None, api_key: Optional[str] = None,
+                 rate: Optional[Tuple[float, float]] = None, max_connections: int = MAX_CONNECTIONS,
+                 max_retries: int = MAX_RETRIES) -> None:
+        """
+        HTTP client of the Pokémon TCG API shared by every thread of the process: requests go through a pool of
+        keep-alive connections, a token bucket sized to the quota of the API key, and jittered exponential
+        retries of throttled, failed and timed out requests. Identical requests in flight at the same time are
+        sent once and share the response.
+
+        :param endpoint:            Base URL replacing the SDK's, e.g. of a local mock server.
+        :param api_key:             The API key.
+        :param rate:                Requests per second and burst size, by default from the presence of a key.
+        :param max_connections:     Size of the connection pool and maximum number of requests in flight.
+        :param max_retries:         Retries of a request before giving up.
+        """
+        self.endpoint = (endpoint or __endpoint__).rstrip("/")
+        self.max_retries = max_retries
+        self.bucket = TokenBucket(*(rate or (RATE_WITH_KEY if api_key else RATE_WITHOUT_KEY)))
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_connections, pool_block=True)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["User-Agent"] = "pokemon-tcg-collection"
+        if api_key:
+            self.session.headers["X-Api-Key"] = api_key
+        self.requests = 0
+        self.retries = 0
+        self.coalesced = 0
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._in_flight: Dict[tuple, Future] = {}
+        self._lock = threading.Lock()
+
+    def get(self, url: str, params: Optional[dict] = None) -> dict:
+        """
+        Send a GET request, or wait for the identical request already in flight.
+
+        :param url:         The URL, under the SDK's endpoint or this client's.
+        :param params:      The query parameters.
+        :return:            The decoded JSON response.
+        :raise PokemonTcgException: If the API rejects the request, e.g. for an unknown card.
+        :raise ApiError:    If the request still fails after the retries.
+        """
+        if url.startswith(__endpoint__):
+            url = self.endpoint + url[len(__endpoint__):]
+        key = (url, tuple(sorted((name, str(value)) for name, value in (params or {}).items())))
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+        try:
+            response = self._send(url, params)
+            future.set_result(response)
+            return response
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def _send(self, url: str, params: Optional[dict]) -> dict:
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire(QUEUE_TIMEOUT)
+            delay = None
+            try:
+                with self._slots:
+                    self.requests += 1
+                    response = self.session.get(url, params=params, timeout=REQUEST_TIMEOUT)
+            except requests.RequestException as e:
+                error = str(e)
+            else:
+                if response.status_code < 400:
+                    try:
+                        return response.json()
+                    except ValueError:  # e.g. the error page of a proxy, retried like a server error
+                        error = f"HTTP {response.status_code} with a body that is not JSON: {response.text[:200]}"
+                else:
+                    error = f"HTTP {response.status_code}: {response.text[:200]}"
+                    if response.status_code != 429 and response.status_code < 500:
+                        raise PokemonTcgException(error)
+                    retry_after = response.headers.get("Retry-After", "")
+                    delay = float(retry_after) if retry_after.replace(".", "", 1).isdigit() else None
+                    if response.status_code == 429:
+                        self.bucket.pause(delay if delay is not None else BACKOFF_BASE * 2 ** attempt)
+            if attempt == self.max_retries:
+                raise ApiError(f"Request to {url} failed after {attempt + 1} attempts: {error}")
+            self.retries += 1
+            time.sleep(delay if delay is not None else random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt)))
+        raise AssertionError("unreachable")
+
+
+_client: Optional[ApiClient] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> ApiClient:
+    """
+    Get the process-wide API client, configured from the environment on first use: `POKEMON_API_URL` replaces
+    the API's base URL, e.g. with a mock server's, and the key is the SDK's.
+
+    :return:    The client.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = ApiClient(os.getenv("POKEMON_API_URL"),
+                                    RestClient.api_key or os.getenv("POKEMONTCG_IO_API_KEY"))
+    return _client
+
+
+def install() -> None:
+    """
+    Route the requests of the SDK through the process-wide client, unless its transport was already replaced,
+    e.g. by `benchmarks.fake_api.installed`.
+    """
+    if RestClient.__dict__["get"] is _SDK_GET:
+        RestClient.get = classmethod(lambda cls, url, params={}: get_client().get(url, params))
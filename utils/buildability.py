@@ -0,0 +1,204 @@
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+from pokemontcgsdk import Card
+
+from utils.deck import Deck
+
+MAX_COMBINATIONS = 20  # Alternatives listed per group of decks competing for the same copies
+MAX_SEARCH_NODES = 20000  # Bound on the combinations explored per group
+
+
+class BuildabilityMatrix:
+    def __init__(self, cards: Optional[Dict[str, Tuple[Card, int]]] = None,
+                 decks: Optional[Iterable[Deck]] = None) -> None:
+        """
+        Sparse deck × card requirement matrix compared against the owned quantity of each card. Each deck is
+        a row holding the columns of its cards and the copies it needs, and a card → decks index lets a change
+        in the collection only revisit the decks that use the card.
+
+        :param cards:   Dictionary of card IDs to tuples of cards and owned quantities.
+        :param decks:   The decks.
+        """
+        self.card_ids: List[str] = []
+        self.card_index: Dict[str, int] = {}
+        self.owned = np.zeros(0, dtype=np.int32)
+        self.rows: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self.card_decks: Dict[int, Set[str]] = defaultdict(set)
+        self.shortfalls: Dict[str, int] = {}
+        for card_id, (_, quantity) in (cards or {}).items():
+            self.set_owned(card_id, quantity)
+        for deck in decks or []:
+            self.set_deck(deck)
+
+    def _column(self, card_id: str) -> int:
+        column = self.card_index.get(card_id)
+        if column is None:
+            column = len(self.card_ids)
+            self.card_index[card_id] = column
+            self.card_ids.append(card_id)
+            if column >= len(self.owned):
+                # Grow geometrically so that adding cards one at a time stays amortized O(1)
+                self.owned = np.concatenate([self.owned, np.zeros(max(64, len(self.owned)), dtype=np.int32)])
+        return column
+
+    def _update_shortfall(self, name: str) -> None:
+        columns, required = self.rows[name]
+        self.shortfalls[name] = int(np.maximum(required - self.owned[columns], 0).sum())
+
+    def set_owned(self, card_id: str, quantity: int) -> None:
+        """
+        Update the owned quantity of a card.
+
+        :param card_id:     The ID of the card.
+        :param quantity:    The new owned quantity, 0 if the card left the collection.
+        """
+        column = self._column(card_id)
+        self.owned[column] = max(quantity, 0)
+        for name in self.card_decks.get(column, ()):
+            self._update_shortfall(name)
+
+    def set_deck(self, deck: Deck) -> None:
+        """
+        Add a deck, or replace its row after it was edited.
+
+        :param deck:    The deck.
+        """
+        self.remove_deck(deck.name)
+        deck_cards = deck.cards()
+        columns = np.fromiter((self._column(card.id) for card, _ in deck_cards), dtype=np.int64,
+                              count=len(deck_cards))
+        required = np.fromiter((quantity for _, quantity in deck_cards), dtype=np.int32, count=len(deck_cards))
+        self.rows[deck.name] = (columns, required)
+        for column in columns.tolist():
+            self.card_decks[column].add(deck.name)
+        self._update_shortfall(deck.name)
+
+    def remove_deck(self, name: str) -> None:
+        """
+        Remove a deck.
+
+        :param name:    The name of the deck.
+        """
+        row = self.rows.pop(name, None)
+        if row is None:
+            return
+        for column in row[0].tolist():
+            self.card_decks[column].discard(name)
+        del self.shortfalls[name]
+
+    def missing(self, name: str) -> Dict[str, int]:
+        """
+        Get the cards a deck is missing.
+
+        :param name:    The name of the deck.
+        :return:        Dictionary of card IDs to the number of missing copies.
+        """
+        columns, required = self.rows[name]
+        short = required - self.owned[columns]
+        return {self.card_ids[column]: int(count) for column, count in zip(columns, short) if count > 0}
+
+    def complete_decks(self) -> List[str]:
+        """
+        :return:    The names of the non-empty decks that can be built from the collection.
+        """
+        return [name for name, shortfall in self.shortfalls.items() if shortfall == 0 and len(self.rows[name][0])]
+
+    def combined_shortfall(self, names: Iterable[str]) -> Dict[str, int]:
+        """
+        Get the cards missing to build several decks at the same time, without sharing copies between them.
+
+        :param names:   The names of the decks.
+        :return:        Dictionary of card IDs to the number of missing copies.
+        """
+        rows = [self.rows[name] for name in names]
+        if not rows:
+            return {}
+        columns = np.concatenate([row[0] for row in rows])
+        required = np.concatenate([row[1] for row in rows])
+        unique_columns, inverse = np.unique(columns, return_inverse=True)
+        demand = np.bincount(inverse, weights=required).astype(np.int32)
+        short = demand - self.owned[unique_columns]
+        return {self.card_ids[column]: int(count) for column, count in zip(unique_columns, short) if count > 0}
+
+    def simultaneous_builds(self) -> Tuple[List[str], List[List[List[str]]]]:
+        """
+        Find which complete decks can be built at the same time. Decks are grouped by the cards they compete for,
+        i.e. cards whose combined demand exceeds the owned quantity, and each group is searched for its maximal
+        combinations of decks that fit in the collection together.
+
+        :return:    The complete decks that never compete for copies, and for each group of competing decks
+                    its alternative combinations, largest first.
+        """
+        complete = self.complete_decks()
+        if not complete:
+            return [], []
+        demand = np.zeros(len(self.owned), dtype=np.int64)
+        for name in complete:
+            columns, required = self.rows[name]
+            np.add.at(demand, columns, required)
+        contested = demand > self.owned
+
+        # Union-find of the decks sharing a contested card
+        parent = {name: name for name in complete}
+
+        def find(name: str) -> str:
+            while parent[name] != name:
+                parent[name] = parent[parent[name]]
+                name = parent[name]
+            return name
+
+        free: List[str] = []
+        first_deck: Dict[int, str] = {}
+        for name in complete:
+            columns = self.rows[name][0]
+            contested_columns = columns[contested[columns]].tolist()
+            if not contested_columns:
+                free.append(name)
+            for column in contested_columns:
+                if column in first_deck:
+                    parent[find(name)] = find(first_deck[column])
+                else:
+                    first_deck[column] = name
+        groups: Dict[str, List[str]] = defaultdict(list)
+        free_decks = set(free)
+        for name in complete:
+            if name not in free_decks:
+                groups[find(name)].append(name)
+
+        choices = [self._maximal_combinations(group, contested) for group in groups.values()]
+        return free, choices
+
+    def _maximal_combinations(self, names: List[str], contested: np.ndarray) -> List[List[str]]:
+        # Dense group × card matrix over the cards the group competes for, small enough to test every deck at once
+        group_columns = np.unique(np.concatenate([self.rows[name][0] for name in names]))
+        group_columns = group_columns[contested[group_columns]]
+        requirements = np.zeros((len(names), len(group_columns)), dtype=np.int64)
+        for row, name in enumerate(names):
+            columns, required = self.rows[name]
+            positions = np.searchsorted(group_columns, columns)
+            found = (positions < len(group_columns)) & (group_columns[np.minimum(positions, len(group_columns) - 1)]
+                                                        == columns)
+            requirements[row, positions[found]] = required[found]
+        capacity = self.owned[group_columns].astype(np.int64)
+
+        combinations: List[List[str]] = []
+        nodes = 0
+
+        def search(start: int, chosen: List[int], used: np.ndarray) -> None:
+            nonlocal nodes
+            nodes += 1
+            fits = np.all(used + requirements <= capacity, axis=1)
+            fits[chosen] = False
+            candidates = np.flatnonzero(fits[start:]) + start
+            # A combination is only kept if no other deck of the group fits into it
+            if not fits.any():
+                combinations.append([names[index] for index in chosen])
+            for candidate in candidates.tolist():
+                if len(combinations) >= MAX_COMBINATIONS or nodes >= MAX_SEARCH_NODES:
+                    return
+                search(candidate + 1, chosen + [candidate], used + requirements[candidate])
+
+        search(0, [], np.zeros(len(capacity), dtype=np.int64))
+        return sorted(combinations, key=len, reverse=True)
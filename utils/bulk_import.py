@@ -0,0 +1,217 @@
+import csv
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from pokemontcgsdk import Card
+
+from utils.catalog import get_catalog
+from utils.pokemon_api import find_cards_by_ids, get_sets, is_section_header, parse_card_line
+
+CHUNK_SIZE = 1000  # Rows resolved together
+API_BATCH_SIZE = 100  # Card IDs fetched per API query
+API_WORKERS = 4
+
+# Accepted CSV header names, compared lower-cased with underscores replaced by spaces
+QUANTITY_COLUMNS = {"quantity", "qty", "count", "amount", "copies"}
+CARD_ID_COLUMNS = {"id", "card id"}
+SET_ID_COLUMNS = {"set id"}
+SET_CODE_COLUMNS = {"set", "set code", "ptcgo code", "ptcgocode", "code"}
+NUMBER_COLUMNS = {"number", "card number", "collector number", "no", "#"}
+
+
+class ImportRow(NamedTuple):
+    line: int
+    text: str
+    quantity: int
+    card_ids: Tuple[str, ...]  # Candidate card IDs, in order of preference
+
+
+def _column(header: List[str], names: set) -> Optional[int]:
+    for index, column in enumerate(header):
+        if column.strip().lower().replace("_", " ") in names:
+            return index
+    return None
+
+
+def candidate_ids(set_code: str, card_number: str) -> Tuple[str, ...]:
+    """
+    Get the IDs a card written with a PTCGO set code and number may have, one per set sharing the code.
+
+    Args:
+        set_code (str): The PTCGO code of the set, e.g. `PAL`.
+        card_number (str): The number of the card in the set.
+
+    Returns:
+        Tuple[str, ...]: The candidate card IDs, e.g. `sv2-185`.
+    """
+    catalog = get_catalog()
+    if not catalog.sets:
+        get_sets()
+    return tuple(f"{set_id}-{card_number}" for set_id in catalog.set_ids_for_code(set_code))
+
+
+def _iter_csv_rows(header: List[str], lines: Iterable[str], first_line: int) -> Iterator[ImportRow]:
+    quantity_column = _column(header, QUANTITY_COLUMNS)
+    card_id_column = _column(header, CARD_ID_COLUMNS)
+    set_id_column = _column(header, SET_ID_COLUMNS)
+    set_code_column = _column(header, SET_CODE_COLUMNS)
+    number_column = _column(header, NUMBER_COLUMNS)
+
+    for line, values in enumerate(csv.reader(lines), start=first_line):
+        if not any(value.strip() for value in values):
+            continue
+        text = ",".join(values)
+
+        def value_of(column: Optional[int]) -> str:
+            return values[column].strip() if column is not None and column < len(values) else ""
+
+        try:
+            quantity = int(value_of(quantity_column) or 1)
+        except ValueError:
+            quantity = 0
+        if value_of(card_id_column):
+            card_ids = (value_of(card_id_column),)
+        elif value_of(set_id_column) and value_of(number_column):
+            card_ids = (f"{value_of(set_id_column)}-{value_of(number_column)}",)
+        elif value_of(set_code_column) and value_of(number_column):
+            card_ids = candidate_ids(value_of(set_code_column).upper(), value_of(number_column))
+        else:
+            card_ids = ()
+        yield ImportRow(line, text, quantity, card_ids)
+
+
+def _iter_decklist_rows(lines: Iterable[str], first_line: int) -> Iterator[ImportRow]:
+    for line, text in enumerate(lines, start=first_line):
+        text = text.strip()
+        # Skip blank lines and PTCGO/PTCGL section headers such as "Pokémon: 12"
+        if not text or is_section_header(text):
+            continue
+        parsed = parse_card_line(text)
+        if parsed is None:
+            yield ImportRow(line, text, 0, ())
+            continue
+        quantity, set_code, card_number = parsed
+        yield ImportRow(line, text, quantity, candidate_ids(set_code, card_number))
+
+
+def iter_rows(lines: Iterable[str]) -> Iterator[ImportRow]:
+    """
+    Stream the rows of a collection export. CSV files are recognized by a header naming at least a card ID
+    or a set and number column. Anything else is read as PTCGO-style lines such as "3 Regidrago V SIT 135".
+
+    Args:
+        lines (Iterable[str]): The lines of the export, e.g. an open text file.
+
+    Returns:
+        Iterator[ImportRow]: The parsed rows. Rows that could not be parsed have no candidate card IDs.
+    """
+    lines = iter(lines)
+    for first_line, text in enumerate(lines, start=1):
+        if text.strip():
+            break
+    else:
+        return
+
+    header = next(csv.reader([text]))
+    is_csv = len(header) > 1 and (
+            _column(header, CARD_ID_COLUMNS) is not None
+            or _column(header, NUMBER_COLUMNS) is not None
+    )
+    if is_csv:
+        yield from _iter_csv_rows(header, lines, first_line + 1)
+    else:
+        yield from _iter_decklist_rows([text], first_line)
+        yield from _iter_decklist_rows(lines, first_line + 1)
+
+
+def chunks(rows: Iterable[ImportRow], size: int = CHUNK_SIZE) -> Iterator[List[ImportRow]]:
+    """
+    Group rows into lists of at most `size` rows.
+
+    Args:
+        rows (Iterable[ImportRow]): The rows to group.
+        size (int): Maximum number of rows per chunk.
+
+    Returns:
+        Iterator[List[ImportRow]]: The chunks.
+    """
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+
+def resolve_chunk(chunk: List[ImportRow], known_cards: Dict[str, Card],
+                  unknown_ids: Optional[set] = None) -> List[Optional[Card]]:
+    """
+    Resolve the rows of a chunk to cards, looking them up in `known_cards` first, then in the catalog,
+    and fetching the remaining ones from the API in batched queries.
+
+    Args:
+        chunk (List[ImportRow]): The rows to resolve.
+        known_cards (Dict[str, Card]): Cards already at hand, e.g. the user's collection. Updated with
+            the cards fetched from the API.
+        unknown_ids (Optional[set]): Card IDs the API did not find in earlier chunks, not fetched again.
+            Updated with the card IDs not found in this chunk.
+
+    Returns:
+        List[Optional[Card]]: The card of each row, or None if it could not be resolved.
+    """
+    catalog = get_catalog()
+
+    def lookup(row: ImportRow) -> Optional[Card]:
+        for card_id in row.card_ids:
+            card = known_cards.get(card_id) or catalog.get(card_id)
+            if card is not None:
+                return card
+        return None
+
+    missing = list(dict.fromkeys(
+        card_id for row in chunk if row.quantity > 0 and lookup(row) is None for card_id in row.card_ids
+        if unknown_ids is None or card_id not in unknown_ids
+    ))
+    batches = [missing[i:i + API_BATCH_SIZE] for i in range(0, len(missing), API_BATCH_SIZE)]
+    if batches:
+        with ThreadPoolExecutor(max_workers=API_WORKERS) as executor:
+            for found in executor.map(find_cards_by_ids, batches):
+                known_cards.update(found)
+    if unknown_ids is not None:
+        unknown_ids.update(card_id for card_id in missing if card_id not in known_cards)
+
+    return [lookup(row) if row.quantity > 0 else None for row in chunk]
+
+
+def resolve_collection_import(
+        lines: Iterable[str],
+        known_cards: Optional[Dict[str, Card]] = None,
+        progress: Optional[Callable[[int], None]] = None,
+        chunk_size: int = CHUNK_SIZE,
+) -> Tuple[Dict[str, Tuple[Card, int]], List[Tuple[int, str]]]:
+    """
+    Resolve a CSV or decklist export to cards, streaming through it one chunk at a time.
+
+    Args:
+        lines (Iterable[str]): The lines of the export.
+        known_cards (Optional[Dict[str, Card]]): Cards already at hand, e.g. the user's collection.
+        progress (Optional[Callable[[int], None]]): Called with the number of rows processed after each chunk.
+        chunk_size (int): Number of rows resolved together.
+
+    Returns:
+        Tuple[Dict[str, Tuple[Card, int]], List[Tuple[int, str]]]: The cards to add, as a dictionary of
+        card IDs to tuples of cards and quantities, and the line number and text of every unresolved row.
+    """
+    known_cards = dict(known_cards or {})
+    resolved: Dict[str, Tuple[Card, int]] = {}
+    unresolved: List[Tuple[int, str]] = []
+    processed = 0
+    for chunk in chunks(iter_rows(lines), chunk_size):
+        for row, card in zip(chunk, resolve_chunk(chunk, known_cards)):
+            if card is None:
+                unresolved.append((row.line, row.text))
+            else:
+                quantity = resolved[card.id][1] if card.id in resolved else 0
+                resolved[card.id] = (card, quantity + row.quantity)
+        processed += len(chunk)
+        if progress:
+            progress(processed)
+    return resolved, unresolved
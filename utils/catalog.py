@@ -0,0 +1,307 @@
+import atexit
+import os
+import pickle
+import threading
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, Iterator, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows, where only the threads of a single process are serialized
+    fcntl = None
+
+from utils.catalog_snapshot import CatalogSnapshot, SnapshotError, merge_records, write_snapshot
+
+if TYPE_CHECKING:
+    from pokemontcgsdk import Card, Set
+
+CATALOG_PATH = os.path.join("data", ".catalog")
+SNAPSHOT_FILE = "catalog.bin"
+LEGACY_SNAPSHOT_FILE = "catalog.pkl"  # Pickled snapshot of earlier versions, converted on the next save
+LOCK_FILE = "catalog.lock"
+SETS_MAX_AGE = 24 * 60 * 60  # Refresh the set list from the API once a day
+
+
+class Catalog:
+    def __init__(self, sets: Optional[List["Set"]] = None, cards: Optional[Dict[str, "Card"]] = None,
+                 sets_updated_at: float = 0.0, snapshot: Optional[CatalogSnapshot] = None) -> None:
+        """
+        Local copy of the set list and of every card the app has fetched so far. The cards of the snapshot file
+        are read from its shared memory map, `cards` only holds the cards fetched since it was written.
+
+        :param sets:                The known sets.
+        :param cards:               Dictionary of card IDs to the known cards that are not in the snapshot.
+        :param sets_updated_at:     Timestamp of the last time the set list was fetched from the API.
+        :param snapshot:            The mapped snapshot file, if any.
+        """
+        self.sets: List["Set"] = []
+        self.cards: Dict[str, "Card"] = cards or {}
+        self.snapshot = snapshot
+        self.sets_updated_at = sets_updated_at
+        self.dirty = False
+        self._sets_by_code: Dict[str, List[str]] = {}
+        self._code_by_set: Dict[str, str] = {}
+        self._listeners: List[Callable[[List["Card"]], None]] = []
+        self._lock = threading.Lock()
+        self.set_sets(sets or [], sets_updated_at)
+        self.dirty = False
+
+    def set_sets(self, sets: List["Set"], updated_at: Optional[float] = None) -> None:
+        """
+        Replace the set list.
+
+        :param sets:        The sets.
+        :param updated_at:  When the sets were fetched, now if not given.
+        """
+        sets_by_code: Dict[str, List[str]] = {}
+        code_by_set: Dict[str, str] = {}
+        for s in sets:
+            if s.ptcgoCode:
+                sets_by_code.setdefault(s.ptcgoCode.strip().upper(), []).append(s.id)
+                code_by_set[s.id] = s.ptcgoCode
+        with self._lock:
+            self.sets = sets
+            self._sets_by_code = sets_by_code
+            self._code_by_set = code_by_set
+            self.sets_updated_at = time.time() if updated_at is None else updated_at
+            self.dirty = True
+
+    def add_listener(self, listener: Callable[[List["Card"]], None]) -> None:
+        """
+        Call a function with the cards added to the catalog from now on, e.g. to index them. Registered before
+        reading the catalog, so that the cards added while it is read are not missed, they may be seen twice.
+
+        :param listener:    The function, called with the list of newly added cards.
+        """
+        with self._lock:
+            self._listeners.append(listener)
+
+    def add_cards(self, cards: Iterable["Card"]) -> None:
+        """
+        Remember cards returned by the API, and pass the new ones to the listeners.
+
+        :param cards:   The cards to remember.
+        """
+        added = []
+        with self._lock:
+            for card in cards:
+                if card is not None and card.id not in self.cards and \
+                        (self.snapshot is None or card.id not in self.snapshot):
+                    self.cards[card.id] = card
+                    added.append(card)
+                    self.dirty = True
+            listeners = list(self._listeners)
+        if added:
+            for listener in listeners:
+                listener(added)
+
+    def __iter__(self) -> Iterator["Card"]:
+        """
+        :return:    Every card of the catalog. The cards of the snapshot are unpickled one by one rather than
+                    loaded into its cache.
+        """
+        with self._lock:
+            overlay, snapshot = dict(self.cards), self.snapshot
+        yield from overlay.values()
+        if snapshot is not None:
+            for card_id, record in snapshot.records():
+                if card_id not in overlay:
+                    yield pickle.loads(record)
+
+    def get(self, card_id: str) -> Optional["Card"]:
+        """
+        Get a card by ID.
+
+        :param card_id:     The ID of the card, e.g. `sv2-185`.
+        :return:            The card, or None if it is not in the catalog.
+        """
+        card = self.cards.get(card_id)
+        if card is None and self.snapshot is not None:
+            card = self.snapshot.get(card_id)
+        return card
+
+    def set_ids_for_code(self, set_code: str) -> List[str]:
+        """
+        Get the IDs of the sets with the given PTCGO code.
+
+        :param set_code:    The PTCGO code, e.g. `PAL`.
+        :return:            The matching set IDs.
+        """
+        return self._sets_by_code.get(set_code.strip().upper(), [])
+
+    def ptcgo_code(self, set_id: str) -> Optional[str]:
+        """
+        Get the PTCGO code of a set.
+
+        :param set_id:      The ID of the set, e.g. `sv2`.
+        :return:            The PTCGO code, or None if the set has none or is unknown.
+        """
+        return self._code_by_set.get(set_id)
+
+    def find(self, set_code: str, card_number: str) -> Optional["Card"]:
+        """
+        Find a card by PTCGO set code and card number, as written in decklists.
+
+        :param set_code:        The PTCGO code of the set.
+        :param card_number:     The number of the card in the set.
+        :return:                The card, or None if it is not in the catalog.
+        """
+        for set_id in self.set_ids_for_code(set_code):
+            card = self.get(f"{set_id}-{card_number}")
+            if card is not None:
+                return card
+        return None
+
+    def sets_stale(self) -> bool:
+        """
+        :return:    Whether the set list is missing or older than `SETS_MAX_AGE`.
+        """
+        return not self.sets or time.time() - self.sets_updated_at > SETS_MAX_AGE
+
+
+_catalog: Optional[Catalog] = None
+_catalog_lock = threading.Lock()
+_save_lock = threading.Lock()
+_warm_up_thread: Optional[threading.Thread] = None
+
+
+def snapshot_path() -> str:
+    """
+    :return:    The path of the catalog snapshot file.
+    """
+    return os.path.join(CATALOG_PATH, SNAPSHOT_FILE)
+
+
+def open_snapshot() -> Optional[CatalogSnapshot]:
+    """
+    Map the catalog snapshot file.
+
+    :return:    The snapshot, or None if there is no readable snapshot.
+    """
+    try:
+        return CatalogSnapshot(snapshot_path())
+    except (OSError, SnapshotError, EOFError, pickle.UnpicklingError):
+        return None
+
+
+def load_snapshot() -> Catalog:
+    """
+    Load the catalog from its snapshot file. Only the set list is read, the cards are looked up in the mapped file.
+
+    :return:    The loaded catalog, or an empty one if there is no readable snapshot.
+    """
+    snapshot = open_snapshot()
+    if snapshot is not None:
+        return Catalog(snapshot.sets, None, snapshot.sets_updated_at, snapshot)
+    try:
+        with open(os.path.join(CATALOG_PATH, LEGACY_SNAPSHOT_FILE), "rb") as f:
+            data = pickle.load(f)
+        catalog = Catalog(data["sets"], data["cards"], data["sets_updated_at"])
+        catalog.dirty = True
+        return catalog
+    except (OSError, EOFError, pickle.UnpicklingError, KeyError):
+        return Catalog()
+
+
+@contextmanager
+def _snapshot_lock() -> Iterator[None]:
+    # Held across threads and processes while a snapshot is merged and written, so that no save is lost
+    with _save_lock:
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(CATALOG_PATH, LOCK_FILE), "ab") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def save_snapshot(catalog: Catalog) -> None:
+    """
+    Atomically write the catalog to its snapshot file, merged with the cards other processes saved since the catalog
+    was loaded, then read the catalog's cards from the new file.
+
+    :param catalog:     The catalog to save.
+    """
+    os.makedirs(CATALOG_PATH, exist_ok=True)
+    path = snapshot_path()
+    with catalog._lock:
+        sets, cards, sets_updated_at = catalog.sets, dict(catalog.cards), catalog.sets_updated_at
+        snapshot = catalog.snapshot
+        catalog.dirty = False
+    with _snapshot_lock():
+        on_disk = open_snapshot()
+        if on_disk is not None and snapshot is not None and on_disk.inode == snapshot.inode:
+            on_disk = None
+        if on_disk is not None and on_disk.sets_updated_at > sets_updated_at:
+            sets, sets_updated_at = on_disk.sets, on_disk.sets_updated_at
+        write_snapshot(path, sets, merge_records([on_disk, snapshot], cards.values()), sets_updated_at)
+        saved = open_snapshot()
+
+    if saved is not None:
+        # The cards already unpickled stay in memory rather than being read again
+        saved.preload(cards, snapshot)
+        with catalog._lock:
+            catalog.snapshot = saved
+            for card_id in cards:
+                catalog.cards.pop(card_id, None)
+
+
+def get_catalog() -> Catalog:
+    """
+    Get the process-wide catalog, loading it from the snapshot if `warm_up` has not done it yet.
+
+    :return:    The catalog.
+    """
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                _catalog = load_snapshot()
+    return _catalog
+
+
+def set_catalog(catalog: Optional[Catalog]) -> None:
+    """
+    Replace the process-wide catalog, or drop it so the next `get_catalog` reloads the snapshot.
+
+    :param catalog:     The new catalog.
+    """
+    global _catalog
+    with _catalog_lock:
+        _catalog = catalog
+
+
+def _warm_up() -> None:
+    catalog = get_catalog()
+    # Imported here so that starting the warm-up does not pay for the scheduler's imports on the request path
+    from utils.scheduler import HIGH, get_scheduler
+    scheduler = get_scheduler()
+    if catalog.sets_stale():
+        scheduler.submit("refresh_sets", priority=HIGH)
+    if catalog.dirty:
+        save_snapshot(catalog)
+
+
+def warm_up() -> threading.Thread:
+    """
+    Load the catalog snapshot in a background thread and start the background job scheduler, which refreshes the
+    set list from the API if it is stale. Safe to call on every rerun, the work only happens once per process.
+
+    :return:    The warm-up thread.
+    """
+    global _warm_up_thread
+    with _catalog_lock:
+        if _warm_up_thread is None:
+            _warm_up_thread = threading.Thread(target=_warm_up, name="catalog-warm-up", daemon=True)
+            _warm_up_thread.start()
+    return _warm_up_thread
+
+
+@atexit.register
+def _save_on_exit() -> None:
+    if _catalog is not None and _catalog.dirty:
+        save_snapshot(_catalog)
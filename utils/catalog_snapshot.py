@@ -0,0 +1,176 @@
+import mmap
+import os
+import pickle
+import struct
+import sys
+import tempfile
+from array import array
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    from pokemontcgsdk import Card, Set
+
+MAGIC = b"PTCGCAT\x01"
+# Magic, card count, sets updated at, then the offset of the index, strings, sets and records sections
+HEADER = struct.Struct("<8sQdQQQQ")
+INDEX_FIELDS = 4  # Per card: offset and length of its ID in the strings, offset and length of its record
+
+
+class SnapshotError(Exception):
+    pass
+
+
+class CatalogSnapshot:
+    def __init__(self, path: str) -> None:
+        """
+        Read-only view of a catalog snapshot file, memory-mapped so that every process reading the same file
+        shares its pages. The file holds a fixed-width index of the cards sorted by ID, a string table of the IDs
+        and one pickled record per card: looking a card up is a binary search over the mapped index, and only the
+        record of the card found is unpickled, once per process.
+
+        :param path:    The path of the snapshot file, as written by `write_snapshot`.
+        """
+        if sys.byteorder != "little":
+            raise SnapshotError("Catalog snapshots are little-endian")
+        with open(path, "rb") as f:
+            self.inode = os.fstat(f.fileno()).st_ino
+            try:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError as e:  # Empty file
+                raise SnapshotError(str(e)) from e
+        if len(self._mmap) < HEADER.size:
+            raise SnapshotError("Truncated catalog snapshot")
+        magic, count, self.sets_updated_at, index_offset, self._strings_offset, sets_offset, self._records_offset = \
+            HEADER.unpack_from(self._mmap)
+        if magic != MAGIC or self._records_offset > len(self._mmap):
+            raise SnapshotError("Not a catalog snapshot")
+        self._count = count
+        self._index = memoryview(self._mmap)[index_offset:index_offset + count * INDEX_FIELDS * 4].cast("I")
+        # The set list is small and needed whole, it is the only part unpickled up front
+        self.sets: List["Set"] = pickle.loads(self._mmap[sets_offset:self._records_offset])
+        self._loaded: Dict[str, "Card"] = {}
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _id_at(self, position: int) -> bytes:
+        start = self._strings_offset + self._index[position * INDEX_FIELDS]
+        return self._mmap[start:start + self._index[position * INDEX_FIELDS + 1]]
+
+    def _record_at(self, position: int) -> memoryview:
+        start = self._records_offset + self._index[position * INDEX_FIELDS + 2]
+        return memoryview(self._mmap)[start:start + self._index[position * INDEX_FIELDS + 3]]
+
+    def _position(self, card_id: str) -> int:
+        key = card_id.encode()
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._id_at(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low if low < self._count and self._id_at(low) == key else -1
+
+    def __contains__(self, card_id: str) -> bool:
+        return card_id in self._loaded or self._position(card_id) >= 0
+
+    def __iter__(self) -> Iterator[str]:
+        for position in range(self._count):
+            yield self._id_at(position).decode()
+
+    def get(self, card_id: str) -> Optional["Card"]:
+        """
+        Get a card by ID.
+
+        :param card_id:     The ID of the card, e.g. `sv2-185`.
+        :return:            The card, or None if it is not in the snapshot.
+        """
+        card = self._loaded.get(card_id)
+        if card is None:
+            position = self._position(card_id)
+            if position < 0:
+                return None
+            card = self._loaded.setdefault(card_id, pickle.loads(self._record_at(position)))
+        return card
+
+    def preload(self, cards: Dict[str, "Card"], previous: Optional["CatalogSnapshot"] = None) -> None:
+        """
+        Keep cards that were already unpickled, so that they are not read again from this snapshot.
+
+        :param cards:       Dictionary of card IDs to cards, e.g. the cards just written to this snapshot.
+        :param previous:    A snapshot this one replaces, whose unpickled cards are kept as well.
+        """
+        if previous is not None:
+            self._loaded.update(previous._loaded)
+        self._loaded.update(cards)
+
+    def records(self) -> Iterator[Tuple[str, memoryview]]:
+        """
+        :return:    The ID and pickled record of every card, without unpickling them.
+        """
+        for position in range(self._count):
+            yield self._id_at(position).decode(), self._record_at(position)
+
+
+def write_snapshot(path: str, sets: List["Set"], records: Dict[str, bytes], sets_updated_at: float) -> None:
+    """
+    Atomically write a catalog snapshot file, through a temporary file of its own so that concurrent writers never
+    write to the same file. Processes that mapped the previous file keep reading it.
+
+    :param path:                The path of the snapshot file.
+    :param sets:                The set list.
+    :param records:             Dictionary of card IDs to their pickled records, see `pickle_card`.
+    :param sets_updated_at:     Timestamp of the last time the set list was fetched from the API.
+    """
+    keys = sorted(card_id.encode() for card_id in records)
+    index = array("I")
+    strings_length = records_length = 0
+    for key in keys:
+        record_length = len(records[key.decode()])
+        index.extend((strings_length, len(key), records_length, record_length))
+        strings_length += len(key)
+        records_length += record_length
+    sets_data = pickle.dumps(sets, pickle.HIGHEST_PROTOCOL)
+    index_offset = HEADER.size
+    strings_offset = index_offset + len(index) * index.itemsize
+    sets_offset = strings_offset + strings_length
+    records_offset = sets_offset + len(sets_data)
+    descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "wb") as f:
+            f.write(HEADER.pack(MAGIC, len(keys), sets_updated_at, index_offset, strings_offset, sets_offset,
+                                records_offset))
+            f.write(index.tobytes())
+            f.writelines(keys)
+            f.write(sets_data)
+            f.writelines(records[key.decode()] for key in keys)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+
+
+def pickle_card(card: "Card") -> bytes:
+    """
+    :param card:    A card.
+    :return:        The record of the card in a snapshot.
+    """
+    return pickle.dumps(card, pickle.HIGHEST_PROTOCOL)
+
+
+def merge_records(snapshots: Iterable[Optional[CatalogSnapshot]], cards: Iterable["Card"]) -> Dict[str, bytes]:
+    """
+    Collect the records of the cards of several snapshots, copying the records of the snapshots as they are.
+
+    :param snapshots:   The snapshots, None entries are skipped.
+    :param cards:       Cards to add, that are not in the snapshots yet.
+    :return:            Dictionary of card IDs to their pickled records.
+    """
+    records: Dict[str, bytes] = {}
+    for snapshot in snapshots:
+        if snapshot is not None:
+            records.update(snapshot.records())
+    for card in cards:
+        records[card.id] = pickle_card(card)
+    return records
@@ -0,0 +1,202 @@
+import os
+import pickle
+import struct
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, BinaryIO, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows, where only the sessions of a single process are kept in sync
+    fcntl = None
+
+JOURNAL_FILE = "changes.log"
+LOCK_FILE = "changes.lock"
+JOURNAL_LIMIT = 4 * 1024 * 1024  # Size past which the journal is restarted, sessions then reload the collections
+
+CARDS = "cards"
+DECKS = "decks"
+
+_HEADER = struct.Struct("<I")
+# Starts each journal: a magic number and a random ID that tells the journal from the ones before it
+_JOURNAL_HEADER = struct.Struct("<4s16s")
+_MAGIC = b"PTCJ"
+_thread_locks: Dict[str, threading.Lock] = {}
+_thread_locks_lock = threading.Lock()
+
+
+class FeedPosition(NamedTuple):
+    journal: bytes  # ID of the journal, which changes when it is restarted, empty if there was no journal
+    offset: int  # Bytes of the journal already applied, including its header
+
+
+@contextmanager
+def user_lock(user_path: str) -> Iterator[None]:
+    """
+    Holds the lock on a user's data across threads and processes, so that a write to the collections and its
+    journal record are not interleaved with another write.
+
+    Args:
+        user_path (str): The user-specific data path.
+    """
+    with _thread_locks_lock:
+        thread_lock = _thread_locks.setdefault(os.path.abspath(user_path), threading.Lock())
+    with thread_lock:
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(user_path, LOCK_FILE), "ab") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def append_changes(user_path: str, kind: str, changes: Dict[str, Any]) -> None:
+    """
+    Appends a record to a user's journal. Records hold the new value of each changed entry rather than the
+    change itself, so applying a record twice, or to a collection that already has it, is harmless.
+    Must be called while holding `user_lock`, after the collections were saved.
+
+    Args:
+        user_path (str): The user-specific data path.
+        kind (str): CARDS or DECKS, the collection that changed.
+        changes (Dict[str, Any]): Dictionary of card IDs to tuples of cards and quantities, or of deck names
+            to decks, with None for removed entries.
+    """
+    if not changes:
+        return
+    journal_path = os.path.join(user_path, JOURNAL_FILE)
+    if not os.path.exists(journal_path) or os.path.getsize(journal_path) > JOURNAL_LIMIT \
+            or _read_journal_id(journal_path) is None:
+        _restart_journal(journal_path)
+    record = pickle.dumps((kind, changes))
+    with open(journal_path, "ab") as f:
+        f.write(_HEADER.pack(len(record)) + record)
+
+
+def _restart_journal(journal_path: str) -> None:
+    # The collections hold every change, so the journal can restart empty under a new ID. Its header is in place
+    # before it replaces the previous journal, so readers always find one
+    tmp_path = f"{journal_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_JOURNAL_HEADER.pack(_MAGIC, uuid.uuid4().bytes))
+    os.replace(tmp_path, journal_path)
+
+
+def _read_header(f: BinaryIO) -> Optional[bytes]:
+    # The ID of an open journal, None if it has no header, e.g. one written before journals had IDs
+    header = f.read(_JOURNAL_HEADER.size)
+    if len(header) < _JOURNAL_HEADER.size:
+        return None
+    magic, journal_id = _JOURNAL_HEADER.unpack(header)
+    return journal_id if magic == _MAGIC else None
+
+
+def _read_journal_id(journal_path: str) -> Optional[bytes]:
+    with open(journal_path, "rb") as f:
+        return _read_header(f)
+
+
+def compact_journal(user_path: str, min_size: int, idle: float) -> bool:
+    """
+    Restarts a user's journal ahead of `JOURNAL_LIMIT` while nobody is editing the collections, so that the restart
+    and the reload it causes do not land on a session's write.
+
+    Args:
+        user_path (str): The user-specific data path.
+        min_size (int): Size below which the journal is left alone.
+        idle (float): Seconds since the last change below which the journal is left alone.
+
+    Returns:
+        bool: Whether the journal was restarted.
+    """
+    journal_path = os.path.join(user_path, JOURNAL_FILE)
+
+    def due() -> bool:
+        try:
+            stat = os.stat(journal_path)
+        except FileNotFoundError:
+            return False
+        return stat.st_size >= min_size and time.time() - stat.st_mtime >= idle
+
+    if not due():
+        return False
+    with user_lock(user_path):
+        # Checked again, a change may have been saved while waiting for the lock
+        if not due():
+            return False
+        _restart_journal(journal_path)
+        return True
+
+
+def current_position(user_path: str) -> FeedPosition:
+    """
+    Gets the end of a user's journal. Taken before loading the collections, so that no later change is missed.
+
+    Args:
+        user_path (str): The user-specific data path.
+
+    Returns:
+        FeedPosition: The position of the end of the journal.
+    """
+    try:
+        with open(os.path.join(user_path, JOURNAL_FILE), "rb") as f:
+            journal_id = _read_header(f)
+            if journal_id is None:  # Restarted with a header by the next change
+                return FeedPosition(b"", 0)
+            return FeedPosition(journal_id, os.fstat(f.fileno()).st_size)
+    except FileNotFoundError:
+        return FeedPosition(b"", 0)
+
+
+def read_changes(user_path: str, position: FeedPosition) \
+        -> Tuple[FeedPosition, Optional[List[Tuple[str, Dict[str, Any]]]]]:
+    """
+    Reads the records appended to a user's journal since a position. Costs reading the journal's header when
+    nothing changed. A journal whose records cannot be read is treated like a restarted one.
+
+    Args:
+        user_path (str): The user-specific data path.
+        position (FeedPosition): The position up to which the journal was already applied.
+
+    Returns:
+        Tuple[FeedPosition, Optional[List[Tuple[str, Dict[str, Any]]]]]: The new position and the records in
+            order, or None if the journal was restarted and the collections must be reloaded.
+    """
+    try:
+        with open(os.path.join(user_path, JOURNAL_FILE), "rb") as f:
+            journal_id = _read_header(f)
+            if journal_id is None:  # Written before journals had IDs, restarted with one by the next change
+                return (position, []) if not position.journal else (FeedPosition(b"", 0), None)
+            if position.journal and journal_id != position.journal:
+                return FeedPosition(b"", 0), None
+            # A position taken while there was no journal reads the one created since from its start
+            offset = position.offset if position.journal else _JOURNAL_HEADER.size
+            size = os.fstat(f.fileno()).st_size
+            if size < offset:
+                return FeedPosition(b"", 0), None
+            if size == offset:
+                return FeedPosition(journal_id, offset), []
+            f.seek(offset)
+            data = f.read()
+    except FileNotFoundError:
+        return (position, []) if not position.journal else (FeedPosition(b"", 0), None)
+
+    records = []
+    view = memoryview(data)
+    start = 0
+    try:
+        while start + _HEADER.size <= len(data):
+            (length,) = _HEADER.unpack_from(view, start)
+            end = start + _HEADER.size + length
+            if end > len(data):  # A record still being written, read on the next poll
+                break
+            records.append(pickle.loads(view[start + _HEADER.size:end]))
+            start = end
+    except (pickle.UnpicklingError, struct.error, EOFError, ValueError):
+        return FeedPosition(b"", 0), None
+    return FeedPosition(journal_id, offset + start), records
@@ -0,0 +1,158 @@
+import re
+import unicodedata
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from pokemontcgsdk import Card
+
+from utils import deck_index, meta, recommender
+from utils.bulk_import import ImportRow, candidate_ids, chunks, resolve_chunk
+from utils.deck import Deck
+from utils.pokemon_api import is_section_header, parse_card_line
+from utils.storage import clear_corpus, corpus_deck_id, iter_corpus_decks, save_corpus_chunk
+
+CHUNK_DECKS = 250  # Decks resolved and written together
+DECK_HEADER = re.compile(r"^deck\s*(?:name)?\s*:\s*(.*)$", re.IGNORECASE)
+POKEMON_HEADER = re.compile(r"^\W*pok[eé]mon\b", re.IGNORECASE)
+
+
+class CorpusDecklist(NamedTuple):
+    name: str
+    rows: List[ImportRow]
+
+
+class CorpusSummary(NamedTuple):
+    decks: int
+    cards: int
+    unresolved: int
+
+
+def normalize_line(line: str) -> str:
+    """
+    Normalize a decklist line: Unicode compatibility forms, e.g. full-width digits, bullets and runs of whitespace.
+
+    Args:
+        line (str): The line to normalize.
+
+    Returns:
+        str: The normalized line, empty for blank lines.
+    """
+    return " ".join(unicodedata.normalize("NFKC", line).lstrip("*•-– \t").split())
+
+
+def iter_decklists(lines: Iterable[str]) -> Iterator[CorpusDecklist]:
+    """
+    Split a dump of decklists into decks, streaming through it. A deck starts at a "Deck: <name>" line, or at a
+    "Pokémon: <count>" section header following card lines, as PTCGL exports start with their Pokémon.
+
+    Args:
+        lines (Iterable[str]): The lines of the dump, e.g. an open text file.
+
+    Returns:
+        Iterator[CorpusDecklist]: The name and card rows of each deck, in the order of the dump. Decks without a
+        "Deck:" line are named after their position. Lines that are neither card lines nor headers are kept as
+        rows without candidate card IDs, so that they are reported as unresolved.
+    """
+    name, rows, count = "", [], 0
+    for line, text in enumerate(lines, start=1):
+        text = normalize_line(text)
+        if not text:
+            continue
+        header = DECK_HEADER.match(text)
+        if header is not None or (rows and POKEMON_HEADER.match(text) and is_section_header(text)):
+            if rows:
+                count += 1
+                yield CorpusDecklist(name or f"Deck {count}", rows)
+            name, rows = header.group(1).strip() if header is not None else "", []
+            continue
+        if is_section_header(text):
+            continue
+        parsed = parse_card_line(text)
+        if parsed is None:
+            rows.append(ImportRow(line, text, 0, ()))
+        else:
+            quantity, set_code, card_number = parsed
+            rows.append(ImportRow(line, text, quantity, candidate_ids(set_code, card_number)))
+    if rows:
+        yield CorpusDecklist(name or f"Deck {count + 1}", rows)
+
+
+def iter_resolved_decks(
+        lines: Iterable[str],
+        chunk_decks: int = CHUNK_DECKS,
+) -> Iterator[Tuple[List[Deck], List[List[Tuple[int, str]]]]]:
+    """
+    Resolve the decks of a dump, one chunk of decks at a time. The card lines of a chunk are resolved together,
+    the misses fetched from the API in batches by a pool of workers, and the cards found are cached for the
+    following chunks, so that memory grows with the number of distinct cards, not with the size of the dump.
+
+    Args:
+        lines (Iterable[str]): The lines of the dump.
+        chunk_decks (int): Number of decks resolved together.
+
+    Returns:
+        Iterator[Tuple[List[Deck], List[List[Tuple[int, str]]]]]: The decks of each chunk, named
+        "<name> #<position>" to be unique within the dump, and the line number and text of the unresolved
+        lines of each deck.
+    """
+    known_cards: Dict[str, Card] = {}
+    unknown_ids: set = set()
+    position = 0
+    for chunk in chunks(iter_decklists(lines), chunk_decks):
+        rows = [row for decklist in chunk for row in decklist.rows]
+        cards = iter(resolve_chunk(rows, known_cards, unknown_ids))
+        decks, unresolved = [], []
+        for decklist in chunk:
+            position += 1
+            deck, deck_unresolved = Deck(f"{decklist.name} #{position}", []), []
+            for row, card in zip(decklist.rows, cards):
+                if card is None:
+                    deck_unresolved.append((row.line, row.text))
+                else:
+                    for _ in range(row.quantity):
+                        deck.add_card(card)
+            decks.append(deck)
+            unresolved.append(deck_unresolved)
+        yield decks, unresolved
+
+
+def ingest_corpus(
+        lines: Iterable[str],
+        corpus: str,
+        chunk_decks: int = CHUNK_DECKS,
+        on_deck: Optional[Callable[[Deck, List[Tuple[int, str]]], None]] = None,
+) -> CorpusSummary:
+    """
+    Ingest a dump of decklists as a corpus, replacing the corpus of the same name. The decks are written to storage
+    a chunk at a time and added to the process-wide deck index, recommender and meta analytics, if they were built.
+
+    Args:
+        lines (Iterable[str]): The lines of the dump.
+        corpus (str): The name of the corpus.
+        chunk_decks (int): Number of decks resolved and written together.
+        on_deck (Optional[Callable[[Deck, List[Tuple[int, str]]], None]]): Called with each deck and its
+            unresolved lines, e.g. to report progress.
+
+    Returns:
+        CorpusSummary: The number of decks, of cards and of unresolved lines ingested.
+    """
+    for deck_id, _ in iter_corpus_decks(corpus):
+        deck_index.index_deck(deck_id, None)
+        recommender.index_deck(deck_id, None)
+        meta.index_deck(deck_id, None)
+    clear_corpus(corpus)
+
+    decks_count = cards_count = unresolved_count = 0
+    for chunk, (decks, unresolved) in enumerate(iter_resolved_decks(lines, chunk_decks)):
+        ingested = [(corpus_deck_id(corpus, deck.name), deck) for deck in decks if len(deck)]
+        save_corpus_chunk(corpus, chunk, [deck for _, deck in ingested])
+        deck_index.index_decks(ingested)
+        recommender.index_decks(ingested)
+        meta.index_decks(ingested)
+        for deck, deck_unresolved in zip(decks, unresolved):
+            if len(deck):
+                decks_count += 1
+                cards_count += len(deck)
+            unresolved_count += len(deck_unresolved)
+            if on_deck:
+                on_deck(deck, deck_unresolved)
+    return CorpusSummary(decks_count, cards_count, unresolved_count)
@@ -1,11 +1,36 @@
 import re
 from concurrent.futures import ThreadPoolExecutor
 from itertools import repeat
-from typing import Tuple
+from typing import Iterator, Tuple
 
 from pokemontcgsdk import Card
 
-from utils.pokemon_api import import_card_from_string, get_sets
+from utils.api_client import MAX_CONNECTIONS
+from utils.catalog import get_catalog
+from utils.pokemon_api import import_card_from_string, get_sets, is_section_header, parse_card_line
+
+
+def clean_card_name(card_name: str) -> str:
+    """
+    Remove anything between parentheses in a card name, as decklists do.
+
+    :param card_name:   The card name.
+    :return:            The cleaned card name.
+    """
+    return re.sub(r"\(.*\)", "", card_name).strip()
+
+
+def get_set_ptcgo_code(set_id: str) -> str:
+    """
+    Get the PTCGO code of a set, as written in decklists.
+
+    :param set_id:  The ID of the set.
+    :return:        The PTCGO code of the set, or "none" if it has none.
+    """
+    catalog = get_catalog()
+    if not catalog.sets:
+        get_sets()
+    return catalog.ptcgo_code(set_id) or "none"
 
 
 class Deck:
@@ -166,30 +191,59 @@ class Deck:
             for category in [self.trainer_cards, self.pokemon_cards, self.energy_cards]
         )
 
-    def import_from_string(self, import_data: str) -> None:
+    def import_from_string(self, import_data: str) -> list[str]:
         """
         Import a deck from a string input, containing lines of the format:
         <count> <card_name> <set_code> <card_number>
 
         Args:
             import_data (str): The string input containing the deck data.
+
+        Returns:
+            list[str]: The lines that could not be resolved to a card.
         """
         category_lines = [
             line.strip()
             for line in import_data.split("\n")
-            if line.strip() and ":" not in line
+            if line.strip() and not is_section_header(line.strip())
         ]
         sets = get_sets()  # Assuming get_sets() is defined and returns List[Set]
 
-        # Use itertools.repeat to pass 'sets' to each call
-        with ThreadPoolExecutor() as executor:
-            results = list(executor.map(import_card_from_string, category_lines, repeat(sets)))
+        # Lines of cards in the catalog are resolved right away, the others are fetched from the API concurrently
+        catalog = get_catalog()
+        results: list[Tuple[Card | None, int]] = []
+        misses = []
+        for line in category_lines:
+            parsed = parse_card_line(line)
+            card = catalog.find(parsed[1], parsed[2]) if parsed is not None else None
+            if card is None and parsed is not None:
+                misses.append(len(results))
+            results.append((card, parsed[0] if card is not None else 0))
+        if misses:
+            # Use itertools.repeat to pass 'sets' to each call, with no more threads than API connections
+            with ThreadPoolExecutor(max_workers=min(MAX_CONNECTIONS, len(misses))) as executor:
+                fetched = executor.map(import_card_from_string, [category_lines[i] for i in misses], repeat(sets))
+                for i, result in zip(misses, fetched):
+                    results[i] = result
 
         # Add fetched cards to the deck sequentially
-        for card, qty in results:
+        unresolved = []
+        for line, (card, qty) in zip(category_lines, results):
             if card:
                 for _ in range(qty):
                     self.add_card(card)
+            else:
+                unresolved.append(line)
+        return unresolved
+
+    def export_lines(self) -> Iterator[str]:
+        """
+        Generate the lines of the deck export, one card per line.
+
+        :return:  An iterator over the lines of the export.
+        """
+        for card, quantity in self.cards():
+            yield f"{quantity} {clean_card_name(card.name)} {get_set_ptcgo_code(card.set.id)} {card.number}"
 
     def export(self) -> str:
         """
@@ -197,20 +251,4 @@ class Deck:
 
         :return:  The string representation of the deck.
         """
-
-        def get_set_ptcgo_code(set_id: str) -> str:
-            for s in get_sets():
-                if s.id == set_id:
-                    return s.ptcgoCode
-            return "none"
-
-        # remove anything between the parentheses in the card name
-        def clean_card_name(card_name: str) -> str:
-            return re.sub(r"\(.*\)", "", card_name).strip()
-
-        return "\n".join(
-            [
-                f"{quantity} {clean_card_name(card.name)} {get_set_ptcgo_code(card.set.id)} {card.number}"
-                for card, quantity in self.cards()
-            ]
-        )
+        return "\n".join(self.export_lines())
@@ -0,0 +1,342 @@
+import hashlib
+import threading
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from utils.deck import Deck, clean_card_name
+
+NUM_PERM = 128  # MinHash permutations per signature
+BANDS = 32  # LSH bands of NUM_PERM // BANDS rows, decks collide from a Jaccard similarity of about 0.4
+SIGNATURE_CHUNK = 4096  # Decks whose signatures are computed together
+ARCHETYPE_THRESHOLD = 0.5  # Minimum estimated similarity for two decks to share an archetype
+COPY_MIX = np.uint64(0x9E3779B97F4A7C15)  # Mixed into the name hash to tell the copies of a card apart
+COMPACT_THRESHOLD = 1024  # Replaced or removed decks kept as dead rows before the arrays are compacted
+
+
+class Archetype(NamedTuple):
+    name: str
+    deck_ids: List[str]
+
+
+@lru_cache(maxsize=None)
+def _name_hash(card_name: str) -> int:
+    # Stable across processes, unlike hash(), so that signatures can be compared between runs
+    return int.from_bytes(hashlib.blake2b(clean_card_name(card_name).encode("utf-8"), digest_size=8).digest(),
+                          "little")
+
+
+def deck_tokens(decks: List[Deck]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Turn decks into weighted card sets: one token per copy of each card, so that the Jaccard similarity of
+    the token sets is the weighted Jaccard similarity of the decks. Cards are identified by name, so that
+    reprints of the same card count as the same card.
+
+    :param decks:   The decks.
+    :return:        The 64-bit token hashes of all the decks, one deck after the other, and the number of
+                    tokens of each deck.
+    """
+    hashes, quantities, sizes = [], [], []
+    for deck in decks:
+        size = len(hashes)
+        for category in (deck.pokemon_cards, deck.trainer_cards, deck.energy_cards):
+            for entry in category.values():
+                hashes.append(_name_hash(entry["card"].name))
+                quantities.append(entry["quantity"])
+        sizes.append(len(hashes) - size)
+    quantities = np.array(quantities, dtype=np.int64)
+    token_decks = np.repeat(np.repeat(np.arange(len(decks)), sizes), quantities)
+    token_hashes = np.repeat(np.array(hashes, dtype=np.uint64), quantities)
+    # Sort by deck then card, and number the copies of each card 0, 1, 2... within its deck
+    order = np.lexsort((token_hashes, token_decks))
+    token_decks, token_hashes = token_decks[order], token_hashes[order]
+    starts = np.ones(len(order), dtype=bool)
+    starts[1:] = (token_decks[1:] != token_decks[:-1]) | (token_hashes[1:] != token_hashes[:-1])
+    positions = np.arange(len(order))
+    copies = positions - np.maximum.accumulate(np.where(starts, positions, 0))
+    tokens = token_hashes ^ (copies.astype(np.uint64) * COPY_MIX)
+    return tokens, np.bincount(token_decks, minlength=len(decks))
+
+
+def key_pokemon(deck: Deck) -> str:
+    """
+    Get the Pokémon a deck plays the most copies of, used to name archetypes.
+
+    :param deck:    The deck.
+    :return:        The name of the Pokémon, or an empty string for decks without Pokémon.
+    """
+    pokemon = deck.get_pokemon_cards()
+    if not pokemon:
+        return ""
+    card, _ = max(pokemon, key=lambda item: item[1])
+    return clean_card_name(card.name)
+
+
+class DeckIndex:
+    def __init__(self, num_perm: int = NUM_PERM, bands: int = BANDS, seed: int = 1) -> None:
+        """
+        MinHash/LSH index of decks, answering k-nearest-deck queries without comparing against every deck,
+        and clustering the indexed decks into archetypes. Safe to use from several threads: updates and
+        queries hold the index's lock, only the signatures are computed outside of it.
+
+        :param num_perm:    Number of MinHash permutations per signature.
+        :param bands:       Number of LSH bands, must divide `num_perm`.
+        :param seed:        Seed of the permutations. Signatures are only comparable between equal seeds.
+        """
+        if num_perm % bands:
+            raise ValueError("The number of bands must divide the number of permutations.")
+        rng = np.random.default_rng(seed)
+        self.bands = bands
+        self.rows = num_perm // bands
+        # Multiply-shift hash functions (a * x + b) >> 32 over 64-bit integers, one per permutation
+        self._a = rng.integers(0, 1 << 64, num_perm, dtype=np.uint64, endpoint=False) | np.uint64(1)
+        self._b = rng.integers(0, 1 << 64, num_perm, dtype=np.uint64, endpoint=False)
+        # Odd multipliers folding the rows of a band into a single 64-bit bucket key
+        self._band_mix = rng.integers(0, 1 << 64, self.rows, dtype=np.uint64, endpoint=False) | np.uint64(1)
+
+        self.ids: List[str] = []
+        self.positions: Dict[str, int] = {}
+        self.names: List[str] = []  # Key Pokémon of each deck
+        self.signatures = np.zeros((0, num_perm), dtype=np.uint32)
+        self.band_keys = np.zeros((bands, 0), dtype=np.uint64)
+        self.alive = np.zeros(0, dtype=bool)
+        # Per band, positions sorted by bucket key for binary search. Decks added since the last sort are in
+        # an unsorted tail that queries scan linearly until it grows large enough to be merged.
+        self._sorted_positions = np.zeros((bands, 0), dtype=np.int64)
+        self._sorted_keys = np.zeros((bands, 0), dtype=np.uint64)
+        self._indexed = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """
+        :return:    The number of indexed decks.
+        """
+        with self._lock:
+            return len(self.positions)
+
+    def _signatures(self, decks: List[Deck]) -> np.ndarray:
+        tokens, counts = deck_tokens(decks)
+        # Hash each distinct token once. The extra last column is the padding of decks shorter than their chunk.
+        vocabulary, inverse = np.unique(tokens, return_inverse=True)
+        table = np.full((len(self._a), len(vocabulary) + 1), np.iinfo(np.uint32).max, dtype=np.uint32)
+        table[:, :-1] = (self._a[:, None] * vocabulary[None, :] + self._b[:, None]) >> np.uint64(32)
+
+        signatures = np.empty((len(decks), len(self._a)), dtype=np.uint32)
+        ends = np.cumsum(counts)
+        for start in range(0, len(decks), SIGNATURE_CHUNK):
+            chunk_counts = counts[start:start + SIGNATURE_CHUNK]
+            first_token = ends[start] - counts[start]
+            # Decks × tokens matrix of vocabulary indices, so that each permutation is one gather and one min
+            padded = np.full((len(chunk_counts), max(int(chunk_counts.max()), 1)), len(vocabulary), dtype=np.int64)
+            rows = np.repeat(np.arange(len(chunk_counts)), chunk_counts)
+            columns = np.arange(len(rows)) - np.repeat(np.cumsum(chunk_counts) - chunk_counts, chunk_counts)
+            padded[rows, columns] = inverse[first_token:first_token + len(rows)]
+            if padded.size <= 1024:
+                # Single decks, e.g. queries, are cheaper to hash with one gather over every permutation
+                signatures[start:start + len(chunk_counts)] = table[:, padded].min(axis=2).T
+                continue
+            for permutation in range(len(self._a)):
+                signatures[start:start + len(chunk_counts), permutation] = (
+                    np.take(table[permutation], padded).min(axis=1))
+        return signatures
+
+    def _band_keys(self, signatures: np.ndarray) -> np.ndarray:
+        bands = signatures.reshape(len(signatures), self.bands, self.rows).astype(np.uint64)
+        # Multiplications wrap modulo 2**64, which is what we want for hashing
+        return (bands * self._band_mix).sum(axis=2, dtype=np.uint64).T
+
+    def signature(self, deck: Deck) -> np.ndarray:
+        """
+        Compute the MinHash signature of a deck.
+
+        :param deck:    The deck.
+        :return:        The signature.
+        """
+        return self._signatures([deck])[0]
+
+    def add_decks(self, decks: Iterable[Tuple[str, Deck]]) -> None:
+        """
+        Index decks, replacing the previous version of decks that are already indexed.
+
+        :param decks:   Tuples of deck IDs and decks.
+        """
+        decks = list(decks)
+        if not decks:
+            return
+        signatures = self._signatures([deck for _, deck in decks])
+        band_keys = self._band_keys(signatures)
+        names = [key_pokemon(deck) for _, deck in decks]
+        with self._lock:
+            for deck_id, _ in decks:
+                self._remove(deck_id)
+            for deck_id, _ in decks:
+                self.positions[deck_id] = len(self.ids)
+                self.ids.append(deck_id)
+            self.names.extend(names)
+            self.signatures = np.concatenate([self.signatures, signatures])
+            self.band_keys = np.concatenate([self.band_keys, band_keys], axis=1)
+            self.alive = np.concatenate([self.alive, np.ones(len(decks), dtype=bool)])
+            if len(self.ids) - len(self.positions) > max(COMPACT_THRESHOLD, len(self.positions)):
+                self._compact()
+            elif len(self.ids) - self._indexed > max(1000, self._indexed // 10):
+                self._sort_bands()
+
+    def remove(self, deck_id: str) -> None:
+        """
+        Remove a deck from the index.
+
+        :param deck_id:     The ID of the deck.
+        """
+        with self._lock:
+            self._remove(deck_id)
+
+    def _remove(self, deck_id: str) -> None:
+        position = self.positions.pop(deck_id, None)
+        if position is not None:
+            self.alive[position] = False
+
+    def _compact(self) -> None:
+        positions = np.flatnonzero(self.alive)
+        self.ids = [self.ids[position] for position in positions.tolist()]
+        self.positions = {deck_id: position for position, deck_id in enumerate(self.ids)}
+        self.names = [self.names[position] for position in positions.tolist()]
+        self.signatures = self.signatures[positions]
+        self.band_keys = self.band_keys[:, positions]
+        self.alive = np.ones(len(positions), dtype=bool)
+        self._sort_bands()
+
+    def _sort_bands(self) -> None:
+        self._sorted_positions = np.argsort(self.band_keys, axis=1, kind="stable")
+        self._sorted_keys = np.take_along_axis(self.band_keys, self._sorted_positions, axis=1)
+        self._indexed = len(self.ids)
+
+    def _candidates(self, keys: np.ndarray) -> np.ndarray:
+        candidates = []
+        if self._indexed:
+            for band in range(self.bands):
+                low = int(np.searchsorted(self._sorted_keys[band], keys[band], side="left"))
+                high = int(np.searchsorted(self._sorted_keys[band], keys[band], side="right"))
+                if high > low:
+                    candidates.append(self._sorted_positions[band, low:high])
+        tail = self.band_keys[:, self._indexed:]
+        if tail.shape[1]:
+            candidates.append(np.flatnonzero((tail == keys[:, None]).any(axis=0)) + self._indexed)
+        if not candidates:
+            return np.zeros(0, dtype=np.int64)
+        candidates = np.unique(np.concatenate(candidates))
+        return candidates[self.alive[candidates]]
+
+    def query(self, deck: Deck, k: int = 10, exclude: Optional[str] = None) -> List[Tuple[str, float]]:
+        """
+        Find the indexed decks most similar to a deck.
+
+        :param deck:        The deck.
+        :param k:           The maximum number of decks to return.
+        :param exclude:     The ID of a deck to leave out, e.g. the queried deck itself.
+        :return:            Tuples of deck IDs and estimated weighted Jaccard similarities, most similar first.
+                            Decks less similar than about 0.4 are unlikely to be found.
+        """
+        signature = self.signature(deck)
+        keys = self._band_keys(signature[None, :])[:, 0]
+        with self._lock:
+            candidates = self._candidates(keys)
+            if exclude in self.positions:
+                candidates = candidates[candidates != self.positions[exclude]]
+            if not len(candidates):
+                return []
+            similarities = (self.signatures[candidates] == signature).mean(axis=1)
+            top = np.argsort(-similarities, kind="stable")[:k]
+            return [(self.ids[candidates[i]], float(similarities[i])) for i in top]
+
+    def archetypes(self, threshold: float = ARCHETYPE_THRESHOLD) -> List[Archetype]:
+        """
+        Cluster the indexed decks into archetypes: connected components of the decks sharing an LSH bucket
+        with an estimated similarity of at least `threshold`. Each archetype is named after the key Pokémon
+        of its decks.
+
+        :param threshold:   Minimum estimated similarity for two decks to be linked.
+        :return:            The archetypes, largest first.
+        """
+        from scipy.sparse import coo_matrix
+        from scipy.sparse.csgraph import connected_components
+
+        with self._lock:
+            if self._indexed < len(self.ids):
+                self._sort_bands()
+            alive_positions = np.flatnonzero(self.alive)
+            if not len(alive_positions):
+                return []
+            sources, targets = [], []
+            for band in range(self.bands):
+                order = self._sorted_positions[band][self.alive[self._sorted_positions[band]]]
+                keys = self.band_keys[band, order]
+                # Link each deck to the next one in its bucket, when they are similar enough
+                same_bucket = np.flatnonzero(keys[1:] == keys[:-1])
+                first, second = order[same_bucket], order[same_bucket + 1]
+                similar = (self.signatures[first] == self.signatures[second]).mean(axis=1) >= threshold
+                sources.append(first[similar])
+                targets.append(second[similar])
+            sources, targets = np.concatenate(sources), np.concatenate(targets)
+            graph = coo_matrix((np.ones(len(sources), dtype=np.int8), (sources, targets)),
+                               shape=(len(self.ids), len(self.ids)))
+            _, labels = connected_components(graph, directed=False)
+
+            members: Dict[int, List[int]] = {}
+            for position in alive_positions.tolist():
+                members.setdefault(int(labels[position]), []).append(position)
+            archetypes = []
+            for positions in members.values():
+                names = Counter(self.names[position] for position in positions if self.names[position])
+                top_pokemon = [name for name, _ in names.most_common(2)]
+                archetypes.append(Archetype(" / ".join(top_pokemon) or "Other", [self.ids[p] for p in positions]))
+        return sorted(archetypes, key=lambda archetype: len(archetype.deck_ids), reverse=True)
+
+
+_deck_index: Optional[DeckIndex] = None
+_deck_index_lock = threading.Lock()
+
+
+def get_deck_index() -> DeckIndex:
+    """
+    Get the process-wide index of every user's decks, building it on first use.
+
+    :return:    The deck index.
+    """
+    global _deck_index
+    if _deck_index is None:
+        with _deck_index_lock:
+            if _deck_index is None:
+                from utils.storage import iter_all_decks
+                index = DeckIndex()
+                index.add_decks(iter_all_decks())
+                _deck_index = index
+    return _deck_index
+
+
+def index_deck(deck_id: str, deck: Optional[Deck]) -> None:
+    """
+    Update a deck in the process-wide index, if it was built. Does nothing otherwise, the deck will be
+    read from storage when the index is built.
+
+    :param deck_id:     The ID of the deck, of the form "<user>/<deck name>".
+    :param deck:        The deck, or None to remove it from the index.
+    """
+    if _deck_index is None:
+        return
+    if deck is None:
+        _deck_index.remove(deck_id)
+    else:
+        _deck_index.add_decks([(deck_id, deck)])
+
+
+def index_decks(decks: Iterable[Tuple[str, Deck]]) -> None:
+    """
+    Add many decks to the process-wide index at once, if it was built.
+
+    :param decks:   Tuples of deck IDs and decks.
+    """
+    if _deck_index is None:
+        return
+    _deck_index.add_decks(decks)
@@ -0,0 +1,214 @@
+import csv
+import io
+import json
+import tempfile
+from typing import IO, BinaryIO, Callable, Dict, Iterable, Iterator, List, Tuple
+
+from pokemontcgsdk import Card
+
+from utils.deck import Deck, clean_card_name, get_set_ptcgo_code
+
+SECTIONS = ["Pokémon", "Trainer", "Energy"]
+CSV_HEADER = ["Quantity", "Card ID", "Name", "Set Code", "Number", "Supertype"]
+
+
+def _csv_line(values: list) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerow(values)
+    return buffer.getvalue()
+
+
+def _card_values(card: Card, quantity: int) -> list:
+    return [quantity, card.id, card.name, get_set_ptcgo_code(card.set.id), card.number, card.supertype]
+
+
+def _card_record(card: Card, quantity: int) -> dict:
+    return {
+        "id": card.id,
+        "name": card.name,
+        "set_id": card.set.id,
+        "set_code": get_set_ptcgo_code(card.set.id),
+        "number": card.number,
+        "supertype": card.supertype,
+        "quantity": quantity,
+    }
+
+
+def _ptcgl_line(card: Card, quantity: int) -> str:
+    return f"{quantity} {clean_card_name(card.name)} {get_set_ptcgo_code(card.set.id)} {card.number}\n"
+
+
+def _ptcgl_sections(cards: Callable[[], Iterable[Tuple[Card, int]]]) -> Iterator[str]:
+    # Counts are taken in a first pass over the cards so that the headers can be written before the lines
+    counts = {supertype: 0 for supertype in SECTIONS}
+    for card, quantity in cards():
+        if card.supertype in counts:
+            counts[card.supertype] += quantity
+    for supertype in SECTIONS:
+        if not counts[supertype]:
+            continue
+        yield f"{supertype}: {counts[supertype]}\n"
+        for card, quantity in cards():
+            if card.supertype == supertype:
+                yield _ptcgl_line(card, quantity)
+        yield "\n"
+    yield f"Total Cards: {sum(counts.values())}\n"
+
+
+def collection_csv(cards: Dict[str, Tuple[Card, int]]) -> Iterator[str]:
+    """
+    Generate a CSV export of a collection, readable by the bulk importer.
+
+    Args:
+        cards (Dict[str, Tuple[Card, int]]): Dictionary of card IDs to tuples of cards and quantities.
+
+    Returns:
+        Iterator[str]: The lines of the export.
+    """
+    yield _csv_line(CSV_HEADER)
+    for card, quantity in cards.values():
+        yield _csv_line(_card_values(card, quantity))
+
+
+def collection_jsonl(cards: Dict[str, Tuple[Card, int]]) -> Iterator[str]:
+    """
+    Generate a JSON Lines export of a collection, one card per line.
+
+    Args:
+        cards (Dict[str, Tuple[Card, int]]): Dictionary of card IDs to tuples of cards and quantities.
+
+    Returns:
+        Iterator[str]: The lines of the export.
+    """
+    for card, quantity in cards.values():
+        yield json.dumps(_card_record(card, quantity), ensure_ascii=False) + "\n"
+
+
+def collection_ptcgl(cards: Dict[str, Tuple[Card, int]]) -> Iterator[str]:
+    """
+    Generate a PTCGL text export of a collection, grouped in Pokémon, Trainer and Energy sections.
+
+    Args:
+        cards (Dict[str, Tuple[Card, int]]): Dictionary of card IDs to tuples of cards and quantities.
+
+    Returns:
+        Iterator[str]: The lines of the export.
+    """
+    yield from _ptcgl_sections(cards.values)
+
+
+def decks_csv(decks: Iterable[Deck]) -> Iterator[str]:
+    """
+    Generate a CSV export of decks, one row per card and deck.
+
+    Args:
+        decks (Iterable[Deck]): The decks to export.
+
+    Returns:
+        Iterator[str]: The lines of the export.
+    """
+    yield _csv_line(["Deck"] + CSV_HEADER)
+    for deck in decks:
+        for card, quantity in deck.cards():
+            yield _csv_line([deck.name] + _card_values(card, quantity))
+
+
+def decks_jsonl(decks: Iterable[Deck]) -> Iterator[str]:
+    """
+    Generate a JSON Lines export of decks, one deck per line.
+
+    Args:
+        decks (Iterable[Deck]): The decks to export.
+
+    Returns:
+        Iterator[str]: The lines of the export.
+    """
+    for deck in decks:
+        record = {"name": deck.name, "cards": [_card_record(card, quantity) for card, quantity in deck.cards()]}
+        yield json.dumps(record, ensure_ascii=False) + "\n"
+
+
+def decks_ptcgl(decks: Iterable[Deck]) -> Iterator[str]:
+    """
+    Generate a PTCGL text export of decks. Each deck starts with a "Deck: <name>" line and is followed
+    by a blank line.
+
+    Args:
+        decks (Iterable[Deck]): The decks to export.
+
+    Returns:
+        Iterator[str]: The lines of the export.
+    """
+    for deck in decks:
+        yield f"Deck: {deck.name}\n"
+        yield from _ptcgl_sections(deck.cards)
+        yield "\n"
+
+
+# Format name -> (collection exporter, decks exporter, file extension, MIME type)
+EXPORT_FORMATS = {
+    "CSV": (collection_csv, decks_csv, "csv", "text/csv"),
+    "JSON Lines": (collection_jsonl, decks_jsonl, "jsonl", "application/jsonl"),
+    "PTCGL": (collection_ptcgl, decks_ptcgl, "txt", "text/plain"),
+}
+
+
+def write_export(lines: Iterable[str], file: IO[bytes], encoding: str = "utf-8") -> int:
+    """
+    Write an export to a binary file as it is generated.
+
+    Args:
+        lines (Iterable[str]): The lines of the export.
+        file (IO[bytes]): The file or stream to write to.
+        encoding (str): The text encoding.
+
+    Returns:
+        int: The number of bytes written.
+    """
+    written = 0
+    batch: List[str] = []
+    for line in lines:
+        batch.append(line)
+        # Write in batches of lines to keep the number of system calls down
+        if len(batch) >= 256:
+            written += file.write("".join(batch).encode(encoding))
+            batch.clear()
+    if batch:
+        written += file.write("".join(batch).encode(encoding))
+    return written
+
+
+def export_to_file(lines: Iterable[str]) -> BinaryIO:
+    """
+    Write an export to an anonymous temporary file as it is generated, and rewind it for reading.
+    The file disappears once the returned handle is closed, which is up to the caller, see `read_and_close`.
+
+    Args:
+        lines (Iterable[str]): The lines of the export.
+
+    Returns:
+        BinaryIO: The export, positioned at its start.
+    """
+    file = tempfile.TemporaryFile(prefix="export-")
+    try:
+        write_export(lines, file)
+    except BaseException:
+        file.close()
+        raise
+    file.seek(0)
+    return file
+
+
+def read_and_close(file: BinaryIO) -> bytes:
+    """
+    Read a temporary file such as the ones of `export_to_file` and `proxy_sheets_to_file`, then close it. Used by the
+    download buttons, which read the data they are given without closing it.
+
+    Args:
+        file (BinaryIO): The file, positioned at its start.
+
+    Returns:
+        bytes: The contents of the file.
+    """
+    with file:
+        return file.read()
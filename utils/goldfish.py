@@ -0,0 +1,385 @@
+import atexit
+import multiprocessing
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+from utils.deck import Deck, clean_card_name
+
+HAND_SIZE = 7
+PRIZES = 6
+BENCH_SIZE = 5
+CHUNK_GAMES = 2000  # Games simulated per task of the process pool
+MAX_MULLIGANS = 1000  # Backstop, a single basic Pokémon in 60 cards averages about 7 mulligans
+
+# Effects of trainer cards, read from their rules text
+DRAW, DRAW_UNTIL, DISCARD_DRAW, SHUFFLE_DRAW = 1, 2, 3, 4
+SEARCH_BASIC, SEARCH_POKEMON = 1, 2
+DRAW_EFFECTS = [
+    (re.compile(r"shuffle your hand into your deck\. then, draw (\d+) cards", re.IGNORECASE), SHUFFLE_DRAW),
+    (re.compile(r"shuffles their hand into their deck and draws (\d+) cards", re.IGNORECASE), SHUFFLE_DRAW),
+    (re.compile(r"discard your hand and draw (\d+) cards", re.IGNORECASE), DISCARD_DRAW),
+    (re.compile(r"draw cards until you have (\d+) cards in your hand", re.IGNORECASE), DRAW_UNTIL),
+    (re.compile(r"draw (\d+) cards", re.IGNORECASE), DRAW),
+]
+SEARCH_EFFECT = re.compile(r"search your deck for (?:up to (\d+) |an? )?(basic )?(?:\w+ )?pok[eé]mon", re.IGNORECASE)
+
+
+class EncodedDeck(NamedTuple):
+    names: List[str]  # The card names of the deck, cards are referred to by their index in it
+    cards: np.ndarray  # The name index of every card of the deck
+    stage: np.ndarray  # -1 for trainers and energy, 0 for basic Pokémon, 1 and 2 for evolutions
+    evolves_from: np.ndarray  # Name index of the Pokémon an evolution evolves from, -1 if it is not in the deck
+    energy: np.ndarray
+    supporter: np.ndarray
+    rare_candy: np.ndarray
+    draw: np.ndarray  # Draw effect of trainers, one of DRAW, DRAW_UNTIL, DISCARD_DRAW and SHUFFLE_DRAW
+    draw_count: np.ndarray
+    search: np.ndarray  # Search effect of trainers, SEARCH_BASIC or SEARCH_POKEMON
+    search_count: np.ndarray
+
+
+class GoldfishResult(NamedTuple):
+    games: int
+    turns: int
+    mulligans: float  # Average number of mulligans per game
+    names: List[str]
+    in_play: np.ndarray  # Names × turns, probability of having each Pokémon in play by each turn
+    stage_in_play: np.ndarray  # 3 × turns, probability of having a Pokémon of each stage in play by each turn
+    pokemon_in_play: np.ndarray  # Average number of Pokémon in play at the end of each turn
+    energy_attached: np.ndarray  # Average number of energy attached by the end of each turn
+    games_per_second: float
+
+
+def encode_deck(deck: Deck) -> EncodedDeck:
+    """
+    Encode a deck as integer arrays for the simulator. Cards sharing a name are played alike, and evolution
+    lines follow the `evolvesFrom` of the cards.
+
+    :param deck:    The deck.
+    :return:        The encoded deck.
+    :raises ValueError: If the deck has no basic Pokémon, no opening hand could be kept.
+    """
+    names: List[str] = []
+    index: Dict[str, int] = {}
+    prints = []
+    cards = []
+    for card, quantity in deck.cards():
+        name = clean_card_name(card.name)
+        if name not in index:
+            index[name] = len(names)
+            names.append(name)
+            prints.append(card)
+        cards.extend([index[name]] * quantity)
+
+    size = len(names)
+    encoded = {field: np.zeros(size, dtype=np.int16) for field in ("stage", "draw", "draw_count", "search",
+                                                                  "search_count")}
+    encoded["evolves_from"] = np.full(size, -1, dtype=np.int16)
+    flags = {field: np.zeros(size, dtype=bool) for field in ("energy", "supporter", "rare_candy")}
+    for position, card in enumerate(prints):
+        subtypes = card.subtypes or []
+        if card.supertype == "Pokémon":
+            if card.evolvesFrom:
+                encoded["stage"][position] = 2 if "Stage 2" in subtypes else 1
+                encoded["evolves_from"][position] = index.get(clean_card_name(card.evolvesFrom), -1)
+        else:
+            encoded["stage"][position] = -1
+        flags["energy"][position] = card.supertype == "Energy"
+        if card.supertype != "Trainer":
+            continue
+        flags["supporter"][position] = "Supporter" in subtypes
+        flags["rare_candy"][position] = names[position] == "Rare Candy"
+        text = " ".join(card.rules or [])
+        for pattern, effect in DRAW_EFFECTS:
+            match = pattern.search(text)
+            if match:
+                encoded["draw"][position], encoded["draw_count"][position] = effect, int(match.group(1))
+                break
+        match = SEARCH_EFFECT.search(text)
+        if match:
+            encoded["search"][position] = SEARCH_BASIC if match.group(2) else SEARCH_POKEMON
+            encoded["search_count"][position] = int(match.group(1) or 1)
+    if not (encoded["stage"] == 0).any():
+        raise ValueError(f"Deck '{deck.name}' has no basic Pokémon, it can never keep an opening hand.")
+    return EncodedDeck(names, np.array(cards, dtype=np.int16), **encoded, **flags)
+
+
+class Game:
+    __slots__ = ("deck", "hand", "in_play", "turn", "energy", "entered")
+
+    def __init__(self, deck: List[int], hand: List[int]) -> None:
+        """
+        State of a game: the cards are name indices, the deck is drawn from its end and `in_play` holds the
+        name index and entry turn of each Pokémon in play, the active Pokémon first.
+        """
+        self.deck = deck
+        self.hand = hand
+        self.in_play: List[List[int]] = []
+        self.turn = 0
+        self.energy = 0
+        self.entered: Dict[int, int] = {}  # First turn each name was in play
+
+    def draw(self, count: int) -> None:
+        for _ in range(min(count, len(self.deck))):
+            self.hand.append(self.deck.pop())
+
+    def put_in_play(self, name: int) -> None:
+        self.in_play.append([name, self.turn])
+        self.entered.setdefault(name, self.turn)
+
+
+class Policy:
+    """
+    Decisions of the simulated player, the rules are enforced by the simulator. Subclasses override the
+    decisions to try other play patterns.
+    """
+    label = "Bench everything"
+    bench_size = BENCH_SIZE
+
+    def search_target(self, game: Game, deck: "_Lists", basic_only: bool) -> Optional[int]:
+        """
+        :return:    The name index of the Pokémon to take from the deck with a search effect, or None.
+        """
+        wanted = None
+        if not basic_only:
+            # The next evolution of a Pokémon in play, else the missing stage 1 of a line
+            in_play = {name for name, _ in game.in_play}
+            for name in reversed(game.deck):
+                if deck.stage[name] > 0 and deck.evolves_from[name] in in_play:
+                    return name
+                if wanted is None and deck.stage[name] >= 0:
+                    wanted = name
+        for name in reversed(game.deck):
+            if deck.stage[name] == 0 and len(game.in_play) <= self.bench_size:
+                return name
+        return None if basic_only else wanted
+
+    def choose_supporter(self, game: Game, deck: "_Lists", supporters: List[int]) -> Optional[int]:
+        """
+        :return:    The name index of the supporter to play this turn, or None.
+        """
+        def value(name: int) -> int:
+            if deck.search[name]:
+                return 10
+            if deck.draw[name] == DRAW_UNTIL:
+                return deck.draw_count[name] - len(game.hand)
+            if deck.draw[name] in (DISCARD_DRAW, SHUFFLE_DRAW):
+                return deck.draw_count[name] - len(game.hand) + 1
+            return deck.draw_count[name]
+        best = max(supporters, key=value)
+        return best if value(best) > 0 else None
+
+
+class SmallBenchPolicy(Policy):
+    """
+    Keeps at most two Pokémon on the bench, as decks fearing bench damage do.
+    """
+    label = "Small bench"
+    bench_size = 2
+
+
+POLICIES: Dict[str, Policy] = {policy.label: policy for policy in (Policy(), SmallBenchPolicy())}
+
+
+class _Lists:
+    # Fields of an encoded deck as lists, much faster than arrays to index one element at a time
+    def __init__(self, deck: EncodedDeck) -> None:
+        for field in EncodedDeck._fields[1:]:
+            setattr(self, field, getattr(deck, field).tolist())
+
+
+def _play_game(cards: List[int], deck: _Lists, policy: Policy, turns: int, going_first: bool,
+               rng: random.Random, tally: Dict[str, np.ndarray]) -> int:
+    stage, evolves_from = deck.stage, deck.evolves_from
+    mulligans = 0
+    hand = cards[-HAND_SIZE:]
+    while not any(stage[name] == 0 for name in hand):
+        mulligans += 1
+        if mulligans > MAX_MULLIGANS:
+            raise ValueError(f"No opening hand with a basic Pokémon after {MAX_MULLIGANS} mulligans.")
+        rng.shuffle(cards)
+        hand = cards[-HAND_SIZE:]
+    game = Game(cards[:-HAND_SIZE - PRIZES], hand)  # Prizes are the cards under the hand
+
+    basics = sorted((name for name in hand if stage[name] == 0), key=lambda name: -hand.count(name))
+    for name in basics[:1 + policy.bench_size]:
+        hand.remove(name)
+        game.put_in_play(name)
+
+    for turn in range(1, turns + 1):
+        game.turn = turn
+        first_turn = turn == 1 and going_first
+        if not first_turn:
+            game.draw(1)
+
+        supporter_played = False
+        progress = True
+        while progress:
+            progress = False
+            # Bench basics
+            for name in [name for name in hand if stage[name] == 0]:
+                if len(game.in_play) <= policy.bench_size:
+                    hand.remove(name)
+                    game.put_in_play(name)
+            # Items, then one supporter per turn except on the first turn of the player going first
+            playable = [name for name in hand if (deck.draw[name] or deck.search[name]) and not deck.rare_candy[name]]
+            items = [name for name in playable if not deck.supporter[name]]
+            supporters = [name for name in playable if deck.supporter[name]]
+            chosen = items[:1]
+            if not chosen and supporters and not supporter_played and not first_turn:
+                supporter = policy.choose_supporter(game, deck, supporters)
+                if supporter is not None:
+                    chosen, supporter_played = [supporter], True
+            for name in chosen:
+                hand.remove(name)
+                progress = True
+                for _ in range(deck.search_count[name] if deck.search[name] else 0):
+                    target = policy.search_target(game, deck, deck.search[name] == SEARCH_BASIC)
+                    if target is None:
+                        break
+                    # The rest of the deck is already in random order, no need to shuffle it again
+                    del game.deck[len(game.deck) - 1 - game.deck[::-1].index(target)]
+                    hand.append(target)
+                effect, count = deck.draw[name], deck.draw_count[name]
+                if effect == DRAW:
+                    game.draw(count)
+                elif effect == DRAW_UNTIL:
+                    game.draw(count - len(hand))
+                elif effect == DISCARD_DRAW:
+                    hand.clear()
+                    game.draw(count)
+                elif effect == SHUFFLE_DRAW:
+                    game.deck.extend(hand)
+                    hand.clear()
+                    rng.shuffle(game.deck)
+                    game.draw(count)
+
+        # Evolve the Pokémon that were in play since an earlier turn, no evolution on the first turn
+        if turn > 1:
+            for pokemon in game.in_play:
+                if pokemon[1] == turn:
+                    continue
+                evolution = next((name for name in hand if evolves_from[name] == pokemon[0]), None)
+                if evolution is None and stage[pokemon[0]] == 0:
+                    candy = next((name for name in hand if deck.rare_candy[name]), None)
+                    if candy is not None:
+                        evolution = next((name for name in hand if stage[name] == 2 and evolves_from[name] >= 0
+                                          and evolves_from[evolves_from[name]] == pokemon[0]), None)
+                        if evolution is not None:
+                            hand.remove(candy)
+                if evolution is not None:
+                    hand.remove(evolution)
+                    pokemon[0], pokemon[1] = evolution, turn
+                    game.entered.setdefault(evolution, turn)
+
+        # Attach an energy
+        energy = next((name for name in hand if deck.energy[name]), None)
+        if energy is not None:
+            hand.remove(energy)
+            game.energy += 1
+
+        tally["pokemon"][turn - 1] += len(game.in_play)
+        tally["energy"][turn - 1] += game.energy
+
+    stages = np.full(3, turns + 1)
+    for name, turn in game.entered.items():
+        tally["entered"][name, turn] += 1
+        stages[stage[name]] = min(stages[stage[name]], turn)
+    for pokemon_stage, turn in enumerate(stages.tolist()):
+        if turn <= turns:
+            tally["stages"][pokemon_stage, turn] += 1
+    return mulligans
+
+
+def play_games(deck: EncodedDeck, games: int, turns: int, going_first: bool, policy: Policy,
+               seed: int) -> Dict[str, np.ndarray]:
+    """
+    Simulate games of a deck played alone, without an opponent. Runs in a worker process.
+
+    :param deck:        The encoded deck.
+    :param games:       The number of games.
+    :param turns:       The number of turns of each game.
+    :param going_first: Whether the player goes first, and so does not draw or play a supporter on turn 1.
+    :param policy:      The decisions of the player.
+    :param seed:        The seed of the shuffles.
+    :return:            Totals over the games, summed across workers into a `GoldfishResult`.
+    """
+    lists = _Lists(deck)
+    rng = random.Random(seed)
+    tally = {
+        "entered": np.zeros((len(deck.names), turns + 1), dtype=np.int64),  # Turn 0 is the setup
+        "stages": np.zeros((3, turns + 1), dtype=np.int64),
+        "pokemon": np.zeros(turns, dtype=np.int64),
+        "energy": np.zeros(turns, dtype=np.int64),
+        "mulligans": np.zeros(1, dtype=np.int64),
+    }
+    # The first shuffle of every game at once, the much rarer mulligans and shuffles during games use `rng`
+    shuffled = np.random.default_rng(seed).permuted(np.tile(deck.cards, (games, 1)), axis=1)
+    for cards in shuffled.tolist():
+        tally["mulligans"][0] += _play_game(cards, lists, policy, turns, going_first, rng, tally)
+    return tally
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # Spawned rather than forked, forking the threads of a running app server is unsafe. The pool is
+                # kept for the process, so that only the first simulation pays for starting the workers.
+                _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+                atexit.register(_pool.shutdown, cancel_futures=True)
+    return _pool
+
+
+def simulate(deck: Deck, games: int = 10000, turns: int = 4, going_first: bool = True,
+             policy: Policy = POLICIES["Bench everything"], workers: Optional[int] = None,
+             seed: Optional[int] = None) -> GoldfishResult:
+    """
+    Simulate games of a deck played alone, to measure how consistently it sets up, e.g. how often it has a
+    Stage 2 Pokémon in play by turn 3. Games are spread across a pool of processes in chunks.
+
+    :param deck:        The deck.
+    :param games:       The number of games.
+    :param turns:       The number of turns of each game.
+    :param going_first: Whether the player goes first, and so does not draw or play a supporter on turn 1.
+    :param policy:      The decisions of the player, e.g. one of `POLICIES`.
+    :param workers:     The number of worker processes, one per CPU by default. With a single worker the games
+                        are simulated in the calling process.
+    :param seed:        The seed of the shuffles, random by default.
+    :return:            The results.
+    :raises ValueError: If the deck has no basic Pokémon.
+    """
+    encoded = encode_deck(deck)
+    workers = workers or os.cpu_count() or 1
+    seed = random.randrange(2 ** 32) if seed is None else seed
+    chunks = [min(CHUNK_GAMES, games - start) for start in range(0, games, CHUNK_GAMES)]
+    started = time.perf_counter()
+    if workers == 1 or len(chunks) == 1:
+        tallies = [play_games(encoded, chunk, turns, going_first, policy, seed + index)
+                   for index, chunk in enumerate(chunks)]
+    else:
+        pool = _get_pool(workers)
+        tallies = list(pool.map(play_games, [encoded] * len(chunks), chunks, [turns] * len(chunks),
+                                [going_first] * len(chunks), [policy] * len(chunks),
+                                [seed + index for index in range(len(chunks))]))
+    elapsed = time.perf_counter() - started
+    totals = {key: sum(tally[key] for tally in tallies) for key in tallies[0]}
+    # Turns at which Pokémon first entered play, accumulated into "in play by turn t" (setup counts as turn 1)
+    in_play = np.cumsum(totals["entered"], axis=1)[:, 1:] / games
+    stage_in_play = np.cumsum(totals["stages"], axis=1)[:, 1:] / games
+    return GoldfishResult(
+        games, turns, float(totals["mulligans"][0] / games), encoded.names, in_play, stage_in_play,
+        totals["pokemon"] / games, totals["energy"] / games, games / elapsed if elapsed else float("inf"),
+    )
@@ -0,0 +1,279 @@
+import threading
+from functools import lru_cache
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from scipy.sparse import csr_matrix, vstack
+
+from utils.deck import Deck, clean_card_name
+
+COMPACT_THRESHOLD = 1024  # Removed decks kept as dead rows before the matrices are compacted
+
+_clean_card_name = lru_cache(maxsize=None)(clean_card_name)
+
+
+class CardUsage(NamedTuple):
+    name: str
+    supertype: str
+    decks: int
+    inclusion: float
+    average_copies: float
+
+
+class SetUsage(NamedTuple):
+    set_id: str
+    name: str
+    release_date: str
+    decks: int
+    inclusion: float
+    copies: int
+    share: float
+
+
+class _CountMatrix:
+    def __init__(self) -> None:
+        # Decks × columns matrix of card copies, with the deck (row) of each stored entry for weighted sums
+        self.matrix = csr_matrix((0, 0), dtype=np.int64)
+        self.rows = np.zeros(0, dtype=np.int64)
+
+    def append(self, rows: List[Dict[int, int]], columns: int) -> None:
+        indptr = np.concatenate([[0], np.cumsum([len(row) for row in rows])])
+        indices = np.fromiter((column for row in rows for column in row), dtype=np.int64, count=indptr[-1])
+        data = np.fromiter((count for row in rows for count in row.values()), dtype=np.int64, count=indptr[-1])
+        self.matrix.resize((self.matrix.shape[0], columns))
+        self.matrix = vstack([self.matrix, csr_matrix((data, indices, indptr), shape=(len(rows), columns))],
+                             format="csr")
+        self.rows = np.repeat(np.arange(self.matrix.shape[0]), np.diff(self.matrix.indptr))
+
+    def keep(self, positions: np.ndarray) -> None:
+        self.matrix = self.matrix[positions]
+        self.rows = np.repeat(np.arange(self.matrix.shape[0]), np.diff(self.matrix.indptr))
+
+    def totals(self, weights: np.ndarray, columns: int) -> Tuple[np.ndarray, np.ndarray]:
+        # Number of weighted decks playing each column, and their copies of it
+        entry_weights = weights[self.rows]
+        return (np.bincount(self.matrix.indices, weights=entry_weights, minlength=columns),
+                np.bincount(self.matrix.indices, weights=entry_weights * self.matrix.data, minlength=columns))
+
+
+class MetaAnalytics:
+    def __init__(self) -> None:
+        """
+        Card usage statistics over a corpus of decks: the decks are projected into sparse decks × card names and
+        decks × sets count matrices, and grouped aggregates are weighted column sums over them. Decks are grouped
+        by owner, the user or corpus the deck ID starts with. Updates are buffered and appended to the matrices
+        on the next query; removed decks stay as dead rows until there are enough of them to compact.
+        """
+        self.deck_ids: List[str] = []
+        self.positions: Dict[str, int] = {}
+        self.alive = np.zeros(0, dtype=bool)
+        self.owners: List[str] = []
+        self.owner_index: Dict[str, int] = {}
+        self.deck_owners = np.zeros(0, dtype=np.int64)
+        self.names: List[str] = []
+        self.name_index: Dict[str, int] = {}
+        self.supertypes: List[str] = []
+        self.sets: List[Tuple[str, str, str]] = []  # ID, name and release date of each set
+        self.set_index: Dict[str, int] = {}
+        self._names = _CountMatrix()
+        self._sets = _CountMatrix()
+        self._pending: List[Tuple[str, Dict[int, int], Dict[int, int]]] = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """
+        :return:    The number of decks in the corpus.
+        """
+        with self._lock:
+            self._merge()
+            return len(self.positions)
+
+    def _rows(self, deck: Deck) -> Tuple[Dict[int, int], Dict[int, int]]:
+        names: Dict[int, int] = {}
+        sets: Dict[int, int] = {}
+        for card, quantity in deck.cards():
+            name = _clean_card_name(card.name)
+            name_index = self.name_index.get(name)
+            if name_index is None:
+                name_index = self.name_index[name] = len(self.names)
+                self.names.append(name)
+                self.supertypes.append(card.supertype or "")
+            names[name_index] = names.get(name_index, 0) + quantity
+            set_index = self.set_index.get(card.set.id)
+            if set_index is None:
+                set_index = self.set_index[card.set.id] = len(self.sets)
+                self.sets.append((card.set.id, card.set.name, card.set.releaseDate or ""))
+            sets[set_index] = sets.get(set_index, 0) + quantity
+        return names, sets
+
+    def add_decks(self, decks: Iterable[Tuple[str, Deck]]) -> None:
+        """
+        Add decks to the corpus, replacing the previous version of decks that are already in it.
+
+        :param decks:   Tuples of deck IDs and decks.
+        """
+        with self._lock:
+            for deck_id, deck in decks:
+                self._pending.append((deck_id, *self._rows(deck)))
+
+    def remove_deck(self, deck_id: str) -> None:
+        """
+        Remove a deck from the corpus.
+
+        :param deck_id:     The ID of the deck.
+        """
+        with self._lock:
+            self._pending.append((deck_id, {}, {}))
+
+    def _drop(self, deck_id: str) -> None:
+        position = self.positions.pop(deck_id, None)
+        if position is not None:
+            self.alive[position] = False
+
+    def _merge(self) -> None:
+        if not self._pending:
+            return
+        # Only the last version of each deck is appended, removals are empty rows
+        latest = {deck_id: (names, sets) for deck_id, names, sets in self._pending}
+        self._pending.clear()
+        for deck_id in latest:
+            self._drop(deck_id)
+        added = [(deck_id, names, sets) for deck_id, (names, sets) in latest.items() if names]
+        for deck_id, _, _ in added:
+            owner = deck_id.split("/", 1)[0]
+            if owner not in self.owner_index:
+                self.owner_index[owner] = len(self.owners)
+                self.owners.append(owner)
+            self.positions[deck_id] = len(self.deck_ids)
+            self.deck_ids.append(deck_id)
+        self.alive = np.concatenate([self.alive, np.ones(len(added), dtype=bool)])
+        self.deck_owners = np.concatenate([self.deck_owners, np.array(
+            [self.owner_index[deck_id.split("/", 1)[0]] for deck_id, _, _ in added], dtype=np.int64)])
+        if added:
+            self._names.append([names for _, names, _ in added], len(self.names))
+            self._sets.append([sets for _, _, sets in added], len(self.sets))
+        if len(self.deck_ids) - len(self.positions) > max(COMPACT_THRESHOLD, len(self.positions)):
+            self._compact()
+
+    def _compact(self) -> None:
+        positions = np.flatnonzero(self.alive)
+        self.deck_ids = [self.deck_ids[position] for position in positions.tolist()]
+        self.positions = {deck_id: position for position, deck_id in enumerate(self.deck_ids)}
+        self.alive = np.ones(len(positions), dtype=bool)
+        self.deck_owners = self.deck_owners[positions]
+        self._names.keep(positions)
+        self._sets.keep(positions)
+
+    def _weights(self, owners: Optional[Iterable[str]]) -> np.ndarray:
+        if owners is None:
+            return self.alive.astype(np.float64)
+        selected = np.zeros(len(self.owners), dtype=bool)
+        selected[[self.owner_index[owner] for owner in owners if owner in self.owner_index]] = True
+        return (self.alive & selected[self.deck_owners]).astype(np.float64)
+
+    def owner_names(self) -> List[str]:
+        """
+        :return:    The users and corpora that own at least one deck of the corpus.
+        """
+        with self._lock:
+            self._merge()
+            counts = np.bincount(self.deck_owners[self.alive], minlength=len(self.owners))
+            return [owner for owner, count in zip(self.owners, counts.tolist()) if count]
+
+    def card_usage(self, owners: Optional[Iterable[str]] = None, supertype: Optional[str] = None,
+                   limit: Optional[int] = None) -> List[CardUsage]:
+        """
+        Get how often each card is played, reprints of a card counting as the same card.
+
+        :param owners:      The users and corpora whose decks to count, all of them if None.
+        :param supertype:   Only count the cards of this supertype, e.g. "Trainer".
+        :param limit:       The maximum number of cards to return.
+        :return:            The usage of each card played by at least one deck, most included first.
+        """
+        with self._lock:
+            self._merge()
+            weights = self._weights(owners)
+            decks, copies = self._names.totals(weights, len(self.names))
+            names, supertypes = self.names, np.array(self.supertypes, dtype=object)
+        deck_count = weights.sum()
+        if not deck_count:
+            return []
+        played = decks > 0
+        if supertype is not None:
+            played &= supertypes == supertype
+        order = np.flatnonzero(played)
+        order = order[np.lexsort((-copies[order], -decks[order]))][:limit]
+        return [
+            CardUsage(names[index], supertypes[index], int(decks[index]), float(decks[index] / deck_count),
+                      float(copies[index] / decks[index]))
+            for index in order.tolist()
+        ]
+
+    def set_usage(self, owners: Optional[Iterable[str]] = None) -> List[SetUsage]:
+        """
+        Get how much each set is played, in order of release, to follow how new sets change the meta.
+
+        :param owners:  The users and corpora whose decks to count, all of them if None.
+        :return:        The usage of each set played by at least one deck, oldest first.
+        """
+        with self._lock:
+            self._merge()
+            weights = self._weights(owners)
+            decks, copies = self._sets.totals(weights, len(self.sets))
+            sets = list(self.sets)
+        deck_count, copy_count = weights.sum(), copies.sum()
+        if not deck_count:
+            return []
+        played = np.flatnonzero(decks > 0).tolist()
+        return [
+            SetUsage(sets[index][0], sets[index][1], sets[index][2], int(decks[index]),
+                     float(decks[index] / deck_count), int(copies[index]), float(copies[index] / copy_count))
+            for index in sorted(played, key=lambda index: (sets[index][2], sets[index][0]))
+        ]
+
+
+_meta: Optional[MetaAnalytics] = None
+_meta_lock = threading.Lock()
+
+
+def get_meta_analytics() -> MetaAnalytics:
+    """
+    Get the process-wide analytics over every user's decks and the decklist corpora, building them on first use.
+
+    :return:    The analytics.
+    """
+    global _meta
+    if _meta is None:
+        with _meta_lock:
+            if _meta is None:
+                from utils.storage import iter_all_decks
+                meta = MetaAnalytics()
+                meta.add_decks(iter_all_decks())
+                _meta = meta
+    return _meta
+
+
+def index_deck(deck_id: str, deck: Optional[Deck]) -> None:
+    """
+    Update a deck in the process-wide analytics, if they were built. Does nothing otherwise, the deck will be
+    read from storage when the analytics are built.
+
+    :param deck_id:     The ID of the deck, of the form "<user>/<deck name>".
+    :param deck:        The deck, or None to remove it.
+    """
+    if _meta is None:
+        return
+    if deck is None:
+        _meta.remove_deck(deck_id)
+    else:
+        _meta.add_decks([(deck_id, deck)])
+
+
+def index_decks(decks: Iterable[Tuple[str, Deck]]) -> None:
+    """
+    Add many decks to the process-wide analytics at once, if they were built.
+
+    :param decks:   Tuples of deck IDs and decks.
+    """
+    if _meta is not None:
+        _meta.add_decks(decks)
@@ -0,0 +1,149 @@
+import itertools
+from collections import OrderedDict
+from collections.abc import ItemsView, ValuesView
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Mapping, Optional, Tuple
+
+from pokemontcgsdk import Card
+
+BITS = 6  # Each level of the trie is indexed by 6 bits of the card ID's hash
+BRANCHES = 1 << BITS
+MASK = BRANCHES - 1
+VIEW_CACHE_SIZE = 8  # Views kept per version, e.g. the filter combinations of the Owned Cards tab
+
+Entry = Tuple[Card, int]
+
+_EMPTY_LEAF: Dict[str, Tuple[int, Entry]] = {}  # Shared by every empty slot, never written to
+_EMPTY_BRANCH = (_EMPTY_LEAF,) * BRANCHES
+_versions = itertools.count(1)
+
+
+def _slots(card_id: str) -> Tuple[int, int]:
+    # The hash of a string is cached on it, it differs between processes so pickling rebuilds the trie
+    digest = hash(card_id)
+    return digest & MASK, (digest >> BITS) & MASK
+
+
+class _Items(ItemsView):
+    def __iter__(self) -> Iterator[Tuple[str, Entry]]:
+        return iter(self._mapping._entries())
+
+
+class _Values(ValuesView):
+    def __iter__(self) -> Iterator[Entry]:
+        return (entry for _, entry in self._mapping._entries())
+
+
+class OwnedCards(Mapping[str, Entry]):
+    def __init__(self, cards: Optional[Mapping[str, Entry]] = None) -> None:
+        """
+        Persistent map of card IDs to tuples of cards and owned quantities. It is never modified in place:
+        `set_owned` returns a new version that shares every untouched part with the previous one, so sessions hold
+        it without copying it and views derived from a version stay valid as long as it is the current one.
+
+        The map is a two-level trie of 64 × 64 small dictionaries indexed by the hash of the card IDs, an update
+        copies one of them and the two tuples leading to it. Iteration follows insertion order, like a dictionary.
+
+        :param cards:   Dictionary of card IDs to tuples of cards and owned quantities.
+        """
+        branches: Dict[int, List[Dict[str, Tuple[int, Entry]]]] = {}
+        for sequence, (card_id, entry) in enumerate((cards or {}).items()):
+            first, second = _slots(card_id)
+            leaves = branches.setdefault(first, [_EMPTY_LEAF] * BRANCHES)
+            if leaves[second] is _EMPTY_LEAF:
+                leaves[second] = {}
+            leaves[second][card_id] = (sequence, entry)
+        root = tuple(tuple(branches[first]) if first in branches else _EMPTY_BRANCH for first in range(BRANCHES))
+        self._init(root, len(cards or {}), len(cards or {}))
+
+    def _init(self, root: tuple, size: int, next_sequence: int) -> None:
+        self._root = root
+        self._size = size
+        self._next_sequence = next_sequence  # Insertion counter, orders the iteration
+        self._order: Optional[List[Tuple[str, Entry]]] = None
+        self._views: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self.version = next(_versions)  # Unique per map, equal versions have equal contents
+
+    def __getitem__(self, card_id: str) -> Entry:
+        digest = hash(card_id)  # `_slots` inlined, lookups are the hot path
+        return self._root[digest & MASK][(digest >> BITS) & MASK][card_id][1]
+
+    def __contains__(self, card_id: object) -> bool:
+        digest = hash(card_id)
+        return card_id in self._root[digest & MASK][(digest >> BITS) & MASK]
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __iter__(self) -> Iterator[str]:
+        return (card_id for card_id, _ in self._entries())
+
+    def __repr__(self) -> str:
+        return f"OwnedCards(version={self.version}, cards={self._size})"
+
+    def __reduce__(self) -> tuple:
+        return OwnedCards, (dict(self.items()),)
+
+    def _entries(self) -> List[Tuple[str, Entry]]:
+        # Sorted by insertion once per version
+        if self._order is None:
+            entries = [(sequence, card_id, entry) for branch in self._root if branch is not _EMPTY_BRANCH
+                       for leaf in branch for card_id, (sequence, entry) in leaf.items()]
+            entries.sort(key=lambda item: item[0])
+            self._order = [(card_id, entry) for _, card_id, entry in entries]
+        return self._order
+
+    def items(self) -> ItemsView:
+        return _Items(self)
+
+    def values(self) -> ValuesView:
+        return _Values(self)
+
+    def set_owned(self, card: Card, quantity: int) -> "OwnedCards":
+        """
+        :param card:        A card.
+        :param quantity:    Its new owned quantity, the card is removed if it is zero or less.
+        :return:            The new version of the collection, or this one if nothing changed.
+        """
+        first, second = _slots(card.id)
+        leaf = self._root[first][second]
+        current = leaf.get(card.id)
+        if quantity <= 0 and current is None:
+            return self
+        if current is not None and current[1] == (card, quantity):
+            return self
+
+        new_leaf = dict(leaf)
+        size, next_sequence = self._size, self._next_sequence
+        if quantity <= 0:
+            del new_leaf[card.id]
+            size -= 1
+        elif current is not None:
+            new_leaf[card.id] = (current[0], (card, quantity))  # Keeps its place, like a dictionary
+        else:
+            new_leaf[card.id] = (next_sequence, (card, quantity))
+            size += 1
+            next_sequence += 1
+        branch = self._root[first]
+        new_branch = branch[:second] + (new_leaf if new_leaf else _EMPTY_LEAF,) + branch[second + 1:]
+        new_root = self._root[:first] + (new_branch,) + self._root[first + 1:]
+
+        owned = OwnedCards.__new__(OwnedCards)
+        owned._init(new_root, size, next_sequence)
+        return owned
+
+    def view(self, key: Hashable, build: Callable[[], Any]) -> Any:
+        """
+        Get a view derived from this version of the collection, e.g. its filtered and sorted cards, building it
+        on first use. The views are dropped with the version, so they never need to be invalidated.
+
+        :param key:     The key of the view, e.g. the filters.
+        :param build:   Function building the view from the collection.
+        :return:        The view. It is shared, it must not be modified.
+        """
+        if key in self._views:
+            self._views.move_to_end(key)
+            return self._views[key]
+        value = self._views[key] = build()
+        if len(self._views) > VIEW_CACHE_SIZE:
+            self._views.popitem(last=False)
+        return value
@@ -1,14 +1,25 @@
 import os
 import re
+import sys
+from functools import cache
 from typing import List, Optional, Tuple
 
-import streamlit as st
-from dotenv import load_dotenv
-from pokemontcgsdk import RestClient, Card, Set
+from pokemontcgsdk import RestClient, Card, Set, PokemonTcgException
 
-# Initialize the Pokémon TCG API client
-load_dotenv()
-RestClient.configure(os.getenv("POKEMON_API_KEY"))
+from utils import api_client
+from utils.catalog import get_catalog, save_snapshot
+
+
+@cache
+def configure_client() -> None:
+    """
+    Initialize the Pokémon TCG API client and route its requests through the shared, rate-limited
+    `utils.api_client`. Deferred to the first API call so that importing this module stays cheap on cold starts.
+    """
+    from dotenv import load_dotenv
+    load_dotenv()
+    RestClient.configure(os.getenv("POKEMON_API_KEY"))
+    api_client.install()
 
 
 # Function to process the card name to sanitize it and handle multi-word names
@@ -25,35 +36,107 @@ def process_card_name(card_name: str) -> str:
     return "*" + ".*".join(words) + "*"
 
 
-# cache the API response
-@st.cache_data
-def get_sets() -> list[Set]:
+def fetch_sets() -> list[Set]:
     """
-    Get all the sets from the Pokémon TCG API.
+    Fetch all the sets from the Pokémon TCG API, bypassing the catalog.
     :return:  A list of all the sets.
     """
+    configure_client()
     return Set.all()
 
 
-@st.cache_data
+def get_sets() -> list[Set]:
+    """
+    Get all the sets, from the local catalog snapshot when available and from the Pokémon TCG API otherwise.
+    A stale snapshot is served as is and refreshed by a background job, see `utils.scheduler`.
+    :return:  A list of all the sets.
+    """
+    catalog = get_catalog()
+    if not catalog.sets:
+        catalog.set_sets(fetch_sets())
+        save_snapshot(catalog)
+    return catalog.sets
+
+
 def try_find_card_with_params(**kwargs) -> (List[Card], bool):
     """
-    Try to find a card with the given parameters.
+    Try to find a card with the given parameters. Uncached, the app caches its searches in `components.card_shop`.
     :param kwargs:  The parameters to search for, common parameters include:
                     - name: The name of the card.
                     - set.id: The ID of the set.
     :return:       A tuple containing the list of cards found and a boolean indicating if the search was successful.
     """
+    configure_client()
     try:
         cards = Card.where(**kwargs)
         if cards:
+            get_catalog().add_cards(cards)
             return cards, True
         else:
             return None, False
-    except Exception:
+    except PokemonTcgException as e:
+        print(f"Search {kwargs} failed: {e}", file=sys.stderr)
         return None, False
 
 
+def find_cards_by_ids(card_ids: List[str]) -> dict[str, Card]:
+    """
+    Fetch many cards from the Pokémon TCG API in a single query.
+
+    :param card_ids:    The IDs of the cards to fetch, up to `pageSize` (250) at a time.
+    :return:            A dictionary of card IDs to the cards that were found.
+    """
+    if not card_ids:
+        return {}
+    configure_client()
+    query = " or ".join(f"id:{card_id}" for card_id in card_ids)
+    try:
+        cards = Card.where(q=f"({query})", pageSize=250, page=1)
+    except PokemonTcgException as e:
+        print(f"Failed to fetch {len(card_ids)} cards: {e}", file=sys.stderr)
+        return {}
+    get_catalog().add_cards(cards)
+    return {card.id: card for card in cards}
+
+
+# PTCGO/PTCGL section headers such as "Pokémon: 12", "Trainer - 36" or "Total Cards: 60"
+SECTION_HEADER = re.compile(r"^\W*(pok[eé]mon|trainers?|energy|total cards)\s*[:\-]?\s*\(?\d*\)?\s*$", re.IGNORECASE)
+
+
+def is_section_header(line: str) -> bool:
+    """
+    Checks whether a decklist line is a section header rather than a card line.
+
+    Args:
+        line (str): The line to check.
+
+    Returns:
+        bool: Whether the line is a section header.
+    """
+    return SECTION_HEADER.match(line) is not None
+
+
+def parse_card_line(card_string: str) -> Optional[Tuple[int, str, str]]:
+    """
+    Parses a decklist line such as "3 Regidrago V SIT 135". PTCGL's "* " bullet prefix is accepted.
+
+    Args:
+        card_string (str): The line to parse.
+
+    Returns:
+        Optional[Tuple[int, str, str]]: The quantity, upper-cased set code and card number,
+        or None if the line is not a card line.
+    """
+    split_words = card_string.strip().lstrip("*").split()
+    if len(split_words) < 3:
+        return None
+    try:
+        quantity = int(split_words[0])
+    except ValueError:
+        return None
+    return quantity, split_words[-2].strip().upper(), split_words[-1].strip()
+
+
 def import_card_from_string(card_string: str, sets: List[Set]) -> Tuple[Optional[Card], int]:
     """
     Imports a card from a string input, such as "3 Regidrago V SIT 135".
@@ -65,13 +148,10 @@ def import_card_from_string(card_string: str, sets: List[Set]) -> Tuple[Optional
     Returns:
         Tuple[Optional[Card], int]: A tuple containing the card object and the quantity.
     """
-    split_words = card_string.strip().split()
-    if len(split_words) < 3:
+    parsed = parse_card_line(card_string)
+    if parsed is None:
         return None, 0
-
-    quantity = int(split_words[0])
-    set_code = split_words[-2].strip().upper()
-    card_number = split_words[-1].strip()
+    quantity, set_code, card_number = parsed
 
     # Normalize set_code and ptcgoCode for case-insensitive comparison
     matching_sets = [
@@ -79,15 +159,27 @@ def import_card_from_string(card_string: str, sets: List[Set]) -> Tuple[Optional
     ]
     if not matching_sets:
         return None, 0
+
+    catalog = get_catalog()
+    for s in matching_sets:
+        card = catalog.get(f"{s.id}-{card_number}")
+        if card:
+            return card, quantity
+
+    configure_client()
     for s in matching_sets:
         set_id = s.id
         card_id = f"{set_id}-{card_number}"
         try:
             card = Card.find(card_id)
             if card:
+                catalog.add_cards([card])
                 return card, quantity
-        except Exception:  # Handle exceptions such as card not found
+        except api_client.ApiError as e:  # The API is unreachable, the other sets would fail too
+            print(f"Failed to fetch {card_id}: {e}", file=sys.stderr)
+            return None, 0
+        except PokemonTcgException:  # Card not found
             continue
 
-    print(f"No card found for set code '{set_code}' and card number '{card_number}'")
+    print(f"No card found for set code '{set_code}' and card number '{card_number}'", file=sys.stderr)
     return None, 0
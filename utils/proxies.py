@@ -0,0 +1,255 @@
+import io
+import multiprocessing
+import os
+import sys
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import TYPE_CHECKING, BinaryIO, Dict, List, Optional, Tuple
+
+import requests
+from PIL import Image, ImageDraw
+
+if TYPE_CHECKING:
+    from pokemontcgsdk import Card
+
+    from utils.deck import Deck
+
+IMAGE_CACHE_PATH = os.path.join("data", ".images")
+THUMBNAIL_CACHE_PATH = os.path.join(IMAGE_CACHE_PATH, "small")  # Out of the large images hashed for recognition
+IMAGE_WORKERS = 8  # Concurrent image downloads
+DPI = 300
+PAGE_SIZE_MM = (210.0, 297.0)  # A4
+CARD_SIZE_MM = (63.0, 88.0)  # Standard card size
+GRID = (3, 3)  # Cards per row and per column
+JPEG_QUALITY = 90
+CROP_MARK_MM = 4.0
+
+
+def _pixels(millimeters: float) -> int:
+    return round(millimeters / 25.4 * DPI)
+
+
+def missing_cards(deck: "Deck", owned: Dict[str, Tuple["Card", int]]) -> List["Card"]:
+    """
+    List the copies of the cards of a deck that are not in the collection.
+
+    Args:
+        deck (Deck): The deck.
+        owned (Dict[str, Tuple[Card, int]]): Dictionary of card IDs to tuples of cards and owned quantities.
+
+    Returns:
+        List[Card]: One entry per missing copy, in the order of the deck.
+    """
+    return [
+        card
+        for card, quantity in deck.cards()
+        for _ in range(quantity - (owned[card.id][1] if card.id in owned else 0))
+    ]
+
+
+def cached_image_path(card: "Card", size: str = "large") -> Optional[str]:
+    """
+    Get the path of an image of a card, downloading it into the image cache if it is not there yet.
+
+    Args:
+        card (Card): The card.
+        size (str): "large" for the print-size image, "small" for its thumbnail.
+
+    Returns:
+        Optional[str]: The path of the image file, or None if the card has no image or it could not be fetched.
+    """
+    url = getattr(card.images, size) if card.images else None
+    if not url:
+        return None
+    directory = IMAGE_CACHE_PATH if size == "large" else THUMBNAIL_CACHE_PATH
+    path = os.path.join(directory, f"{card.id}{os.path.splitext(url)[1] or '.png'}")
+    if os.path.exists(path):
+        return path
+    try:
+        response = requests.get(url, timeout=30)
+        response.raise_for_status()
+    except requests.RequestException as e:
+        print(f"Failed to fetch the image of {card.id}: {e}", file=sys.stderr)
+        return None
+    os.makedirs(directory, exist_ok=True)
+    # Written under a unique name and moved in place, concurrent downloads of the same image are harmless
+    with tempfile.NamedTemporaryFile(dir=directory, suffix=".tmp", delete=False) as f:
+        f.write(response.content)
+    os.replace(f.name, path)
+    return path
+
+
+def compose_page(slots: List[Tuple[Optional[str], str]]) -> bytes:
+    """
+    Lay out card images on a page at print size, with crop marks in the margins. Runs in a worker process, so
+    that pages are composed in parallel; only the compressed page is sent back.
+
+    Args:
+        slots (List[Tuple[Optional[str], str]]): The image path and name of each card of the page, in reading order.
+            Cards without an image are printed as a frame with their name.
+
+    Returns:
+        bytes: The page, as a JPEG image.
+    """
+    page_width, page_height = _pixels(PAGE_SIZE_MM[0]), _pixels(PAGE_SIZE_MM[1])
+    card_width, card_height = _pixels(CARD_SIZE_MM[0]), _pixels(CARD_SIZE_MM[1])
+    left = (page_width - GRID[0] * card_width) // 2
+    top = (page_height - GRID[1] * card_height) // 2
+    page = Image.new("RGB", (page_width, page_height), "white")
+    draw = ImageDraw.Draw(page)
+
+    for position, (path, name) in enumerate(slots):
+        x = left + (position % GRID[0]) * card_width
+        y = top + (position // GRID[0]) * card_height
+        image = None
+        if path is not None:
+            try:
+                with Image.open(path) as source:
+                    source.draft("RGB", (card_width, card_height))  # Decode JPEGs at a reduced size when possible
+                    image = source.convert("RGB").resize((card_width, card_height), Image.LANCZOS)
+            except OSError:
+                image = None
+        if image is not None:
+            page.paste(image, (x, y))
+            image.close()
+        else:
+            draw.rectangle((x, y, x + card_width - 1, y + card_height - 1), outline="black", width=3)
+            draw.text((x + card_width // 10, y + card_height // 10), name, fill="black", font_size=_pixels(4))
+
+    mark = _pixels(CROP_MARK_MM)
+    for column in range(GRID[0] + 1):
+        x = left + column * card_width
+        draw.line((x, top - mark - 10, x, top - 10), fill="black", width=2)
+        draw.line((x, top + GRID[1] * card_height + 10, x, top + GRID[1] * card_height + mark + 10), fill="black",
+                  width=2)
+    for row in range(GRID[1] + 1):
+        y = top + row * card_height
+        draw.line((left - mark - 10, y, left - 10, y), fill="black", width=2)
+        draw.line((left + GRID[0] * card_width + 10, y, left + GRID[0] * card_width + mark + 10, y), fill="black",
+                  width=2)
+
+    output = io.BytesIO()
+    page.save(output, "JPEG", quality=JPEG_QUALITY, dpi=(DPI, DPI))
+    return output.getvalue()
+
+
+class PdfWriter:
+    def __init__(self, out: BinaryIO, page_size_mm: Tuple[float, float] = PAGE_SIZE_MM) -> None:
+        """
+        Minimal PDF writer streaming one full-page JPEG image per page, so that pages never need to be held in
+        memory together. `out` only needs to be writable, offsets are counted rather than read back.
+
+        :param out:             The binary stream to write the PDF to.
+        :param page_size_mm:    The width and height of the pages, in millimeters.
+        """
+        self.out = out
+        self.width = page_size_mm[0] / 25.4 * 72
+        self.height = page_size_mm[1] / 25.4 * 72
+        self.position = 0
+        self.offsets: List[int] = [0, 0]  # The catalog and page tree are written last, with the list of pages
+        self.pages: List[int] = []
+        self._write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _write(self, data: bytes) -> None:
+        self.out.write(data)
+        self.position += len(data)
+
+    def _object(self, body: bytes, stream: Optional[bytes] = None, number: Optional[int] = None) -> int:
+        if number is None:
+            self.offsets.append(0)
+            number = len(self.offsets)
+        self.offsets[number - 1] = self.position
+        self._write(b"%d 0 obj\n" % number + body)
+        if stream is not None:
+            self._write(b"\nstream\n")
+            self._write(stream)
+            self._write(b"\nendstream")
+        self._write(b"\nendobj\n")
+        return number
+
+    def add_page(self, jpeg: bytes) -> None:
+        """
+        Add a page showing a JPEG image over its whole area.
+
+        :param jpeg:    The JPEG image.
+        """
+        with Image.open(io.BytesIO(jpeg)) as page:  # Only reads the header
+            width, height = page.size
+        image = self._object(
+            b"<< /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace /DeviceRGB /BitsPerComponent 8 "
+            b"/Filter /DCTDecode /Length %d >>" % (width, height, len(jpeg)), jpeg)
+        content = b"q %.2f 0 0 %.2f 0 0 cm /Im0 Do Q" % (self.width, self.height)
+        contents = self._object(b"<< /Length %d >>" % len(content), content)
+        self.pages.append(self._object(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %.2f %.2f] /Resources << /XObject << /Im0 %d 0 R >> >> "
+            b"/Contents %d 0 R >>" % (self.width, self.height, image, contents)))
+
+    def close(self) -> None:
+        """
+        Write the page tree, the cross-reference table and the trailer.
+        """
+        kids = b" ".join(b"%d 0 R" % page for page in self.pages)
+        self._object(b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(self.pages)), number=2)
+        self._object(b"<< /Type /Catalog /Pages 2 0 R >>", number=1)
+        xref = self.position
+        self._write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(self.offsets) + 1))
+        self._write(b"".join(b"%010d 00000 n \n" % offset for offset in self.offsets))
+        self._write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(self.offsets) + 1, xref))
+        self.out.flush()
+
+
+def write_proxy_sheets(cards: List["Card"], out: BinaryIO, workers: Optional[int] = None) -> int:
+    """
+    Write printable proxy sheets of cards as a PDF, 9 cards per page. Images are downloaded into the image cache
+    by a pool of threads while pages are composed by a pool of processes, and each page is written as soon as it
+    and the pages before it are ready, so that only a few compressed pages are held in memory at a time.
+
+    Args:
+        cards (List[Card]): The cards to print, one entry per copy.
+        out (BinaryIO): The binary stream to write the PDF to.
+        workers (Optional[int]): The number of worker processes composing pages, one per CPU by default.
+
+    Returns:
+        int: The number of pages written.
+    """
+    per_page = GRID[0] * GRID[1]
+    pages = [cards[start:start + per_page] for start in range(0, len(cards), per_page)]
+    workers = max(1, min(workers or os.cpu_count() or 1, len(pages)))
+    writer = PdfWriter(out)
+    # Spawned rather than forked, forking the threads of a running app server is unsafe
+    with ThreadPoolExecutor(max_workers=IMAGE_WORKERS) as fetcher, \
+            ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as composer:
+        unique_cards = {card.id: card for card in cards}
+        images = {card_id: fetcher.submit(cached_image_path, card) for card_id, card in unique_cards.items()}
+        composing = deque()
+        for page in pages:
+            composing.append(composer.submit(compose_page, [(images[card.id].result(), card.name) for card in page]))
+            if len(composing) > workers:
+                writer.add_page(composing.popleft().result())
+        while composing:
+            writer.add_page(composing.popleft().result())
+    writer.close()
+    return len(pages)
+
+
+def proxy_sheets_to_file(cards: List["Card"]) -> BinaryIO:
+    """
+    Write proxy sheets of cards to an anonymous temporary file, and rewind it for reading.
+    The file disappears once the returned handle is closed, which is up to the caller, see
+    `utils.export.read_and_close`.
+
+    Args:
+        cards (List[Card]): The cards to print, one entry per copy.
+
+    Returns:
+        BinaryIO: The PDF, positioned at its start.
+    """
+    file = tempfile.TemporaryFile(prefix="proxies-", suffix=".pdf")
+    try:
+        write_proxy_sheets(cards, file)
+    except BaseException:
+        file.close()
+        raise
+    file.seek(0)
+    return file
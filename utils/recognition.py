@@ -0,0 +1,385 @@
+import heapq
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING, BinaryIO, Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+
+import numpy as np
+from PIL import Image, ImageOps
+from scipy.fft import dctn
+
+from utils.catalog import get_catalog
+from utils.proxies import CARD_SIZE_MM, IMAGE_CACHE_PATH
+
+if TYPE_CHECKING:
+    from pokemontcgsdk import Card
+
+HASH_FILE = os.path.join(IMAGE_CACHE_PATH, "hashes.npz")
+HASH_SIZE = 8  # The hash keeps the 8 × 8 lowest frequencies, 64 bits
+DCT_SIZE = 32
+ART_BOX = (0.08, 0.10, 0.92, 0.48)  # Left, top, right and bottom of the artwork, as fractions of the card
+MATCH_DISTANCE = 22  # Candidates further than this many bits from the photo are not reported
+BACKGROUND_THRESHOLD = 40  # Grey level difference from the border that counts as the card rather than background
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+
+
+class Match(NamedTuple):
+    card_id: str
+    distance: int
+
+
+def _hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def perceptual_hash(image: Image.Image) -> int:
+    """
+    Hash an image so that resized, recompressed or slightly different shots of it get hashes a few bits apart:
+    the signs of the lowest frequencies of its discrete cosine transform, relative to their median.
+
+    :param image:   The image.
+    :return:        The 64-bit hash.
+    """
+    pixels = np.asarray(image.convert("L").resize((DCT_SIZE, DCT_SIZE), Image.LANCZOS), dtype=np.float64)
+    frequencies = dctn(pixels, norm="ortho")[:HASH_SIZE, :HASH_SIZE].ravel()
+    bits = frequencies > np.median(frequencies[1:])  # The DC term only measures brightness
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def crop_card(image: Image.Image) -> Image.Image:
+    """
+    Crop a photo or scan to the card it shows: the background, told apart by its difference from the average
+    border colour, is trimmed and the rest is cut to the proportions of a card.
+
+    :param image:   The photo, showing a single upright card.
+    :return:        The card.
+    """
+    image = ImageOps.exif_transpose(image).convert("RGB")
+    gray = np.asarray(image.convert("L"), dtype=np.int16)
+    border = np.concatenate([gray[0], gray[-1], gray[:, 0], gray[:, -1]])
+    foreground = np.abs(gray - np.median(border)) > BACKGROUND_THRESHOLD
+    rows, columns = np.flatnonzero(foreground.any(axis=1)), np.flatnonzero(foreground.any(axis=0))
+    if len(rows) > gray.shape[0] // 4 and len(columns) > gray.shape[1] // 4:
+        image = image.crop((columns[0], rows[0], columns[-1] + 1, rows[-1] + 1))
+    width, height = image.size
+    aspect = CARD_SIZE_MM[0] / CARD_SIZE_MM[1]
+    if width > height * aspect:
+        margin = (width - round(height * aspect)) // 2
+        image = image.crop((margin, 0, width - margin, height))
+    else:
+        margin = (height - round(width / aspect)) // 2
+        image = image.crop((0, margin, width, height - margin))
+    return image
+
+
+def art_hash(card: Image.Image) -> int:
+    """
+    Hash the artwork of a card image, which tells cards apart much better than the frame and text they share.
+
+    :param card:    The card, cropped to its edges.
+    :return:        The 64-bit hash.
+    """
+    width, height = card.size
+    left, top, right, bottom = ART_BOX
+    return perceptual_hash(card.crop((round(left * width), round(top * height),
+                                      round(right * width), round(bottom * height))))
+
+
+def _open(source: Union[str, BinaryIO, Image.Image]) -> Image.Image:
+    if isinstance(source, Image.Image):
+        return source
+    image = Image.open(source)
+    image.draft("RGB", (1024, 1024))  # Photos are decoded at a reduced size, hashes only need 32 × 32 pixels
+    return image
+
+
+def hash_image_file(path: str) -> Optional[int]:
+    """
+    Hash the artwork of a catalog card image. Runs in a worker process when many images are hashed.
+
+    :param path:    The path of the image, as downloaded from the API.
+    :return:        The 64-bit hash, or None if the image could not be read.
+    """
+    try:
+        with Image.open(path) as image:
+            return art_hash(image.convert("RGB"))
+    except OSError:
+        return None
+
+
+def load_hashes() -> Dict[str, int]:
+    """
+    Load the hashes of the cached card images computed so far.
+
+    :return:    Dictionary of card IDs to the hashes of their artwork.
+    """
+    try:
+        with np.load(HASH_FILE) as data:
+            return dict(zip(data["ids"].tolist(), data["hashes"].tolist()))
+    except (OSError, KeyError, ValueError):
+        return {}
+
+
+def save_hashes(hashes: Dict[str, int]) -> None:
+    """
+    Save the hashes of the cached card images, atomically.
+
+    :param hashes:  Dictionary of card IDs to the hashes of their artwork.
+    """
+    os.makedirs(IMAGE_CACHE_PATH, exist_ok=True)
+    # Written under a unique name, refreshes of the app, of `cli.py index-images` and of other processes may overlap
+    descriptor, temporary = tempfile.mkstemp(dir=IMAGE_CACHE_PATH, suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "wb") as f:
+            np.savez(f, ids=np.array(list(hashes), dtype=str),
+                     hashes=np.array(list(hashes.values()), dtype=np.uint64))
+        os.replace(temporary, HASH_FILE)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def hash_cached_images(hashes: Dict[str, int], workers: Optional[int] = None) -> Dict[str, int]:
+    """
+    Hash the images of the image cache that are not hashed yet, in a pool of processes.
+
+    :param hashes:  Dictionary of card IDs to the hashes computed so far.
+    :param workers: The number of worker processes, one per CPU by default.
+    :return:        Dictionary of card IDs to the hashes of the newly hashed images.
+    """
+    try:
+        files = os.listdir(IMAGE_CACHE_PATH)
+    except FileNotFoundError:
+        return {}
+    paths = {
+        os.path.splitext(file)[0]: os.path.join(IMAGE_CACHE_PATH, file)
+        for file in files if file.lower().endswith(IMAGE_EXTENSIONS)
+    }
+    pending = [card_id for card_id in paths if card_id not in hashes]
+    if not pending:
+        return {}
+    workers = max(1, min(workers or os.cpu_count() or 1, len(pending)))
+    if workers == 1:
+        computed = map(hash_image_file, (paths[card_id] for card_id in pending))
+        return {card_id: value for card_id, value in zip(pending, computed) if value is not None}
+    # Spawned rather than forked, forking the threads of a running app server is unsafe
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        computed = executor.map(hash_image_file, (paths[card_id] for card_id in pending), chunksize=64)
+        return {card_id: value for card_id, value in zip(pending, computed) if value is not None}
+
+
+class BKTree:
+    def __init__(self) -> None:
+        """
+        Burkhard-Keller tree over 64-bit hashes in the Hamming metric. Each node keeps its children by their
+        distance to it, so that by the triangle inequality a search within a radius only descends into the
+        children whose distance is within that radius of the query's distance to the node. Values with the same
+        hash, such as reprints sharing their artwork, share a node.
+        """
+        self.hashes: List[int] = []
+        self.values: List[List[str]] = []
+        self.children: List[Dict[int, int]] = []
+
+    def __len__(self) -> int:
+        """
+        :return:    The number of distinct hashes in the tree.
+        """
+        return len(self.hashes)
+
+    def add(self, value_hash: int, value: str) -> None:
+        """
+        Add a value under its hash.
+
+        :param value_hash:  The hash.
+        :param value:       The value, e.g. a card ID.
+        """
+        if not self.hashes:
+            self._node(value_hash, value)
+            return
+        node = 0
+        while True:
+            distance = _hamming(value_hash, self.hashes[node])
+            if distance == 0:
+                if value not in self.values[node]:
+                    self.values[node].append(value)
+                return
+            child = self.children[node].get(distance)
+            if child is None:
+                self.children[node][distance] = self._node(value_hash, value)
+                return
+            node = child
+
+    def _node(self, value_hash: int, value: str) -> int:
+        self.hashes.append(value_hash)
+        self.values.append([value])
+        self.children.append({})
+        return len(self.hashes) - 1
+
+    def nearest(self, value_hash: int, limit: int, max_distance: int) -> List[Tuple[int, List[str]]]:
+        """
+        Find the hashes closest to a hash. The search radius shrinks to the distance of the furthest of the
+        `limit` best hashes found so far.
+
+        :param value_hash:      The hash to look up.
+        :param limit:           The maximum number of hashes to return.
+        :param max_distance:    The largest distance to return.
+        :return:                Tuples of distances and the values stored under each hash, closest first.
+        """
+        if not self.hashes or limit < 1:
+            return []
+        best: List[Tuple[int, int]] = []  # Max-heap of (-distance, node) of the hashes found so far
+        radius = max_distance
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            distance = _hamming(value_hash, self.hashes[node])
+            if distance <= radius:
+                heapq.heappush(best, (-distance, node))
+                if len(best) > limit:
+                    heapq.heappop(best)
+                if len(best) == limit:
+                    radius = -best[0][0]
+            stack.extend(child for child_distance, child in self.children[node].items()
+                         if abs(child_distance - distance) <= radius)
+        return [(-negative_distance, self.values[node]) for negative_distance, node in sorted(best, reverse=True)]
+
+
+class CardRecognizer:
+    def __init__(self, hashes: Optional[Dict[str, int]] = None) -> None:
+        """
+        Recognize cards in photos and scans by the perceptual hash of their artwork, looked up in a BK-tree of
+        the hashes of the card images in the image cache.
+
+        :param hashes:  Dictionary of card IDs to the hashes of their artwork.
+        """
+        self.hashes: Dict[str, int] = {}
+        self.tree = BKTree()
+        self._lock = threading.Lock()
+        self.add_hashes(hashes or {})
+
+    def __len__(self) -> int:
+        """
+        :return:    The number of recognizable cards.
+        """
+        return len(self.hashes)
+
+    def add_hashes(self, hashes: Dict[str, int]) -> None:
+        """
+        Make more cards recognizable.
+
+        :param hashes:  Dictionary of card IDs to the hashes of their artwork.
+        """
+        with self._lock:
+            for card_id, value_hash in hashes.items():
+                if card_id not in self.hashes:
+                    self.hashes[card_id] = value_hash
+                    self.tree.add(value_hash, card_id)
+
+    def refresh(self, workers: Optional[int] = None) -> int:
+        """
+        Hash the images downloaded into the image cache since the last refresh, and save the hashes.
+
+        :param workers: The number of worker processes, one per CPU by default.
+        :return:        The number of cards that became recognizable.
+        """
+        added = hash_cached_images(self.hashes, workers)
+        if added:
+            self.add_hashes(added)
+            with self._lock:
+                hashes = dict(self.hashes)
+            save_hashes(hashes)
+        return len(added)
+
+    def match_card(self, card: Image.Image, limit: int = 5, max_distance: int = MATCH_DISTANCE) -> List[Match]:
+        """
+        Find the cards closest to an image already cropped to a card.
+
+        :param card:            The card image.
+        :param limit:           The maximum number of candidates.
+        :param max_distance:    The largest hash distance of the candidates.
+        :return:                The candidates, most similar first.
+        """
+        with self._lock:
+            found = self.tree.nearest(art_hash(card), limit, max_distance)
+        return [Match(card_id, distance) for distance, card_ids in found for card_id in card_ids][:limit]
+
+    def match(self, photo: Union[str, BinaryIO, Image.Image], limit: int = 5,
+              max_distance: int = MATCH_DISTANCE) -> List[Match]:
+        """
+        Recognize the card shown in a photo or scan.
+
+        :param photo:           The photo, as a path, binary stream or image.
+        :param limit:           The maximum number of candidates.
+        :param max_distance:    The largest hash distance of the candidates.
+        :return:                The candidate cards, most similar first.
+        """
+        return self.match_card(crop_card(_open(photo)), limit, max_distance)
+
+    def match_page(self, photo: Union[str, BinaryIO, Image.Image], grid: Tuple[int, int] = (3, 3),
+                   limit: int = 5, max_distance: int = MATCH_DISTANCE) -> List[List[Match]]:
+        """
+        Recognize the cards of a binder page: the page is cut into a grid of pockets and each pocket is
+        recognized on its own.
+
+        :param photo:           The photo of the page, as a path, binary stream or image.
+        :param grid:            The number of pockets per row and per column.
+        :param limit:           The maximum number of candidates per pocket.
+        :param max_distance:    The largest hash distance of the candidates.
+        :return:                The candidates of each pocket, in reading order.
+        """
+        image = ImageOps.exif_transpose(_open(photo)).convert("RGB")
+        width, height = image.size
+        columns, rows = grid
+        return [
+            self.match(image.crop((column * width // columns, row * height // rows,
+                                   (column + 1) * width // columns, (row + 1) * height // rows)),
+                       limit, max_distance)
+            for row in range(rows) for column in range(columns)
+        ]
+
+
+_recognizer: Optional[CardRecognizer] = None
+_recognizer_lock = threading.Lock()
+
+
+def get_recognizer() -> CardRecognizer:
+    """
+    Get the process-wide recognizer, loading the saved hashes on first use and hashing the images cached since.
+
+    :return:    The recognizer.
+    """
+    global _recognizer
+    if _recognizer is None:
+        with _recognizer_lock:
+            if _recognizer is None:
+                recognizer = CardRecognizer(load_hashes())
+                recognizer.refresh()
+                _recognizer = recognizer
+    return _recognizer
+
+
+def candidates_to_cards(matches: Iterable[Match]) -> List[Tuple["Card", int]]:
+    """
+    Resolve candidate card IDs against the catalog, dropping the cards it does not know.
+
+    :param matches: The candidates.
+    :return:        Tuples of the cards and their hash distances, in the order of the candidates.
+    """
+    catalog = get_catalog()
+    return [(card, match.distance) for match in matches if (card := catalog.get(match.card_id)) is not None]
+
+
+def index_image(card_id: str, path: str) -> None:
+    """
+    Make a card whose image was just cached recognizable by the process-wide recognizer, if it was built. Does
+    nothing otherwise, the image will be hashed when the recognizer is built.
+
+    :param card_id: The ID of the card.
+    :param path:    The path of its cached image.
+    """
+    if _recognizer is not None and card_id not in _recognizer.hashes:
+        value_hash = hash_image_file(path)
+        if value_hash is not None:
+            _recognizer.add_hashes({card_id: value_hash})
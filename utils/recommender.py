@@ -0,0 +1,218 @@
+import threading
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from pokemontcgsdk import Card
+from scipy.sparse import csr_matrix
+
+from utils.deck import Deck, clean_card_name
+
+SMOOTHING = 1.0  # Damps the PMI of pairs seen in few decks, weight = count / (count + SMOOTHING)
+MERGE_THRESHOLD = 256  # Deck updates kept apart from the main co-occurrence matrix before being merged into it
+
+_clean_card_name = lru_cache(maxsize=None)(clean_card_name)
+
+
+class CardRecommender:
+    def __init__(self) -> None:
+        """
+        Sparse card-to-card co-occurrence matrix over a corpus of decks, ranking cards by their positive
+        pointwise mutual information (PPMI) with the cards of a deck. Cards are identified by name, so that
+        reprints of the same card are interchangeable. Deck updates are kept in a small delta matrix that is
+        merged into the main one once it grows, so that saving a deck does not rebuild the matrix.
+        """
+        self.names: List[str] = []
+        self.name_index: Dict[str, int] = {}
+        self.decks: Dict[str, np.ndarray] = {}  # Deck ID -> sorted indices of the card names it plays
+        self.document_frequency = np.zeros(0, dtype=np.int64)
+        self._counts = csr_matrix((0, 0), dtype=np.int64)
+        self._pending: List[Tuple[np.ndarray, int]] = []  # Name indices of added (+1) and removed (-1) decks
+        self._delta: Optional[csr_matrix] = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """
+        :return:    The number of decks in the corpus.
+        """
+        return len(self.decks)
+
+    def _name_indices(self, names: Iterable[str], add: bool) -> np.ndarray:
+        indices = set()
+        for name in names:
+            name = _clean_card_name(name)
+            index = self.name_index.get(name)
+            if index is None and add:
+                index = len(self.names)
+                self.name_index[name] = index
+                self.names.append(name)
+            if index is not None:
+                indices.add(index)
+        return np.array(sorted(indices), dtype=np.int64)
+
+    def _deck_indices(self, deck: Deck, add: bool = True) -> np.ndarray:
+        return self._name_indices((card.name for card, _ in deck.cards()), add)
+
+    def _presence(self, rows: List[np.ndarray], signs: Optional[List[int]] = None) -> csr_matrix:
+        # Decks × card names matrix, with a 1 (or the sign of the update) where a deck plays a card
+        indptr = np.concatenate([[0], np.cumsum([len(row) for row in rows])])
+        indices = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+        data = np.ones(len(indices), dtype=np.int64)
+        if signs is not None:
+            data *= np.repeat(signs, np.diff(indptr))
+        return csr_matrix((data, indices, indptr), shape=(len(rows), len(self.names)))
+
+    def _resize(self) -> None:
+        size = len(self.names)
+        if len(self.document_frequency) < size:
+            self.document_frequency = np.pad(self.document_frequency, (0, size - len(self.document_frequency)))
+        if self._counts.shape[0] < size:
+            self._counts.resize((size, size))
+
+    def add_decks(self, decks: Iterable[Tuple[str, Deck]]) -> None:
+        """
+        Add decks to the corpus, replacing the previous version of decks that are already in it.
+
+        :param decks:   Tuples of deck IDs and decks.
+        """
+        with self._lock:
+            rows, signs = [], []
+            for deck_id, deck in decks:
+                previous = self.decks.pop(deck_id, None)
+                if previous is not None:
+                    rows.append(previous)
+                    signs.append(-1)
+                indices = self._deck_indices(deck)
+                self.decks[deck_id] = indices
+                rows.append(indices)
+                signs.append(1)
+            self._apply(rows, signs)
+
+    def remove_deck(self, deck_id: str) -> None:
+        """
+        Remove a deck from the corpus.
+
+        :param deck_id:     The ID of the deck.
+        """
+        with self._lock:
+            previous = self.decks.pop(deck_id, None)
+            if previous is not None:
+                self._apply([previous], [-1])
+
+    def _apply(self, rows: List[np.ndarray], signs: List[int]) -> None:
+        if not rows:
+            return
+        self._resize()
+        for row, sign in zip(rows, signs):
+            self.document_frequency[row] += sign
+        if len(rows) > MERGE_THRESHOLD or not self._counts.nnz:
+            # Bulk loads go straight to the main matrix: co-occurrences are presenceᵀ × presence
+            presence = self._presence(rows)
+            self._counts = (self._counts + self._presence(rows, signs).T @ presence).tocsr()
+            self._counts.eliminate_zeros()
+            return
+        self._pending.extend(zip(rows, signs))
+        self._delta = None
+        if len(self._pending) > MERGE_THRESHOLD:
+            self._counts = (self._counts + self._pending_counts()).tocsr()
+            self._counts.eliminate_zeros()
+            self._pending.clear()
+
+    def _pending_counts(self) -> csr_matrix:
+        if self._delta is None or self._delta.shape[0] != len(self.names):
+            rows = [row for row, _ in self._pending]
+            signs = [sign for _, sign in self._pending]
+            self._delta = (self._presence(rows, signs).T @ self._presence(rows)).tocsr()
+        return self._delta
+
+    def scores(self, deck: Deck) -> np.ndarray:
+        """
+        Score every known card name by how well it fits a deck: the sum of its damped PPMI with each card
+        name of the deck.
+
+        :param deck:    The deck.
+        :return:        The score of each card name, indexed like `names`.
+        """
+        with self._lock:
+            self._resize()
+            deck_indices = self._deck_indices(deck, add=False)
+            if not len(deck_indices) or not self.decks:
+                return np.zeros(len(self.names))
+            rows = self._counts[deck_indices]
+            if self._pending:
+                rows = (rows + self._pending_counts()[deck_indices]).tocsr()
+            document_frequency = self.document_frequency
+            deck_count = len(self.decks)
+
+        row_names = np.repeat(deck_indices, np.diff(rows.indptr))
+        counts = rows.data.astype(np.float64)
+        valid = counts > 0
+        row_names, columns, counts = row_names[valid], rows.indices[valid], counts[valid]
+        pmi = np.log(deck_count * counts / (document_frequency[row_names] * document_frequency[columns]))
+        weights = np.maximum(pmi, 0.0) * counts / (counts + SMOOTHING)
+        return np.bincount(columns, weights=weights, minlength=len(document_frequency))
+
+    def rank(self, deck: Deck, cards: List[Tuple[Card, int]]) -> List[Tuple[Card, int]]:
+        """
+        Sort cards by how well they fit a deck, best first. Cards the corpus knows nothing about keep their
+        relative order at the end.
+
+        :param deck:    The deck.
+        :param cards:   Tuples of cards and quantities, e.g. the owned cards.
+        :return:        The sorted cards.
+        """
+        scores = self.scores(deck)
+        name_scores = [
+            scores[index] if (index := self.name_index.get(_clean_card_name(card.name))) is not None
+            and index < len(scores) else 0.0
+            for card, _ in cards
+        ]
+        order = np.argsort(-np.array(name_scores), kind="stable")
+        return [cards[i] for i in order]
+
+
+_recommender: Optional[CardRecommender] = None
+_recommender_lock = threading.Lock()
+
+
+def get_recommender() -> CardRecommender:
+    """
+    Get the process-wide recommender over every user's decks, building it on first use.
+
+    :return:    The recommender.
+    """
+    global _recommender
+    if _recommender is None:
+        with _recommender_lock:
+            if _recommender is None:
+                from utils.storage import iter_all_decks
+                recommender = CardRecommender()
+                recommender.add_decks(iter_all_decks())
+                _recommender = recommender
+    return _recommender
+
+
+def index_deck(deck_id: str, deck: Optional[Deck]) -> None:
+    """
+    Update a deck in the process-wide recommender, if it was built. Does nothing otherwise, the deck will be
+    read from storage when the recommender is built.
+
+    :param deck_id:     The ID of the deck, of the form "<user>/<deck name>".
+    :param deck:        The deck, or None to remove it from the corpus.
+    """
+    if _recommender is None:
+        return
+    if deck is None:
+        _recommender.remove_deck(deck_id)
+    else:
+        _recommender.add_decks([(deck_id, deck)])
+
+
+def index_decks(decks: Iterable[Tuple[str, Deck]]) -> None:
+    """
+    Add many decks to the process-wide recommender at once, if it was built.
+
+    :param decks:   Tuples of deck IDs and decks.
+    """
+    if _recommender is not None:
+        _recommender.add_decks(decks)
@@ -0,0 +1,507 @@
+import atexit
+import heapq
+import itertools
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Callable, Deque, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows, where a single process is expected to run the app
+    fcntl = None
+
+from utils.catalog import get_catalog, save_snapshot
+from utils.change_feed import JOURNAL_LIMIT, compact_journal
+from utils.storage import DATA_PATH, load_cards_from_collection, load_pickle_file, save_pickle_file
+
+STATE_PATH = os.path.join(DATA_PATH, ".jobs")
+STATE_FILE = "scheduler.pkl"
+LOCK_FILE = "scheduler.lock"  # Held by the process that persists the pending jobs and runs the periodic ones
+INBOX_PREFIX = "inbox-"  # Pending jobs handed over to that process by the others
+WORKERS = int(os.environ.get("JOB_WORKERS", 2))  # Threads running jobs, 0 only queues and persists them
+HIGH, NORMAL, LOW = 0, 1, 2  # Priorities, lower runs first
+PRIORITY_NAMES = {HIGH: "high", NORMAL: "normal", LOW: "low"}
+HISTORY_SIZE = 50  # Finished jobs kept for the status view
+CLOCK_INTERVAL = 60.0  # Longest sleep of the clock thread between checks of the periodic jobs
+INBOX_INTERVAL = 5.0  # Longest wait of the leader for the jobs handed over by other processes
+SAVE_WINDOW = 1.0  # Seconds during which changes to the pending jobs are coalesced into a single save
+SETS_CHECK_INTERVAL = 60 * 60  # The set list is checked hourly and only fetched once older than `SETS_MAX_AGE`
+COMPACT_INTERVAL = 6 * 60 * 60
+TEMPORARY_MAX_AGE = 60 * 60  # Temporary files older than this were left behind by an interrupted write
+JOURNAL_COMPACT_SIZE = JOURNAL_LIMIT // 4
+JOURNAL_IDLE = 60 * 60
+THUMBNAIL_BATCH = 100  # Cards per thumbnail job, their images are downloaded one after the other
+
+JobKey = Tuple[str, Tuple[str, ...]]  # Kind and arguments of a job, jobs with equal keys are run once
+
+
+class JobStatus(NamedTuple):
+    kind: str
+    args: Tuple[str, ...]
+    priority: int
+    state: str  # "queued", "running", "done" or "failed"
+    submitted_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: str = ""  # Summary returned by the job, or its error
+
+
+class Periodic(NamedTuple):
+    kind: str
+    args: Tuple[str, ...]
+    interval: float
+    priority: int
+
+
+_JOBS: Dict[str, Callable[..., Optional[str]]] = {}
+
+
+def job(kind: str) -> Callable[[Callable[..., Optional[str]]], Callable[..., Optional[str]]]:
+    """
+    Register a function as the job of a kind. It is called with the string arguments of the job, must be safe to
+    run again, e.g. after a restart interrupted it, and may return a summary for the status view.
+
+    :param kind:    The kind of job, e.g. "refresh_sets".
+    :return:        The decorator.
+    """
+    def register(function: Callable[..., Optional[str]]) -> Callable[..., Optional[str]]:
+        _JOBS[kind] = function
+        return function
+    return register
+
+
+class Scheduler:
+    def __init__(self, path: Optional[str] = None, workers: int = WORKERS,
+                 periodic: Iterable[Periodic] = ()) -> None:
+        """
+        Runs maintenance jobs in a pool of threads, off the request path. Jobs are queued by priority, a job
+        submitted while the same job is queued is merged into it, and one submitted while it runs is run again
+        once it finished. A clock thread submits the periodic jobs when they are due and saves the pending jobs and
+        the last submission of each periodic job, so that they survive a restart.
+
+        Several processes may run a scheduler over the same path, e.g. the workers of the app and `cli.py jobs`.
+        Only the leader, the one holding the lock file next to the saved jobs, loads and saves them and submits
+        the periodic jobs. The others run the jobs submitted in their process and hand the ones still pending
+        when they stop over to the leader, or right away if they have no workers. A process takes over as the
+        leader once the previous one exited.
+
+        :param path:        The file the pending jobs are saved to.
+        :param workers:     The number of worker threads.
+        :param periodic:    The jobs to submit at regular intervals.
+        """
+        self.path = path or os.path.join(STATE_PATH, STATE_FILE)
+        self.workers = workers
+        self.periodic = list(periodic)
+        self._heap: List[Tuple[int, int, JobKey]] = []  # Stale entries are skipped when popped
+        self._queued: Dict[JobKey, JobStatus] = {}
+        self._running: Dict[JobKey, JobStatus] = {}
+        self._deferred: Dict[JobKey, JobStatus] = {}  # Submitted again while running
+        self._history: Deque[JobStatus] = deque(maxlen=HISTORY_SIZE)
+        self._last_submitted: Dict[JobKey, float] = {}
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._dirty = False
+        self._stopping = False
+        self._threads: List[threading.Thread] = []
+        self._lock_file = None
+        self.leader = False
+
+    def start(self) -> None:
+        """
+        Load the jobs pending at the last shutdown and start the clock and worker threads. Does nothing if they are
+        already started.
+        """
+        with self._condition:
+            if self._threads:
+                return
+            if self._lead():
+                self._load()
+                # Before the threads start, so that a batch job waiting for the scheduler to be idle runs them
+                self._submit_due()
+            self._threads.append(threading.Thread(target=self._clock, name="scheduler-clock", daemon=True))
+            self._threads.extend(threading.Thread(target=self._work, name=f"scheduler-worker-{index}", daemon=True)
+                                 for index in range(self.workers))
+            for thread in self._threads:
+                thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop the threads and save the pending jobs, or hand them over to the leader. Jobs still running are
+        abandoned and run again on the next start.
+        """
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+            state = self._state()
+        if self.leader:
+            self._save(state, self.path)
+        elif state["pending"]:
+            self._save(state, self._inbox_path())
+
+    def submit(self, kind: str, *args: str, priority: int = NORMAL) -> bool:
+        """
+        Queue a job. Returns right away, the job runs in a worker thread.
+
+        :param kind:        The kind of job, registered with `job`.
+        :param args:        The arguments of the job.
+        :param priority:    HIGH, NORMAL or LOW. A job already queued with a lower priority is promoted.
+        :return:            Whether the job was queued, False if it was merged into the same job already queued.
+        """
+        if kind not in _JOBS:
+            raise ValueError(f"Unknown job {kind!r}")
+        with self._condition:
+            return self._submit((kind, tuple(args)), priority)
+
+    def _submit(self, key: JobKey, priority: int) -> bool:
+        queued = self._queued.get(key) or self._deferred.get(key)
+        if queued is not None:
+            if priority < queued.priority:
+                promoted = queued._replace(priority=priority)
+                if key in self._queued:
+                    self._queued[key] = promoted
+                    heapq.heappush(self._heap, (priority, next(self._sequence), key))
+                else:
+                    self._deferred[key] = promoted
+            return False
+        status = JobStatus(key[0], key[1], priority, "queued", time.time())
+        if key in self._running:
+            self._deferred[key] = status
+        else:
+            self._queued[key] = status
+            heapq.heappush(self._heap, (priority, next(self._sequence), key))
+        self._dirty = True
+        self._condition.notify_all()
+        return True
+
+    def status(self) -> List[JobStatus]:
+        """
+        :return:    The running jobs, then the queued jobs in the order they will run, then the finished jobs, most
+                    recent first.
+        """
+        with self._condition:
+            running = sorted(self._running.values(), key=lambda status: status.started_at)
+            queued = sorted(list(self._queued.values()) + list(self._deferred.values()),
+                            key=lambda status: (status.priority, status.submitted_at))
+            return running + queued + list(self._history)
+
+    def wait_idle(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until no job is queued or running, e.g. in a batch job.
+
+        :param timeout: The maximum number of seconds to wait.
+        :return:        Whether the scheduler became idle.
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: not (self._queued or self._running or self._deferred), timeout)
+
+    def _state(self) -> dict:
+        pending = list(self._running.values()) + list(self._queued.values()) + list(self._deferred.values())
+        return {
+            "pending": [(status.kind, status.args, status.priority) for status in pending],
+            "last_submitted": dict(self._last_submitted),
+        }
+
+    def _save(self, state: dict, path: str) -> None:
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            save_pickle_file(state, path)
+        except OSError as e:
+            print(f"Failed to save the pending jobs: {e}", file=sys.stderr)
+
+    def _inbox_path(self) -> str:
+        # Unique, so that processes never overwrite the jobs they handed over
+        return os.path.join(os.path.dirname(self.path), f"{INBOX_PREFIX}{uuid.uuid4().hex}.pkl")
+
+    def _lead(self) -> bool:
+        # Becomes the leader if no other process is, the lock is held until the process exits
+        if fcntl is None:
+            self.leader = True
+            return True
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            lock_file = open(os.path.join(os.path.dirname(self.path), LOCK_FILE), "ab")
+        except OSError:
+            return False
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        self.leader = True
+        return True
+
+    def _load(self) -> None:
+        # Loads the jobs saved by the previous leader and those handed over since
+        state = load_pickle_file(self.path)
+        self._last_submitted.update(state.get("last_submitted", {}))
+        self._submit_saved(state)
+        self._adopt_inbox()
+
+    def _submit_saved(self, state: dict) -> None:
+        for kind, args, priority in state.get("pending", []):
+            if kind in _JOBS:
+                self._submit((kind, tuple(args)), priority)
+
+    def _adopt_inbox(self) -> None:
+        directory = os.path.dirname(self.path)
+        try:
+            files = sorted(os.listdir(directory))
+        except FileNotFoundError:
+            return
+        for file in files:
+            if file.startswith(INBOX_PREFIX) and file.endswith(".pkl"):
+                path = os.path.join(directory, file)
+                self._submit_saved(load_pickle_file(path))
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _hand_over(self) -> dict:
+        # Takes the queued jobs out of a process without workers, for the leader to run them
+        state = {"pending": [(status.kind, status.args, status.priority) for status in self._queued.values()]}
+        self._queued.clear()
+        self._heap.clear()
+        self._condition.notify_all()
+        return state
+
+    def _clock(self) -> None:
+        while True:
+            with self._condition:
+                if self._stopping:
+                    return
+                if not self.leader and self._lead():
+                    self._load()
+                if self.leader:
+                    self._adopt_inbox()
+                    timeout = min(self._submit_due(), INBOX_INTERVAL)
+                else:
+                    timeout = CLOCK_INTERVAL
+                dirty = self._dirty
+            if dirty:
+                # Saved after a window and outside of the lock, a burst of submissions costs a single write and
+                # submitting a job never waits for the disk
+                time.sleep(SAVE_WINDOW)
+                with self._condition:
+                    if self.leader:
+                        state, path = self._state(), self.path
+                    elif not self.workers and self._queued:
+                        state, path = self._hand_over(), self._inbox_path()
+                    else:
+                        state = path = None
+                    self._dirty = False
+                if state is not None:
+                    self._save(state, path)
+            with self._condition:
+                if not self._stopping and not self._dirty:
+                    self._condition.wait(timeout)
+
+    def _submit_due(self) -> float:
+        # Submits the periodic jobs that are due, returns the seconds until the next one is
+        now = time.time()
+        timeout = CLOCK_INTERVAL
+        for periodic in self.periodic:
+            key = (periodic.kind, periodic.args)
+            due = self._last_submitted.get(key, 0.0) + periodic.interval
+            if due <= now:
+                self._submit(key, periodic.priority)
+                self._last_submitted[key] = now
+                self._dirty = True
+                due = now + periodic.interval
+            timeout = min(timeout, due - now)
+        return timeout
+
+    def _work(self) -> None:
+        while True:
+            with self._condition:
+                while not self._stopping and not self._heap:
+                    self._condition.wait()
+                if self._stopping:
+                    return
+                priority, _, key = heapq.heappop(self._heap)
+                status = self._queued.get(key)
+                if status is None or status.priority != priority:
+                    continue  # Promoted since, or already run
+                del self._queued[key]
+                status = self._running[key] = status._replace(state="running", started_at=time.time())
+
+            try:
+                result = _JOBS[key[0]](*key[1])
+                status = status._replace(state="done", result=result or "")
+            except Exception as e:
+                print(f"Job {key[0]}{key[1]} failed: {e}", file=sys.stderr)
+                status = status._replace(state="failed", result=f"{type(e).__name__}: {e}")
+
+            with self._condition:
+                del self._running[key]
+                self._history.appendleft(status._replace(finished_at=time.time()))
+                deferred = self._deferred.pop(key, None)
+                if deferred is not None:
+                    self._queued[key] = deferred
+                    heapq.heappush(self._heap, (deferred.priority, next(self._sequence), key))
+                self._dirty = True
+                self._condition.notify_all()
+
+
+PERIODIC_JOBS = [
+    Periodic("refresh_sets", (), SETS_CHECK_INTERVAL, HIGH),
+    Periodic("compact_storage", (), COMPACT_INTERVAL, LOW),
+]
+
+_scheduler: Optional[Scheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> Scheduler:
+    """
+    Get the process-wide scheduler, starting it on first use with the jobs pending at the last shutdown.
+
+    :return:    The scheduler.
+    """
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                scheduler = Scheduler(periodic=PERIODIC_JOBS)
+                scheduler.start()
+                _scheduler = scheduler
+    return _scheduler
+
+
+def submit(kind: str, *args: str, priority: int = NORMAL) -> bool:
+    """
+    Queue a job on the process-wide scheduler, see `Scheduler.submit`.
+
+    :param kind:        The kind of job.
+    :param args:        The arguments of the job.
+    :param priority:    HIGH, NORMAL or LOW.
+    :return:            Whether the job was queued.
+    """
+    return get_scheduler().submit(kind, *args, priority=priority)
+
+
+@atexit.register
+def _stop_on_exit() -> None:
+    if _scheduler is not None:
+        _scheduler.stop()
+
+
+@job("refresh_sets")
+def refresh_sets() -> str:
+    """
+    Fetch the set list if it is older than `SETS_MAX_AGE`, and queue fetching the cards of the sets released since
+    the last fetch.
+    """
+    # Imported here, the SDK is only needed once a job calls the API
+    from utils.pokemon_api import fetch_sets
+
+    catalog = get_catalog()
+    if not catalog.sets_stale():
+        return "Up to date"
+    known = {card_set.id for card_set in catalog.sets}
+    sets = fetch_sets()
+    catalog.set_sets(sets)
+    save_snapshot(catalog)
+    # On the first fetch every set is new, their cards are fetched on demand by searches instead
+    new_sets = [card_set.id for card_set in sets if card_set.id not in known] if known else []
+    for set_id in new_sets:
+        submit("refresh_cards", set_id, priority=LOW)
+    return f"{len(sets)} sets, {len(new_sets)} new"
+
+
+@job("refresh_cards")
+def refresh_cards(set_id: str) -> str:
+    """
+    Fetch the cards of a set into the catalog.
+    """
+    from pokemontcgsdk import Card
+
+    from utils.pokemon_api import configure_client
+
+    configure_client()
+    cards = Card.where(q=f"set.id:{set_id}")
+    get_catalog().add_cards(cards)
+    return f"{len(cards)} cards"
+
+
+def submit_thumbnails(card_ids: Iterable[str]) -> None:
+    """
+    Queue caching the thumbnails of newly owned cards, in jobs of up to `THUMBNAIL_BATCH` cards.
+
+    :param card_ids:    The IDs of the cards.
+    """
+    card_ids = sorted(set(card_ids))
+    for start in range(0, len(card_ids), THUMBNAIL_BATCH):
+        submit("thumbnails", *card_ids[start:start + THUMBNAIL_BATCH], priority=LOW)
+
+
+@job("thumbnails")
+def cache_thumbnails(*card_ids: str) -> str:
+    """
+    Download the small images of newly owned cards into the image cache, one after the other. The large images
+    used by proxy sheets and photo recognition are downloaded when they are needed.
+    """
+    # Imported here, the image libraries are only needed by this job
+    from utils.pokemon_api import find_cards_by_ids
+    from utils.proxies import cached_image_path
+
+    catalog = get_catalog()
+    cards = {card_id: catalog.get(card_id) for card_id in card_ids}
+    missing = [card_id for card_id, card in cards.items() if card is None]
+    if missing:
+        cards.update(find_cards_by_ids(missing))
+    cached = sum(card is not None and cached_image_path(card, "small") is not None for card in cards.values())
+    if cached < len(card_ids):
+        raise OSError(f"{len(card_ids) - cached} of {len(card_ids)} thumbnails could not be fetched")
+    return f"{cached} thumbnails"
+
+
+@job("price_snapshot")
+def snapshot_prices(name: str) -> str:
+    """
+    Snapshot the prices of a user's collection, unless the last snapshot is recent, see `utils.valuation`.
+    """
+    from utils.valuation import load_price_history
+    from utils.write_queue import get_write_queue
+
+    history = load_price_history(name)
+    if not history.is_stale():
+        return "Up to date"
+    # The changes still queued by the user's sessions in this process are part of the snapshot
+    get_write_queue(name).flush()
+    changed = history.append_snapshot(load_cards_from_collection(name))
+    return f"{changed} cards changed"
+
+
+@job("compact_storage")
+def compact_storage() -> str:
+    """
+    Fold the cards the catalog learned into its snapshot, restart the large journals of idle users and remove the
+    temporary files of interrupted writes.
+    """
+    catalog = get_catalog()
+    saved = catalog.dirty
+    if saved:
+        save_snapshot(catalog)
+
+    journals = removed = 0
+    now = time.time()
+    for directory, _, files in os.walk(DATA_PATH):
+        if os.path.dirname(directory) == DATA_PATH and not os.path.basename(directory).startswith("."):
+            journals += compact_journal(directory, JOURNAL_COMPACT_SIZE, JOURNAL_IDLE)
+        for file in files:
+            path = os.path.join(directory, file)
+            if ".tmp" in file:
+                try:
+                    if now - os.path.getmtime(path) > TEMPORARY_MAX_AGE:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    pass  # Moved in place or removed since it was listed
+    return f"Catalog {'saved' if saved else 'up to date'}, {journals} journals restarted, " \
+           f"{removed} temporary files removed"
@@ -0,0 +1,107 @@
+import re
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from pokemontcgsdk import Card, Set
+
+NUMBER_PATTERN = re.compile(r"^([A-Za-z]*)0*(\d+)$")  # "185", "TG07", "SV001", the digits give the card's slot
+
+
+class SetProgress(NamedTuple):
+    set_id: str
+    name: str
+    series: str
+    release_date: str
+    owned: int
+    total: int
+
+
+class SetCompletionIndex:
+    def __init__(self, sets: Iterable[Set], cards: Optional[Dict[str, Tuple[Card, int]]] = None) -> None:
+        """
+        Bitmap of the owned card numbers of each set, one bit per card number up to the set's total, and the
+        count of set bits per set so that the completion of every set is a single vectorized division.
+
+        :param sets:    The sets, e.g. from the catalog.
+        :param cards:   Dictionary of card IDs to tuples of cards and owned quantities.
+        """
+        self.sets: List[Set] = list(sets)
+        self.set_index: Dict[str, int] = {card_set.id: index for index, card_set in enumerate(self.sets)}
+        self.totals = np.array([card_set.total or 0 for card_set in self.sets], dtype=np.int64)
+        self.owned = np.zeros(len(self.sets), dtype=np.int64)
+        self.bitmaps: List[int] = [0] * len(self.sets)
+        self.prefixes: List[Tuple[str, int]] = [("", 0)] * len(self.sets)  # Letters and zero-padded width
+        for card_id, (_, quantity) in (cards or {}).items():
+            self.set_owned(card_id, quantity)
+
+    def _slot(self, card_id: str) -> Tuple[int, int]:
+        # Slot of a card in its set's bitmap, (-1, -1) for unknown sets and numbers without a slot
+        set_id, _, number = card_id.rpartition("-")
+        index = self.set_index.get(set_id)
+        match = NUMBER_PATTERN.match(number)
+        if index is None or match is None:
+            return -1, -1
+        slot = int(match.group(2)) - 1
+        if not 0 <= slot < self.totals[index]:
+            return -1, -1
+        if match.group(1):
+            self.prefixes[index] = (match.group(1), len(number) - len(match.group(1)))
+        return index, slot
+
+    def set_owned(self, card_id: str, quantity: int) -> None:
+        """
+        Update the ownership of a card.
+
+        :param card_id:     The ID of the card, of the form "<set ID>-<number>".
+        :param quantity:    The new owned quantity, 0 if the card left the collection.
+        """
+        index, slot = self._slot(card_id)
+        if index < 0:
+            return
+        bit = 1 << slot
+        owned = bool(self.bitmaps[index] & bit)
+        if quantity > 0 and not owned:
+            self.bitmaps[index] |= bit
+            self.owned[index] += 1
+        elif quantity <= 0 and owned:
+            self.bitmaps[index] &= ~bit
+            self.owned[index] -= 1
+
+    def completion(self) -> np.ndarray:
+        """
+        :return:    The fraction of each set's card numbers that are owned, indexed like `sets`.
+        """
+        return self.owned / np.maximum(self.totals, 1)
+
+    def progress(self, started_only: bool = False) -> List[SetProgress]:
+        """
+        Get the progress of every set, most complete first.
+
+        :param started_only:    Whether to leave out the sets with no owned card.
+        :return:                The progress of each set.
+        """
+        order = np.lexsort((-self.owned, -self.completion()))
+        if started_only:
+            order = order[self.owned[order] > 0]
+        return [
+            SetProgress(self.sets[index].id, self.sets[index].name, self.sets[index].series,
+                        self.sets[index].releaseDate, int(self.owned[index]), int(self.totals[index]))
+            for index in order.tolist()
+        ]
+
+    def missing_numbers(self, set_id: str) -> List[str]:
+        """
+        Get the card numbers of a set that are not owned.
+
+        :param set_id:  The ID of the set.
+        :return:        The missing card numbers, in order.
+        """
+        index = self.set_index.get(set_id)
+        if index is None:
+            return []
+        total = int(self.totals[index])
+        # Unpack the bitmap to one byte per slot, little-endian so that slot i is the i-th bit
+        bits = np.unpackbits(np.frombuffer(self.bitmaps[index].to_bytes((total + 7) // 8, "little"), dtype=np.uint8),
+                             count=total, bitorder="little")
+        prefix, width = self.prefixes[index]
+        return [f"{prefix}{slot + 1:0{width}d}" for slot in np.flatnonzero(bits == 0).tolist()]
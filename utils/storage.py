@@ -1,14 +1,18 @@
 import os
 import pickle
-from typing import Any, Dict, Tuple
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 from pokemontcgsdk import Card
 
+from utils.change_feed import CARDS, DECKS, append_changes, user_lock
 from utils.deck import Deck
 
 DATA_PATH = "data"
 CARDS_FILE = "cards.pkl"
 DECKS_FILE = "decks.pkl"
+CORPUS_DIRECTORY = ".corpus"  # Decklist corpora, e.g. tournament results, one directory of deck chunks each
+CORPUS_CHUNK_FILE = "decks-{:05d}.pkl"
+CORPUS_PREFIX = "corpus:"  # Starts the owner of corpus deck IDs, so that a corpus never shares one with a user
 
 
 def ensure_directory(path: str) -> None:
@@ -42,14 +46,17 @@ def load_pickle_file(file_path: str) -> Any:
 
 def save_pickle_file(data: Any, file_path: str) -> None:
     """
-    Saves data to a pickle file.
+    Saves data to a pickle file. The data is written to a temporary file first and moved in place,
+    so readers never see a partially written file.
 
     Args:
         data (Any): The data to save.
         file_path (str): The path to the pickle file.
     """
-    with open(file_path, "wb") as f:
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, "wb") as f:
         pickle.dump(data, f) #type: ignore
+    os.replace(tmp_path, file_path)
 
 
 def get_user_path(name: str) -> str:
@@ -76,9 +83,11 @@ def save_deck_to_collection(deck: Deck, name: str) -> None:
     user_path = get_user_path(name)
     ensure_directory(user_path)
     user_decks_path = os.path.join(user_path, DECKS_FILE)
-    decks: Dict[str, Deck] = load_pickle_file(user_decks_path)
-    decks[deck.name] = deck
-    save_pickle_file(decks, user_decks_path)
+    with user_lock(user_path):
+        decks: Dict[str, Deck] = load_pickle_file(user_decks_path)
+        decks[deck.name] = deck
+        save_pickle_file(decks, user_decks_path)
+        append_changes(user_path, DECKS, {deck.name: deck})
 
 
 def load_decks_from_collection(name: str) -> Dict[str, Deck]:
@@ -99,6 +108,107 @@ def load_decks_from_collection(name: str) -> Dict[str, Deck]:
     return decks
 
 
+def iter_all_decks() -> Iterator[Tuple[str, Deck]]:
+    """
+    Iterates over the decks of every user, e.g. to index them.
+
+    Returns:
+        Iterator[Tuple[str, Deck]]: Tuples of deck IDs, of the form "<user>/<deck name>", and Deck objects.
+    """
+    if not os.path.isdir(DATA_PATH):
+        return
+    for user in sorted(os.listdir(DATA_PATH)):
+        user_decks_path = os.path.join(DATA_PATH, user, DECKS_FILE)
+        if user.startswith(".") or not os.path.exists(user_decks_path):
+            continue
+        decks: Dict[str, Deck] = load_pickle_file(user_decks_path)
+        for deck_name, deck in decks.items():
+            yield f"{user}/{deck_name}", deck
+    yield from iter_corpus_decks()
+
+
+def corpus_deck_id(corpus: str, deck_name: str) -> str:
+    """
+    Constructs the ID of a deck of a decklist corpus, in the same namespace as the "<user>/<deck name>" IDs of
+    the users' decks but never equal to one of them.
+
+    Args:
+        corpus (str): The name of the corpus.
+        deck_name (str): The name of the deck.
+
+    Returns:
+        str: The deck ID, of the form "corpus:<corpus>/<deck name>".
+    """
+    return f"{CORPUS_PREFIX}{corpus}/{deck_name}"
+
+
+def get_corpus_path(corpus: str) -> str:
+    """
+    Constructs the data path of a decklist corpus.
+
+    Args:
+        corpus (str): The name of the corpus.
+
+    Returns:
+        str: The data path of the corpus.
+    """
+    return os.path.join(DATA_PATH, CORPUS_DIRECTORY, corpus)
+
+
+def clear_corpus(corpus: str) -> None:
+    """
+    Removes the decks of a decklist corpus, e.g. before ingesting it again.
+
+    Args:
+        corpus (str): The name of the corpus.
+    """
+    corpus_path = get_corpus_path(corpus)
+    if not os.path.isdir(corpus_path):
+        return
+    for file_name in os.listdir(corpus_path):
+        if file_name.endswith(".pkl"):
+            os.remove(os.path.join(corpus_path, file_name))
+
+
+def save_corpus_chunk(corpus: str, chunk: int, decks: List[Deck]) -> None:
+    """
+    Saves a chunk of the decks of a decklist corpus. Each chunk is its own file, so that a corpus is written
+    and read a chunk at a time.
+
+    Args:
+        corpus (str): The name of the corpus.
+        chunk (int): The number of the chunk.
+        decks (List[Deck]): The decks of the chunk, with names unique within the corpus.
+    """
+    corpus_path = get_corpus_path(corpus)
+    ensure_directory(corpus_path)
+    save_pickle_file(decks, os.path.join(corpus_path, CORPUS_CHUNK_FILE.format(chunk)))
+
+
+def iter_corpus_decks(corpus: Optional[str] = None) -> Iterator[Tuple[str, Deck]]:
+    """
+    Iterates over the decks of a decklist corpus, or of every corpus, one chunk in memory at a time.
+
+    Args:
+        corpus (Optional[str]): The name of the corpus, None for every corpus.
+
+    Returns:
+        Iterator[Tuple[str, Deck]]: Tuples of deck IDs, see `corpus_deck_id`, and Deck objects.
+    """
+    corpora_path = os.path.join(DATA_PATH, CORPUS_DIRECTORY)
+    if not os.path.isdir(corpora_path):
+        return
+    for corpus_name in [corpus] if corpus is not None else sorted(os.listdir(corpora_path)):
+        corpus_path = get_corpus_path(corpus_name)
+        if not os.path.isdir(corpus_path):
+            continue
+        for file_name in sorted(os.listdir(corpus_path)):
+            if file_name.endswith(".pkl"):
+                decks: List[Deck] = load_pickle_file(os.path.join(corpus_path, file_name))
+                for deck in decks:
+                    yield corpus_deck_id(corpus_name, deck.name), deck
+
+
 def remove_deck_from_collection(deck_name: str, name: str) -> None:
     """
     Removes a deck from the user's collection.
@@ -109,10 +219,14 @@ def remove_deck_from_collection(deck_name: str, name: str) -> None:
     """
     user_path = get_user_path(name)
     user_decks_path = os.path.join(user_path, DECKS_FILE)
-    decks: Dict[str, Deck] = load_pickle_file(user_decks_path)
-    if deck_name in decks:
-        decks.pop(deck_name)
-        save_pickle_file(decks, user_decks_path)
+    if not os.path.isdir(user_path):
+        return
+    with user_lock(user_path):
+        decks: Dict[str, Deck] = load_pickle_file(user_decks_path)
+        if deck_name in decks:
+            decks.pop(deck_name)
+            save_pickle_file(decks, user_decks_path)
+            append_changes(user_path, DECKS, {deck_name: None})
 
 
 def save_card_to_collection(card: Card, quantity: int, name: str) -> None:
@@ -127,14 +241,36 @@ def save_card_to_collection(card: Card, quantity: int, name: str) -> None:
     user_path = get_user_path(name)
     ensure_directory(user_path)
     cards_path = os.path.join(user_path, CARDS_FILE)
-    cards: Dict[str, Tuple[Card, int]] = load_pickle_file(cards_path)
-    card_id = card.id
-    if card_id in cards:
-        existing_quantity = cards[card_id][1]
-        cards[card_id] = (card, existing_quantity + quantity)
-    else:
-        cards[card_id] = (card, quantity)
-    save_pickle_file(cards, cards_path)
+    with user_lock(user_path):
+        cards: Dict[str, Tuple[Card, int]] = load_pickle_file(cards_path)
+        card_id = card.id
+        if card_id in cards:
+            existing_quantity = cards[card_id][1]
+            cards[card_id] = (card, existing_quantity + quantity)
+        else:
+            cards[card_id] = (card, quantity)
+        save_pickle_file(cards, cards_path)
+        append_changes(user_path, CARDS, {card_id: cards[card_id]})
+
+
+def save_cards_to_collection(new_cards: Dict[str, Tuple[Card, int]], name: str) -> None:
+    """
+    Saves many cards to the user's collection in a single write, adding to the quantities of existing cards.
+
+    Args:
+        new_cards (Dict[str, Tuple[Card, int]]): Dictionary of card IDs to tuples of Card objects and quantities to add.
+        name (str): The user's name.
+    """
+    user_path = get_user_path(name)
+    ensure_directory(user_path)
+    cards_path = os.path.join(user_path, CARDS_FILE)
+    with user_lock(user_path):
+        cards: Dict[str, Tuple[Card, int]] = load_pickle_file(cards_path)
+        for card_id, (card, quantity) in new_cards.items():
+            existing_quantity = cards[card_id][1] if card_id in cards else 0
+            cards[card_id] = (card, existing_quantity + quantity)
+        save_pickle_file(cards, cards_path)
+        append_changes(user_path, CARDS, {card_id: cards[card_id] for card_id in new_cards})
 
 
 def load_cards_from_collection(name: str) -> Dict[str, Tuple[Card, int]]:
@@ -164,11 +300,51 @@ def remove_one_card_from_collection(card_id: str, name: str) -> None:
     """
     user_path = get_user_path(name)
     cards_path = os.path.join(user_path, CARDS_FILE)
-    cards: Dict[str, Tuple[Card, int]] = load_pickle_file(cards_path)
-    if card_id in cards:
-        card, quantity = cards[card_id]
-        if quantity > 1:
-            cards[card_id] = (card, quantity - 1)
-        else:
-            cards.pop(card_id)
-        save_pickle_file(cards, cards_path)
+    if not os.path.isdir(user_path):
+        return
+    with user_lock(user_path):
+        cards: Dict[str, Tuple[Card, int]] = load_pickle_file(cards_path)
+        if card_id in cards:
+            card, quantity = cards[card_id]
+            if quantity > 1:
+                cards[card_id] = (card, quantity - 1)
+            else:
+                cards.pop(card_id)
+            save_pickle_file(cards, cards_path)
+            append_changes(user_path, CARDS, {card_id: cards.get(card_id)})
+
+
+def commit_changes(card_deltas: Dict[str, Tuple[Card, int]], deck_changes: Dict[str, Deck | None], name: str) -> None:
+    """
+    Saves a batch of changes to the user's collection, writing each file at most once.
+
+    Args:
+        card_deltas (Dict[str, Tuple[Card, int]]): Dictionary of card IDs to tuples of Card objects and quantities
+            to add, negative to remove copies. Cards left with no copies are removed.
+        deck_changes (Dict[str, Deck | None]): Dictionary of deck names to the decks to save, or None to remove them.
+        name (str): The user's name.
+    """
+    user_path = get_user_path(name)
+    ensure_directory(user_path)
+    with user_lock(user_path):
+        if card_deltas:
+            cards_path = os.path.join(user_path, CARDS_FILE)
+            cards: Dict[str, Tuple[Card, int]] = load_pickle_file(cards_path)
+            for card_id, (card, quantity) in card_deltas.items():
+                quantity += cards[card_id][1] if card_id in cards else 0
+                if quantity > 0:
+                    cards[card_id] = (card, quantity)
+                else:
+                    cards.pop(card_id, None)
+            save_pickle_file(cards, cards_path)
+            append_changes(user_path, CARDS, {card_id: cards.get(card_id) for card_id in card_deltas})
+        if deck_changes:
+            user_decks_path = os.path.join(user_path, DECKS_FILE)
+            decks: Dict[str, Deck] = load_pickle_file(user_decks_path)
+            for deck_name, deck in deck_changes.items():
+                if deck is not None:
+                    decks[deck_name] = deck
+                else:
+                    decks.pop(deck_name, None)
+            save_pickle_file(decks, user_decks_path)
+            append_changes(user_path, DECKS, deck_changes)
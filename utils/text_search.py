@@ -0,0 +1,242 @@
+import math
+import re
+import threading
+import unicodedata
+from typing import TYPE_CHECKING, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from pokemontcgsdk import Card
+
+K1 = 1.2  # BM25 term frequency saturation
+B = 0.75  # BM25 document length normalization
+SEPARATOR = -1  # Token between two texts of a card, so that phrases do not span them
+TOKEN = re.compile(r"[a-z0-9]+")
+PHRASE = re.compile(r'"([^"]*)"')
+
+
+class TextHit(NamedTuple):
+    card_id: str
+    score: float
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split text into lower-case words, without accents so that "Pokemon" finds "Pokémon".
+
+    :param text:    The text.
+    :return:        The words.
+    """
+    text = unicodedata.normalize("NFKD", text.lower())
+    return TOKEN.findall("".join(character for character in text if not unicodedata.combining(character)))
+
+
+def card_texts(card: "Card") -> List[str]:
+    """
+    :param card:    A card.
+    :return:        The names and texts of its attacks and abilities, and its rules.
+    """
+    texts = []
+    for attack in card.attacks or []:
+        texts.extend((attack.name or "", attack.text or ""))
+    for ability in card.abilities or []:
+        texts.extend((ability.name or "", ability.text or ""))
+    texts.extend(card.rules or [])
+    return [text for text in texts if text]
+
+
+class TextIndex:
+    def __init__(self) -> None:
+        """
+        Inverted index over the attack, ability and rules text of cards, ranked with BM25. Each term maps to the
+        sorted positions of the cards containing it and its frequency in each, and the token sequence of each
+        card is kept to check phrases. Cards are buffered and merged into the postings on the next query.
+        """
+        self.card_ids: List[str] = []
+        self.positions: Dict[str, int] = {}
+        self.terms: Dict[str, int] = {}
+        self.lengths = np.zeros(0, dtype=np.float64)
+        self.supertypes = np.zeros(0, dtype=object)
+        self.set_ids = np.zeros(0, dtype=object)
+        self.type_masks = np.zeros(0, dtype=np.int64)  # Bit i is set if the card has the i-th type of `types`
+        self.types: Dict[str, int] = {}
+        self._tokens: List[np.ndarray] = []
+        self._postings: List[Tuple[np.ndarray, np.ndarray]] = []  # Card positions and frequencies of each term
+        self._pending: List["Card"] = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """
+        :return:    The number of indexed cards.
+        """
+        with self._lock:
+            self._merge()
+            return len(self.card_ids)
+
+    def add_cards(self, cards: Iterable["Card"]) -> None:
+        """
+        Add cards to the index. Cards that are already indexed are skipped, their text does not change.
+
+        :param cards:   The cards.
+        """
+        with self._lock:
+            self._pending.extend(card for card in cards if card is not None and card.id not in self.positions)
+
+    def _merge(self) -> None:
+        if not self._pending:
+            return
+        pending = {card.id: card for card in self._pending if card.id not in self.positions}
+        self._pending.clear()
+        new_postings: Dict[int, Tuple[List[int], List[int]]] = {}
+        lengths, supertypes, set_ids, type_masks = [], [], [], []
+        for card in pending.values():
+            position = self.positions[card.id] = len(self.card_ids)
+            self.card_ids.append(card.id)
+            tokens: List[int] = []
+            for text in card_texts(card):
+                if tokens:
+                    tokens.append(SEPARATOR)
+                tokens.extend(self.terms.setdefault(word, len(self.terms)) for word in tokenize(text))
+            sequence = np.array(tokens, dtype=np.int32)
+            self._tokens.append(sequence)
+            terms, counts = np.unique(sequence[sequence != SEPARATOR], return_counts=True)
+            for term, count in zip(terms.tolist(), counts.tolist()):
+                docs, frequencies = new_postings.setdefault(term, ([], []))
+                docs.append(position)
+                frequencies.append(count)
+            lengths.append(int((sequence != SEPARATOR).sum()))
+            supertypes.append(card.supertype or "")
+            set_ids.append(card.set.id if card.set else "")
+            mask = 0
+            for card_type in card.types or []:
+                mask |= 1 << self.types.setdefault(card_type, len(self.types))
+            type_masks.append(mask)
+
+        self._postings.extend((np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32))
+                              for _ in range(len(self.terms) - len(self._postings)))
+        for term, (docs, frequencies) in new_postings.items():
+            # New cards come after the indexed ones, the postings stay sorted
+            old_docs, old_frequencies = self._postings[term]
+            self._postings[term] = (np.concatenate([old_docs, np.array(docs, dtype=np.int32)]),
+                                    np.concatenate([old_frequencies, np.array(frequencies, dtype=np.int32)]))
+        self.lengths = np.concatenate([self.lengths, np.array(lengths, dtype=np.float64)])
+        self.supertypes = np.concatenate([self.supertypes, np.array(supertypes, dtype=object)])
+        self.set_ids = np.concatenate([self.set_ids, np.array(set_ids, dtype=object)])
+        self.type_masks = np.concatenate([self.type_masks, np.array(type_masks, dtype=np.int64)])
+
+    def _filter(self, supertype: Optional[str], types: Optional[Iterable[str]], set_ids: Optional[Iterable[str]],
+                card_ids: Optional[Iterable[str]]) -> Optional[np.ndarray]:
+        mask = None
+
+        def restrict(condition: np.ndarray) -> None:
+            nonlocal mask
+            mask = condition if mask is None else mask & condition
+
+        if supertype:
+            restrict(self.supertypes == supertype)
+        if types:
+            bits = sum(1 << self.types[card_type] for card_type in set(types) if card_type in self.types)
+            restrict((self.type_masks & bits) != 0)
+        if set_ids:
+            restrict(np.isin(self.set_ids, list(set_ids)))
+        if card_ids is not None:
+            selected = np.zeros(len(self.card_ids), dtype=bool)
+            selected[[self.positions[card_id] for card_id in card_ids if card_id in self.positions]] = True
+            restrict(selected)
+        return mask
+
+    def _has_phrase(self, position: int, phrase: np.ndarray) -> bool:
+        tokens = self._tokens[position]
+        if len(tokens) < len(phrase):
+            return False
+        windows = np.lib.stride_tricks.sliding_window_view(tokens, len(phrase))
+        return bool((windows == phrase).all(axis=1).any())
+
+    def search(self, query: str, limit: Optional[int] = 50, supertype: Optional[str] = None,
+               types: Optional[Iterable[str]] = None, set_ids: Optional[Iterable[str]] = None,
+               card_ids: Optional[Iterable[str]] = None) -> List[TextHit]:
+        """
+        Search the text of the cards. Cards must contain every word of the query, or any of them if no card
+        contains them all, and every "quoted phrase" word for word. Matches are ranked with BM25.
+
+        :param query:       The query, e.g. `"search your deck" basic`.
+        :param limit:       The maximum number of cards to return.
+        :param supertype:   Only return the cards of this supertype, e.g. "Trainer".
+        :param types:       Only return the cards of any of these types, e.g. ["Fire"].
+        :param set_ids:     Only return the cards of these sets.
+        :param card_ids:    Only return these cards, e.g. the owned cards.
+        :return:            The matching cards, best first.
+        """
+        phrases = [tokenize(phrase) for phrase in PHRASE.findall(query)]
+        phrases = [phrase for phrase in phrases if phrase]
+        words = list(dict.fromkeys(tokenize(PHRASE.sub(" ", query)) + [word for phrase in phrases
+                                                                       for word in phrase]))
+        if not words:
+            return []
+        with self._lock:
+            self._merge()
+            count = len(self.card_ids)
+            if not count:
+                return []
+            mask = self._filter(supertype, types, set_ids, card_ids)
+            postings = [self._postings[self.terms[word]] if word in self.terms else None for word in words]
+            phrase_ids = [np.array([self.terms.get(word, -2) for word in phrase], dtype=np.int32)
+                          for phrase in phrases]
+            lengths = self.lengths
+            card_id_list = self.card_ids
+
+            known = [posting for posting in postings if posting is not None]
+            if len(known) < len(words):
+                candidates = np.zeros(0, dtype=np.int32)
+            else:
+                # Intersected from the rarest word, so that the candidates only shrink from there
+                rarest_first = sorted(known, key=lambda posting: len(posting[0]))
+                candidates = rarest_first[0][0]
+                for docs, _ in rarest_first[1:]:
+                    candidates = np.intersect1d(candidates, docs, assume_unique=True)
+            if not len(candidates) and not phrases and known and len(words) > 1:
+                candidates = np.unique(np.concatenate([docs for docs, _ in known]))
+            if mask is not None:
+                candidates = candidates[mask[candidates]]
+            if phrase_ids:
+                candidates = np.array([position for position in candidates.tolist()
+                                       if all(self._has_phrase(position, phrase) for phrase in phrase_ids)],
+                                      dtype=np.int32)
+
+        if not len(candidates):
+            return []
+        document_lengths = lengths[candidates]
+        normalization = K1 * (1 - B + B * document_lengths / max(lengths.mean(), 1.0))
+        scores = np.zeros(len(candidates))
+        for docs, frequencies in known:
+            idf = math.log(1 + (count - len(docs) + 0.5) / (len(docs) + 0.5))
+            index = np.minimum(np.searchsorted(docs, candidates), len(docs) - 1)
+            frequency = np.where(docs[index] == candidates, frequencies[index], 0)
+            scores += idf * frequency * (K1 + 1) / (frequency + normalization)
+        order = np.argsort(-scores, kind="stable")[:limit]
+        return [TextHit(card_id_list[candidates[index]], float(scores[index])) for index in order.tolist()]
+
+
+_text_index: Optional[TextIndex] = None
+_text_index_lock = threading.Lock()
+
+
+def get_text_index() -> TextIndex:
+    """
+    Get the process-wide text index over every card of the catalog, building it on first use.
+
+    :return:    The index.
+    """
+    global _text_index
+    if _text_index is None:
+        with _text_index_lock:
+            if _text_index is None:
+                from utils.catalog import get_catalog
+                catalog = get_catalog()
+                index = TextIndex()
+                # Listening first, so that the cards added while the catalog is read are indexed too
+                catalog.add_listener(index.add_cards)
+                index.add_cards(catalog)
+                _text_index = index
+    return _text_index
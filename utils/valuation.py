@@ -0,0 +1,319 @@
+import math
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from pokemontcgsdk import Card
+
+from utils.change_feed import user_lock
+from utils.storage import ensure_directory, get_user_path
+
+PRICES_DIR = "prices"
+TIMESTAMPS_FILE = "snapshots.f8"
+CARD_IDS_FILE = "cards.txt"
+SET_IDS_FILE = "sets.txt"
+CARD_SETS_FILE = "card_set.i4"  # Index in the set IDs of the set of each card ID
+SNAPSHOT_INTERVAL = 24 * 60 * 60  # Snapshot prices at most once a day unless asked to
+# One append-only file per column, one row per card whose quantity or price changed in a snapshot
+COLUMNS = {
+    "snapshot": np.int32,
+    "card": np.int32,
+    "quantity": np.int32,
+    "usd": np.float32,
+    "eur": np.float32,
+}
+SOURCES = {"usd": "TCGplayer market ($)", "eur": "Cardmarket trend (€)"}
+TCGPLAYER_VARIANTS = ["normal", "holofoil", "reverseHolofoil", "firstEditionHolofoil", "firstEditionNormal"]
+
+
+def card_prices(card: Card) -> Tuple[float, float]:
+    """
+    Get the market prices of a card.
+
+    Args:
+        card (Card): The card.
+
+    Returns:
+        Tuple[float, float]: The TCGplayer market price of the first available variant in dollars and the
+        Cardmarket trend price in euros, NaN when unknown.
+    """
+    usd = eur = math.nan
+    tcgplayer = getattr(card, "tcgplayer", None)
+    if tcgplayer and tcgplayer.prices:
+        for variant in TCGPLAYER_VARIANTS:
+            price = getattr(tcgplayer.prices, variant, None)
+            if price and (price.market or price.mid):
+                usd = price.market or price.mid
+                break
+    cardmarket = getattr(card, "cardmarket", None)
+    if cardmarket and cardmarket.prices:
+        eur = cardmarket.prices.trendPrice or cardmarket.prices.averageSellPrice or math.nan
+    return usd, eur
+
+
+def set_id_of(card_id: str) -> str:
+    """
+    Get the set ID from a card ID, e.g. `sv2` from `sv2-185`.
+
+    Args:
+        card_id (str): The card ID.
+
+    Returns:
+        str: The set ID.
+    """
+    return card_id.rsplit("-", 1)[0]
+
+
+class PriceHistory:
+    def __init__(self, path: str) -> None:
+        """
+        Append-only, columnar price history of a collection. Each snapshot only stores the cards whose quantity
+        or price changed since the previous one, and values at any snapshot are rebuilt with vectorized
+        NumPy operations. Sessions of the same user read and append under the user's lock, each appending session
+        reloads the history first, so that snapshots of two sessions never interleave.
+
+        :param path:    Directory holding the column files, in the user-specific data path.
+        """
+        self.path = path
+        self._reset()
+        if os.path.exists(self._file(TIMESTAMPS_FILE)):
+            # Loading may truncate an interrupted snapshot, which must not be one being appended by another session
+            with user_lock(os.path.dirname(self.path)):
+                self._load()
+
+    def _reset(self) -> None:
+        self.timestamps = np.zeros(0, dtype=np.float64)
+        self.card_ids: List[str] = []
+        self.card_index: Dict[str, int] = {}
+        self.set_ids: List[str] = []
+        self.set_index: Dict[str, int] = {}
+        self.card_sets = np.zeros(0, dtype=np.int32)
+        self.columns = {name: np.zeros(0, dtype=dtype) for name, dtype in COLUMNS.items()}
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _column_file(self, name: str) -> str:
+        # e.g. `usd.f4`, named after the dtype so the files are self-describing
+        return self._file(f"{name}.{np.dtype(COLUMNS[name]).str[1:]}")
+
+    def _read_lines(self, name: str) -> List[str]:
+        if not os.path.exists(self._file(name)):
+            return []
+        with open(self._file(name), encoding="utf-8") as f:
+            return f.read().split()
+
+    def _load(self) -> None:
+        if not os.path.exists(self._file(TIMESTAMPS_FILE)):
+            return
+        self.timestamps = np.fromfile(self._file(TIMESTAMPS_FILE), dtype=np.float64)
+        self.card_ids = self._read_lines(CARD_IDS_FILE)
+        self.set_ids = self._read_lines(SET_IDS_FILE)
+        if os.path.exists(self._file(CARD_SETS_FILE)):
+            self.card_sets = np.fromfile(self._file(CARD_SETS_FILE), dtype=np.int32)
+        if len(self.card_ids) > len(self.card_sets):
+            # The card IDs are written before their sets, drop the ones left behind by an interrupted snapshot
+            self.card_ids = self.card_ids[:len(self.card_sets)]
+            with open(self._file(CARD_IDS_FILE), "w", encoding="utf-8") as f:
+                f.write("".join(f"{card_id}\n" for card_id in self.card_ids))
+        self.card_index = {card_id: index for index, card_id in enumerate(self.card_ids)}
+        self.set_index = {set_id: index for index, set_id in enumerate(self.set_ids)}
+        columns = {name: np.fromfile(self._column_file(name), dtype=dtype)
+                   if os.path.exists(self._column_file(name)) else np.zeros(0, dtype=dtype)
+                   for name, dtype in COLUMNS.items()}
+        # Drop the rows of a snapshot that was interrupted before its timestamp was written, so that the next
+        # snapshot is appended right after the last committed one
+        rows = min(len(column) for column in columns.values())
+        rows = int(np.searchsorted(columns["snapshot"][:rows], len(self.timestamps)))
+        for name, column in columns.items():
+            if len(column) > rows:
+                os.truncate(self._column_file(name), rows * column.itemsize)
+        self.columns = {name: column[:rows] for name, column in columns.items()}
+
+    def __len__(self) -> int:
+        """
+        :return:    The number of snapshots.
+        """
+        return len(self.timestamps)
+
+    def is_stale(self, max_age: float = SNAPSHOT_INTERVAL) -> bool:
+        """
+        :param max_age:     Maximum age of the last snapshot, in seconds.
+        :return:            Whether there is no snapshot or the last one is older than `max_age`.
+        """
+        return not len(self) or time.time() - self.timestamps[-1] > max_age
+
+    def is_outdated(self) -> bool:
+        """
+        :return:    Whether snapshots were appended since this history was loaded, e.g. by another session.
+        """
+        try:
+            return os.path.getsize(self._file(TIMESTAMPS_FILE)) != self.timestamps.nbytes
+        except OSError:
+            return len(self) > 0
+
+    def latest_state(self, snapshot: int = -1) -> Dict[str, np.ndarray]:
+        """
+        Get the quantity and prices of every known card as of a snapshot.
+
+        :param snapshot:    Index of the snapshot, the latest one by default.
+        :return:            Dense arrays indexed like `card_ids`: quantity, usd and eur.
+        """
+        if snapshot < 0:
+            snapshot += len(self)
+        end = int(np.searchsorted(self.columns["snapshot"], snapshot, side="right"))
+        last_row = np.full(len(self.card_ids), -1, dtype=np.int64)
+        np.maximum.at(last_row, self.columns["card"][:end], np.arange(end))
+        known = last_row >= 0
+        state = {
+            "quantity": np.zeros(len(self.card_ids), dtype=np.int32),
+            "usd": np.full(len(self.card_ids), np.nan, dtype=np.float32),
+            "eur": np.full(len(self.card_ids), np.nan, dtype=np.float32),
+        }
+        for name, column in state.items():
+            column[known] = self.columns[name][last_row[known]]
+        return state
+
+    def append_snapshot(self, cards: Dict[str, Tuple[Card, int]], timestamp: Optional[float] = None) -> int:
+        """
+        Record the quantities and current prices of a collection.
+
+        :param cards:       Dictionary of card IDs to tuples of cards and quantities.
+        :param timestamp:   Time of the snapshot, now by default.
+        :return:            The number of cards whose quantity or price changed.
+        """
+        ensure_directory(self.path)
+        with user_lock(os.path.dirname(self.path)):
+            # Another session of the user may have appended since this history was loaded
+            self._reset()
+            self._load()
+            return self._append_snapshot(cards, timestamp)
+
+    def _append_snapshot(self, cards: Dict[str, Tuple[Card, int]], timestamp: Optional[float]) -> int:
+        previous = self.latest_state() if len(self) else None
+        new_ids = [card_id for card_id in cards if card_id not in self.card_index]
+        new_set_ids = []
+        new_card_sets = np.zeros(len(new_ids), dtype=np.int32)
+        for position, card_id in enumerate(new_ids):
+            self.card_index[card_id] = len(self.card_ids)
+            self.card_ids.append(card_id)
+            set_id = set_id_of(card_id)
+            if set_id not in self.set_index:
+                self.set_index[set_id] = len(self.set_ids)
+                self.set_ids.append(set_id)
+                new_set_ids.append(set_id)
+            new_card_sets[position] = self.set_index[set_id]
+
+        count = len(self.card_ids)
+        quantity = np.zeros(count, dtype=np.int32)
+        usd = np.full(count, np.nan, dtype=np.float32)
+        eur = np.full(count, np.nan, dtype=np.float32)
+        for card_id, (card, owned) in cards.items():
+            index = self.card_index[card_id]
+            quantity[index] = owned
+            usd[index], eur[index] = card_prices(card)
+
+        if previous is None:
+            changed = quantity > 0
+        else:
+            padding = count - len(previous["quantity"])
+            previous_quantity = np.pad(previous["quantity"], (0, padding))
+            previous_usd = np.pad(previous["usd"], (0, padding), constant_values=np.nan)
+            previous_eur = np.pad(previous["eur"], (0, padding), constant_values=np.nan)
+            # Cards that left the collection keep their last price so that they do not show up as changes
+            usd = np.where(quantity > 0, usd, previous_usd)
+            eur = np.where(quantity > 0, eur, previous_eur)
+            changed = ((quantity != previous_quantity)
+                       | ~np.isclose(usd, previous_usd, equal_nan=True)
+                       | ~np.isclose(eur, previous_eur, equal_nan=True))
+        rows = np.flatnonzero(changed).astype(np.int32)
+        new_columns = {
+            "snapshot": np.full(len(rows), len(self), dtype=np.int32),
+            "card": rows,
+            "quantity": quantity[rows],
+            "usd": usd[rows],
+            "eur": eur[rows],
+        }
+
+        if new_ids:
+            with open(self._file(CARD_IDS_FILE), "a", encoding="utf-8") as f:
+                f.write("".join(f"{card_id}\n" for card_id in new_ids))
+            with open(self._file(SET_IDS_FILE), "a", encoding="utf-8") as f:
+                f.write("".join(f"{set_id}\n" for set_id in new_set_ids))
+            with open(self._file(CARD_SETS_FILE), "ab") as f:
+                new_card_sets.tofile(f)
+            self.card_sets = np.concatenate([self.card_sets, new_card_sets])
+        for name in COLUMNS:
+            with open(self._column_file(name), "ab") as f:
+                new_columns[name].tofile(f)
+            self.columns[name] = np.concatenate([self.columns[name], new_columns[name]])
+        # The timestamp is written last, it commits the snapshot
+        timestamp = time.time() if timestamp is None else timestamp
+        with open(self._file(TIMESTAMPS_FILE), "ab") as f:
+            np.array([timestamp], dtype=np.float64).tofile(f)
+        self.timestamps = np.append(self.timestamps, timestamp)
+        return len(rows)
+
+    def value_over_time(self, source: str = "usd") -> np.ndarray:
+        """
+        Compute the total value of the collection at every snapshot.
+
+        :param source:  The price column to use, `usd` or `eur`.
+        :return:        The total value at each snapshot.
+        """
+        card, snapshot = self.columns["card"], self.columns["snapshot"]
+        values = self.columns["quantity"] * np.nan_to_num(self.columns[source]).astype(np.float64)
+        # Rows are in snapshot order, so a stable sort by card puts the successive values of each card in order
+        order = np.argsort(card, kind="stable")
+        sorted_values = values[order]
+        same_card = np.zeros(len(order), dtype=bool)
+        same_card[1:] = card[order][1:] == card[order][:-1]
+        previous_values = np.where(same_card, np.roll(sorted_values, 1), 0.0)
+        deltas = np.bincount(snapshot[order], weights=sorted_values - previous_values, minlength=len(self))
+        return np.cumsum(deltas)
+
+    def value_by_set(self, snapshot: int = -1, source: str = "usd") -> Dict[str, float]:
+        """
+        Compute the value of the collection per set at a snapshot.
+
+        :param snapshot:    Index of the snapshot, the latest one by default.
+        :param source:      The price column to use, `usd` or `eur`.
+        :return:            A dictionary of set IDs to values, highest first.
+        """
+        if not len(self):
+            return {}
+        state = self.latest_state(snapshot)
+        values = np.bincount(self.card_sets, weights=state["quantity"] * np.nan_to_num(state[source]),
+                             minlength=len(self.set_ids))
+        order = np.argsort(-values)
+        return {self.set_ids[i]: float(values[i]) for i in order if values[i] > 0}
+
+    def top_movers(self, count: int = 10, source: str = "usd") -> List[Tuple[str, float]]:
+        """
+        Get the cards whose held value changed the most between the last two snapshots.
+
+        :param count:   The number of cards to return.
+        :param source:  The price column to use, `usd` or `eur`.
+        :return:        A list of card IDs and value changes, largest absolute change first.
+        """
+        if len(self) < 2:
+            return []
+        before, after = self.latest_state(-2), self.latest_state(-1)
+        delta = (after["quantity"] * np.nan_to_num(after[source])
+                 - before["quantity"] * np.nan_to_num(before[source]))
+        order = np.argsort(-np.abs(delta))[:count]
+        return [(self.card_ids[i], float(delta[i])) for i in order if delta[i]]
+
+
+def load_price_history(name: str) -> PriceHistory:
+    """
+    Load the price history of a user's collection.
+
+    Args:
+        name (str): The user's name.
+
+    Returns:
+        PriceHistory: The price history, empty if no snapshot was taken yet.
+    """
+    return PriceHistory(os.path.join(get_user_path(name), PRICES_DIR))
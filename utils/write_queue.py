@@ -0,0 +1,141 @@
+import atexit
+import pickle
+import sys
+import threading
+from typing import Dict, Optional, Tuple
+
+from pokemontcgsdk import Card
+
+from utils.deck import Deck
+from utils.storage import commit_changes
+
+COMMIT_WINDOW = 0.25  # Seconds during which mutations are coalesced into a single storage write
+
+
+class WriteQueue:
+    def __init__(self, name: str) -> None:
+        """
+        Queue of the pending changes to a user's collection. Changes are applied to the session right away by the
+        caller and saved by a background timer once no new change arrived for a commit window, so that a burst of
+        clicks costs a single write of each file instead of one per click.
+
+        :param name:    The user's name.
+        """
+        self.name = name
+        self._cards: Dict[str, Tuple[Card, int]] = {}  # Card ID -> (card, quantity to add)
+        self._decks: Dict[str, Optional[Deck]] = {}  # Deck name -> deck to save, or None to remove it
+        self._lock = threading.Lock()
+        self._commit_lock = threading.Lock()  # Held while saving, so that batches are saved in order
+        self._timer: Optional[threading.Timer] = None
+
+    @property
+    def pending(self) -> bool:
+        """
+        :return:    Whether changes were queued or are being saved.
+        """
+        with self._lock:
+            return bool(self._cards or self._decks) or self._commit_lock.locked()
+
+    def add_cards(self, card: Card, quantity: int) -> None:
+        """
+        Queue adding copies of a card to the collection.
+
+        :param card:        The card.
+        :param quantity:    The number of copies to add, negative to remove copies.
+        """
+        with self._lock:
+            _, queued = self._cards.get(card.id, (card, 0))
+            self._cards[card.id] = (card, queued + quantity)
+            self._schedule()
+
+    def save_deck(self, deck: Deck) -> None:
+        """
+        Queue saving a deck.
+
+        :param deck:    The deck.
+        """
+        # Saved as of now, as the session keeps editing the deck while the timer pickles it
+        snapshot = pickle.loads(pickle.dumps(deck))
+        with self._lock:
+            self._decks[deck.name] = snapshot
+            self._schedule()
+
+    def remove_deck(self, deck_name: str) -> None:
+        """
+        Queue removing a deck.
+
+        :param deck_name:   The name of the deck.
+        """
+        with self._lock:
+            self._decks[deck_name] = None
+            self._schedule()
+
+    def flush(self) -> None:
+        """
+        Save the queued changes now, e.g. on logout. Raises the storage error if they could not be saved.
+        """
+        self._commit(raise_errors=True)
+
+    def _schedule(self) -> None:
+        # The window starts with the first change of a batch, later changes join it
+        if self._timer is None:
+            self._timer = threading.Timer(COMMIT_WINDOW, self._commit)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _commit(self, raise_errors: bool = False) -> None:
+        with self._commit_lock:
+            with self._lock:
+                cards, decks = self._cards, self._decks
+                self._cards, self._decks = {}, {}
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+            if not cards and not decks:
+                return
+            try:
+                commit_changes(cards, decks, self.name)
+            except Exception as e:
+                with self._lock:
+                    # Put the batch back in front of the changes queued since, and retry after a window
+                    for card_id, (card, quantity) in self._cards.items():
+                        _, failed = cards.get(card_id, (card, 0))
+                        cards[card_id] = (card, failed + quantity)
+                    decks.update(self._decks)
+                    self._cards, self._decks = cards, decks
+                    self._schedule()
+                if raise_errors:
+                    raise
+                print(f"Failed to save the collection of {self.name}: {e}", file=sys.stderr)
+
+
+_queues: Dict[str, WriteQueue] = {}
+_queues_lock = threading.Lock()
+
+
+def get_write_queue(name: str) -> WriteQueue:
+    """
+    Get the process-wide write queue of a user, shared by all of the user's sessions.
+
+    :param name:    The user's name.
+    :return:        The write queue.
+    """
+    with _queues_lock:
+        queue = _queues.get(name)
+        if queue is None:
+            queue = _queues[name] = WriteQueue(name)
+        return queue
+
+
+@atexit.register
+def flush_all() -> None:
+    """
+    Save the queued changes of every user, called on shutdown.
+    """
+    with _queues_lock:
+        queues = list(_queues.values())
+    for queue in queues:
+        try:
+            queue.flush()
+        except Exception as e:
+            print(f"Failed to save the collection of {queue.name}: {e}", file=sys.stderr)